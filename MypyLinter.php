@@ -6,6 +6,7 @@ final class MypyLinter extends ArcanistLinter {
   private $paths_to_lint = array();
   private $errors_to_show = array();
   private $printed_mypy_server_error = false;
+  private $timed_out_paths = array();
   private $config = null;
 
   private function getConfig() {
@@ -29,24 +30,74 @@ final class MypyLinter extends ArcanistLinter {
     return array(
       'typecheck_error' => 'Typecheck error',
       'mypy_missing' => 'Mypy not found',
+      'mypy_timeout' => 'Mypy timed out',
       'missing_mypy_annotation' => 'Please add a mypy annotation!',
     );
   }
 
-  private function checkMypyAnnotations() {
-    exec("check_mypy_annotations.py master", $output);
-    foreach ($output as $line) {
-      if (array_key_exists($line, $this->seen_errors)) {
-        continue;
+  /**
+   * Makes a GET request to the mypy server and returns [content, HTTP code],
+   * with content FALSE if the server can't be reached. Goes through the
+   * unix socket when the server was started with --unix-socket.
+   */
+  private function requestFromServer($path) {
+    $socketPath = join(DIRECTORY_SEPARATOR, array($this->getProjectRoot(), '.mypy_server.sock'));
+    if (defined('CURLOPT_UNIX_SOCKET_PATH') && file_exists($socketPath)) {
+      $result = $this->curlGet("http://localhost$path", $socketPath);
+      if ($result[0] !== FALSE) {
+        return $result;
       }
+      // The socket may be left over from a server that's gone.
+    }
+    $port = $this->getConfig()['port'];
+    return $this->curlGet("http://localhost:$port$path", null);
+  }
 
-      $filename = null;
-      $lineNumber = null;
+  private function curlGet($url, $socketPath) {
+    $ch = curl_init();
+    curl_setopt($ch, CURLOPT_URL, $url);
+    curl_setopt($ch, CURLOPT_RETURNTRANSFER, 1);
+    if ($socketPath !== null) {
+      curl_setopt($ch, CURLOPT_UNIX_SOCKET_PATH, $socketPath);
+    }
+    $content = curl_exec($ch);
+    $httpCode = curl_getinfo($ch, CURLINFO_HTTP_CODE);
+    curl_close($ch);
+    return array($content, $httpCode);
+  }
 
+  /**
+   * Returns [filename, line] pairs for functions touched since master that
+   * are missing annotations. Asks the mypy server first since it keeps the
+   * files parsed, and falls back to running check_mypy_annotations.py.
+   */
+  private function getMissingAnnotations() {
+    list($content, $httpCode) = $this->requestFromServer('/annotations?rev=master');
+
+    $missing = array();
+    if ($content !== FALSE && $httpCode === 200) {
+      foreach (json_decode($content, true) as $entry) {
+        $missing[] = array($entry['path'], $entry['line']);
+      }
+      return $missing;
+    }
+
+    exec("check_mypy_annotations.py master", $output);
+    foreach ($output as $line) {
       $matches = array();
       if (preg_match('/^(.+):(\d+) Please add a mypy annotation!$/', $line, $matches) === 1) {
-        $filename = $matches[1];
-        $lineNumber = $matches[2];
+        $missing[] = array($matches[1], $matches[2]);
+      }
+    }
+    return $missing;
+  }
+
+  private function checkMypyAnnotations() {
+    foreach ($this->getMissingAnnotations() as $entry) {
+      list($filename, $lineNumber) = $entry;
+      $line = "$filename:$lineNumber Please add a mypy annotation!";
+      if (array_key_exists($line, $this->seen_errors)) {
+        continue;
       }
 
       if (array_key_exists($filename, $this->errors_to_show)) {
@@ -94,6 +145,20 @@ final class MypyLinter extends ArcanistLinter {
     return false;
   }
 
+  private function getSrcDirFlags($absPath) {
+    // Mirrors the server: the longest matching src dir's extra flags win.
+    $flags = array();
+    $longestMatch = -1;
+    foreach ($this->getConfig()['src_dirs'] as $src_dir) {
+      $dir = join(DIRECTORY_SEPARATOR, array($this->getProjectRoot(), $src_dir['path'], ''));
+      if (0 === strpos($absPath, $dir) && strlen($dir) > $longestMatch) {
+        $longestMatch = strlen($dir);
+        $flags = isset($src_dir['flags']) ? $src_dir['flags'] : array();
+      }
+    }
+    return join(' ', $flags);
+  }
+
   public function getMissingMypyOutput($absPath) {
     $mypy_path_parts = array_map(function($part) {
       return join(DIRECTORY_SEPARATOR, array($this->getProjectRoot(), $part));
@@ -106,25 +171,49 @@ final class MypyLinter extends ArcanistLinter {
     }
 
     $flags = join(' ', $this->getConfig()['global_flags']);
-    exec("MYPYPATH=$mypy_path mypy $flags $strictOptional $absPath 2>&1", $output);
+    $srcDirFlags = $this->getSrcDirFlags($absPath);
+    exec("MYPYPATH=$mypy_path mypy $flags $srcDirFlags $strictOptional $absPath 2>&1", $output);
     return $output;
   }
 
-  public function getMypyOutput($absPath) {
-    $output = array();
-    $fileNameHash = md5($absPath);
-    $fileContentHash = md5(file_get_contents($absPath));
-    $port = $this->getConfig()['port'];
-    $url = "http://localhost:$port/file/$fileNameHash/$fileContentHash";
+  private function parseMypyOutput($output) {
+    // Only used when we had to run mypy ourselves; the server hands back
+    // diagnostics that are already parsed.
+    $diagnostics = array();
+    foreach ($output as $line) {
+      $matches = array();
+      if (preg_match('/^(.+?):(\d+):(?:(\d+):)?\s(error|warning|note):\s(.*?)(?:\s\s\[([a-z0-9\-]+)\])?$/', $line, $matches) !== 1) {
+        continue;
+      }
+      $diagnostics[] = array(
+        'path' => $matches[1],
+        'line' => (int)$matches[2],
+        'column' => $matches[3] === '' ? null : (int)$matches[3],
+        'severity' => $matches[4],
+        'code' => isset($matches[6]) ? $matches[6] : null,
+        'message' => $matches[5],
+      );
+    }
+    return $diagnostics;
+  }
 
-    $ch = curl_init();
-    curl_setopt($ch, CURLOPT_URL, $url);
-    curl_setopt($ch, CURLOPT_RETURNTRANSFER, 1);
-    $content = curl_exec($ch);
+  private function getMissingMypyDiagnostics($absPath) {
+    $output = $this->getMissingMypyOutput($absPath);
+    if (count($output) > 0 && preg_match('/command not found/', $output[0]) === 1) {
+      return null;
+    }
+    return $this->parseMypyOutput($output);
+  }
 
-    if ($content === FALSE) {
-      curl_close($ch);
+  /**
+   * Returns the diagnostics for a path as a list of arrays with path, line,
+   * column, severity, code and message keys, or null if mypy is missing.
+   */
+  public function getMypyDiagnostics($absPath) {
+    // The server hashes the file itself, and only when it has changed.
+    list($content, $httpCode) = $this->requestFromServer('/v1/path?path='.urlencode($absPath));
 
+    if ($content === FALSE) {
       if (!$this->printed_mypy_server_error) {
         $msg = "
 \033[1mWARNING\033[0m: It looks like you're not running the mypy server.  Doing so
@@ -134,19 +223,21 @@ final class MypyLinter extends ArcanistLinter {
         $this->printed_mypy_server_error = true;
       }
 
-      return $this->getMissingMypyOutput($absPath);
+      return $this->getMissingMypyDiagnostics($absPath);
+    }
+
+    if ($httpCode === 504) {
+      // Running mypy here would most likely take just as long.
+      $this->timed_out_paths[$absPath] = true;
+      return array();
     }
 
-    $httpCode = curl_getinfo($ch, CURLINFO_HTTP_CODE);
-    curl_close($ch);
     if ($httpCode !== 200) {
-      return $this->getMissingMypyOutput($absPath);
+      return $this->getMissingMypyDiagnostics($absPath);
     }
 
-    $obj = json_decode($content);
-    $output_str = $obj->output;
-    $output = explode("\n", $output_str);
-    return $output;
+    $result = json_decode($content, true);
+    return $result['diagnostics'];
   }
 
   /**
@@ -162,16 +253,19 @@ final class MypyLinter extends ArcanistLinter {
    * @task exec
    */
   public function lintPath($path) {
-    $output = array();
     $absPath = join(DIRECTORY_SEPARATOR, array($this->getProjectRoot(), $path));
 
-    $output = $this->getMypyOutput($absPath);
+    $diagnostics = $this->getMypyDiagnostics($absPath);
 
-    if (count($output) > 0 && preg_match('/command not found/', $output[0]) === 1) {
+    if ($diagnostics === null) {
       $this->raiseLintAtPath('mypy_missing', 'Please install mypy first! See: http://mypy.readthedocs.io/en/latest/getting_started.html#installation');
       return;
     }
 
+    if (array_key_exists($absPath, $this->timed_out_paths)) {
+      $this->raiseLintAtPath('mypy_timeout', 'The mypy server timed out checking this file.');
+    }
+
     if (array_key_exists($absPath, $this->errors_to_show)) {
       foreach ($this->errors_to_show[$absPath] as $entry) {
         $errorType = $entry[0];
@@ -181,25 +275,21 @@ final class MypyLinter extends ArcanistLinter {
       }
     }
 
-    foreach ($output as $line) {
-      if (array_key_exists($line, $this->seen_errors)) {
+    foreach ($diagnostics as $diagnostic) {
+      if ($diagnostic['severity'] !== 'error') {
         continue;
       }
 
-      $filename = null;
-      $lineNumber = null;
-
-      $matches = array();
-      if (preg_match('/(.+):(\d+):\serror:\s(.*)$/', $line, $matches) === 1) {
-        $filename = $matches[1];
-        $lineNumber = $matches[2];
-        $error = $matches[3];
-      } else {
+      $filename = $diagnostic['path'];
+      $lineNumber = $diagnostic['line'];
+      $error = $diagnostic['message'];
+      $line = "$filename:$lineNumber: error: $error";
+      if (array_key_exists($line, $this->seen_errors)) {
         continue;
       }
 
       if ($filename === $this->getActivePath()) {
-        $this->raiseLintAtLine($lineNumber, null, 'typecheck_error', $error);
+        $this->raiseLintAtLine($lineNumber, $diagnostic['column'], 'typecheck_error', $error);
       } else if (array_key_exists($filename, $this->paths_to_lint)) {
         // We're going to revisit this error later when we lint the file where
         // actual the error occurs. We want to show the error with more context
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+""" Times check_mypy_annotations on a large synthetic branch.
+
+Generates a git repository with `--files` modules of `--functions`
+functions each, commits it, then appends an unannotated function to every
+module and adds a few lines to the middle of each existing function.
+`legacy` is how the script used to work: a `git diff | grep | cut`
+pipeline per file plus two more git calls to list them, and a map from
+every line of the file to its function. `current` is check_annotations,
+serially and with a process pool, parsing every file. `warm cache` loads
+a source cache that already indexes every file, like print_mypy_coverage.py
+or mypy_server.py leave behind.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import ast
+import io
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+from typing import Any, Dict, List, Optional, Set  # noqa
+
+from bin.check_mypy_annotations import check_annotations
+from mypytools import source_utils
+from mypytools.source_cache import SOURCE_CACHE_FILENAME, SourceCache
+
+UNIFIED_DIFF_REGEX = re.compile(r'^(\d+)(,(\d+))?$')
+
+
+def legacy_visit_node(root, line_to_func_map):
+    # type: (ast.AST, Dict[int, Optional[ast.FunctionDef]]) -> None
+    active_function = None  # type: Optional[ast.FunctionDef]
+    to_visit = [(root, active_function)]
+    while len(to_visit) > 0:
+        curr_node, active_function = to_visit.pop()
+        for child_node in ast.iter_child_nodes(curr_node):
+            if not getattr(child_node, 'lineno', None):
+                continue
+            if isinstance(child_node, ast.FunctionDef):
+                line_to_func_map[child_node.lineno] = child_node
+                to_visit.append((child_node, child_node))
+            else:
+                line_to_func_map[child_node.lineno] = active_function   # type: ignore
+                to_visit.append((child_node, active_function))
+
+
+def legacy_fill_line_to_func_gaps(line_to_func_map, num_lines):
+    # type: (Dict[int, Optional[ast.FunctionDef]], int) -> None
+    active_function = None
+    curr_line = 1
+    for line_num in sorted(line_to_func_map):
+        for missing_line_num in range(curr_line, line_num):
+            line_to_func_map[missing_line_num] = active_function
+        active_function = line_to_func_map[line_num]
+        curr_line = line_num
+
+    if len(line_to_func_map) == 0:
+        curr_line = 0
+    for line_num in range(curr_line + 1, num_lines + 1):
+        line_to_func_map[line_num] = active_function
+
+
+def legacy_process_source(lines, added_lines, line_to_func_map):
+    # type: (List[str], Set[int], Dict[int, Optional[ast.FunctionDef]]) -> List[int]
+    results = []    # type: List[int]
+    printed_funcs = set()   # type: Set[ast.FunctionDef]
+    for line_num in sorted(added_lines):
+        func_def = line_to_func_map[line_num]
+        if func_def is None or func_def in printed_funcs:
+            continue
+        if source_utils.is_func_def_annotated(func_def, lines):
+            continue
+        results.append(source_utils.find_first_line_of_func(lines, func_def.lineno))
+        printed_funcs.add(func_def)
+    return results
+
+
+def legacy_get_added_lines(filename, rev):
+    # type: (str, str) -> Set[int]
+    added_lines = subprocess.check_output(
+        "git diff --unified=0 {} {} | grep @@ | cut -d'+' -f2 | cut -f1 -d' '".format(rev, filename),
+        universal_newlines=True, shell=True).split('\n')
+    results = set()
+    for line in added_lines:
+        result = UNIFIED_DIFF_REGEX.match(line)
+        if result is None:
+            continue
+        groups = result.groups()
+        start = int(groups[0])
+        if groups[2] is None:
+            results.add(start)
+        else:
+            for i in range(int(groups[2])):
+                results.add(start + i)
+    return results
+
+
+def legacy_get_modified_files(rev):
+    # type: (str) -> List[str]
+    relative_paths = subprocess.check_output(
+        "git diff --name-only {}".format(rev), shell=True, universal_newlines=True).split('\n')[0:-1]
+    repo_root = subprocess.check_output(
+        "git rev-parse --show-toplevel", shell=True, universal_newlines=True).split('\n')[0]
+    python_paths = []
+    for path in relative_paths:
+        abs_path = os.path.join(repo_root, path)
+        if path.endswith('.py'):
+            python_paths.append(abs_path)
+            continue
+        try:
+            with open(abs_path, 'r') as f:
+                first_line = f.readline().rstrip('\n')
+                if first_line.startswith('#!') and first_line.endswith('python'):
+                    python_paths.append(abs_path)
+        except IOError:
+            continue
+    return python_paths
+
+
+def legacy_check_annotations(rev):
+    # type: (str) -> List[str]
+    output = []
+    for filename in legacy_get_modified_files(rev):
+        with open(filename, 'r') as f:
+            source = f.read()
+        line_to_func_map = {}   # type: Dict[int, Optional[ast.FunctionDef]]
+        lines, tree = source_utils.parse_source(source)
+        added_lines = legacy_get_added_lines(filename, rev)
+        legacy_visit_node(tree, line_to_func_map)
+        legacy_fill_line_to_func_gaps(line_to_func_map, len(lines))
+        for line_num in legacy_process_source(lines, added_lines, line_to_func_map):
+            output.append('{}:{} Please add a mypy annotation!'.format(filename, line_num))
+    return output
+
+
+def function_source(name, num_body_lines):
+    # type: (str, int) -> List[str]
+    lines = ['def {}(x):'.format(name), '    # type: (int) -> int']
+    lines.extend('    x += {}'.format(i) for i in range(num_body_lines))
+    lines.extend(['    return x', '', ''])
+    return lines
+
+
+def generate_repo(root, num_files, num_functions):
+    # type: (str, int, int) -> None
+    def git(*args):
+        # type: (*str) -> None
+        subprocess.check_call(['git', '-c', 'user.name=bench', '-c', 'user.email=bench@example.com'] + list(args),
+                              cwd=root, stdout=subprocess.PIPE)
+
+    def write_modules(edited):
+        # type: (bool) -> None
+        for i in range(num_files):
+            # Every module is different, or a cache by content would only parse one.
+            lines = ['MODULE = {}'.format(i), '']   # type: List[str]
+            for j in range(num_functions):
+                body = function_source('func{}'.format(j), 20)
+                if edited:
+                    body[10:10] = ['    x -= 1', '    x -= 2']
+                lines.extend(body)
+            if edited:
+                lines.extend(['def unannotated(x):', '    return x', ''])
+            with open(os.path.join(root, 'mod{}.py'.format(i)), 'w') as f:
+                f.write('\n'.join(lines))
+
+    git('init', '-q')
+    write_modules(edited=False)
+    git('add', '.')
+    git('commit', '-q', '-m', 'base')
+    write_modules(edited=True)
+
+
+@click.command()
+@click.option('--files', default=300)
+@click.option('--functions', default=50)
+@click.option('--jobs', default=None, type=int)
+def main(files, functions, jobs):
+    # type: (int, int, Optional[int]) -> None
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        generate_repo(root, files, functions)
+        os.chdir(root)
+
+        start = time.time()
+        legacy_output = legacy_check_annotations('HEAD')
+        print('{:<16} {:8.2f}s'.format('legacy', time.time() - start))
+
+        cache_path = os.path.join(root, SOURCE_CACHE_FILENAME)
+        source_cache = SourceCache(cache_path)
+        for filename in os.listdir(root):
+            if filename.endswith('.py'):
+                source_cache.parse_file(os.path.join(root, filename))
+        source_cache.save()
+        runs = [
+            ('current serial', 1, lambda: SourceCache()),
+            ('current pool', jobs, lambda: SourceCache()),
+            ('warm cache', jobs, lambda: SourceCache.load(cache_path)),
+        ]
+        for name, num_jobs, make_cache in runs:
+            output = io.StringIO() if sys.version_info[0] > 2 else io.BytesIO()
+            stdout = sys.stdout
+            sys.stdout = output
+            start = time.time()
+            try:
+                check_annotations('HEAD', num_jobs, make_cache())
+            finally:
+                sys.stdout = stdout
+            print('{:<16} {:8.2f}s'.format(name, time.time() - start))
+            assert sorted(output.getvalue().splitlines()) == sorted(legacy_output)
+        print('{} files, {} annotation errors'.format(files, len(legacy_output)))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
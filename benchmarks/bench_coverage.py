@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+""" Times print_mypy_coverage on a synthetic repository.
+
+`tree` inserts `--files` synthetic results into a directory tree `--depth`
+levels deep with `--fanout` subdirectories each. `legacy` is how print_mypy_coverage used to do it, re-summing
+every ancestor's children after each insert, and `aggregate` adds the
+leaves and sums the tree once at the end. `scan` writes `--scan-files`
+modules to disk and times scanning them serially and with a process pool,
+then with the coverage cache: `cold` starts from an empty cache and `warm`
+reruns after `--changed` files were edited.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import time
+
+import click
+from typing import List, Optional, Tuple  # noqa
+
+from bin.print_mypy_coverage import SourceObj, add_new_leaf_node, cache_version, scan_files, scan_files_cached
+from mypytools.coverage_cache import CoverageCache
+
+
+class LegacySourceObj(SourceObj):
+    def add_child(self, child):
+        # type: (SourceObj) -> None
+        super(LegacySourceObj, self).add_child(child)
+        self.refresh()
+
+    def refresh(self):
+        # type: () -> None
+        if len(self.children) > 0:
+            self.num_annotated_funcs = 0
+            self.num_scanned_funcs = 0
+            for child in self.children.values():
+                self.num_annotated_funcs += child.num_annotated_funcs
+                self.num_scanned_funcs += child.num_scanned_funcs
+        if self.parent:
+            self.parent.refresh()   # type: ignore
+
+
+def legacy_add_new_leaf_node(root, path, num_annotated_funcs, num_scanned_funcs):
+    # type: (LegacySourceObj, str, int, int) -> None
+    curr = root
+    for part in path.split('/'):
+        next_dir = curr.children.get(part)
+        if next_dir is None:
+            next_dir = LegacySourceObj(part)
+            curr.add_child(next_dir)
+        curr = next_dir     # type: ignore
+    curr.num_annotated_funcs = num_annotated_funcs
+    curr.num_scanned_funcs = num_scanned_funcs
+    curr.refresh()
+
+
+def synthetic_paths(num_files, depth, fanout=10):
+    # type: (int, int, int) -> List[str]
+    paths = []
+    for i in range(num_files):
+        parts = []
+        n = i // fanout
+        for _ in range(depth):
+            parts.append('d{}'.format(n % fanout))
+            n //= fanout
+        parts.append('mod{}.py'.format(i))
+        paths.append('/'.join(parts))
+    return paths
+
+
+def time_tree(paths):
+    # type: (List[str]) -> None
+    results = [(path, i % 3, 3) for i, path in enumerate(paths)]
+
+    start = time.time()
+    legacy_root = LegacySourceObj('root')
+    for path, num_annotated_funcs, num_scanned_funcs in results:
+        legacy_add_new_leaf_node(legacy_root, path, num_annotated_funcs, num_scanned_funcs)
+    print('{:<16} {:8.2f}s'.format('tree legacy', time.time() - start))
+
+    start = time.time()
+    root = SourceObj('root')
+    for path, num_annotated_funcs, num_scanned_funcs in results:
+        add_new_leaf_node(root, path, num_annotated_funcs, num_scanned_funcs)
+    root.aggregate()
+    print('{:<16} {:8.2f}s'.format('tree aggregate', time.time() - start))
+    assert (root.num_annotated_funcs, root.num_scanned_funcs) == \
+        (legacy_root.num_annotated_funcs, legacy_root.num_scanned_funcs)
+
+
+def time_scan(num_files, num_changed, jobs):
+    # type: (int, int, Optional[int]) -> None
+    root = tempfile.mkdtemp()
+    try:
+        paths = []
+        for i in range(num_files):
+            path = os.path.join(root, 'mod{}.py'.format(i))
+            with open(path, 'w') as f:
+                for j in range(20):
+                    f.write('def func{}(x):\n    # type: (int) -> int\n    return x\n\n\n'.format(j))
+            # As if the files were checked out a while ago.
+            os.utime(path, (time.time() - 3600, time.time() - 3600))
+            paths.append(path)
+
+        for name, num_jobs in [('scan serial', 1), ('scan pool', jobs)]:
+            start = time.time()
+            for _ in scan_files(paths, num_jobs):
+                pass
+            print('{:<16} {:8.2f}s'.format(name, time.time() - start))
+
+        cache_path = os.path.join(root, '.mypy_coverage_cache')
+        for name in ('cache cold', 'cache warm'):
+            start = time.time()
+            cache = CoverageCache.load(cache_path, cache_version())
+            for _ in scan_files_cached(paths, cache, jobs):
+                pass
+            cache.save()
+            print('{:<16} {:8.2f}s'.format(name, time.time() - start))
+            for path in paths[:num_changed]:
+                with open(path, 'a') as f:
+                    f.write('def changed(x):\n    return x\n')
+    finally:
+        shutil.rmtree(root)
+
+
+@click.command()
+@click.option('--files', default=50000)
+@click.option('--depth', default=2)
+@click.option('--fanout', default=50, help='Subdirectories per directory.')
+@click.option('--scan-files', default=2000)
+@click.option('--changed', default=20, help='Files to edit between the cold and warm cache runs.')
+@click.option('--jobs', default=None, type=int)
+def main(files, depth, fanout, scan_files, changed, jobs):
+    # type: (int, int, int, int, int, Optional[int]) -> None
+    time_tree(synthetic_paths(files, depth, fanout))
+    time_scan(scan_files, changed, jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+""" Load tests the HTTP API the way a shared server gets used.
+
+Writes `--files` synthetic source files to a temporary project, fills a
+MypyFileCache with results for `--hit-ratio` of them, and serves it like
+mypy_server.py does. `--concurrency` clients then send `--requests`
+lookups between them, each over a new connection like the arcanist
+linter's curl calls, and the throughput and latency percentiles are
+printed. Most files have no errors and a few have many, so cached results
+range from empty to `--max-errors` diagnostics.
+
+`--endpoint` picks what the clients ask for: `file` looks results up by
+file name and content hashes, `path` by path with /v1/path, and `check`
+posts `--batch` paths at a time to /v1/check like mypy_client.py does.
+Requests the server refuses are counted by the error raised. Pass
+`--max-p99-ms` to exit with an error when the p99 latency is higher or
+any requests fail, e.g. to catch regressions in CI.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter
+from threading import Lock, Thread
+
+import click
+from typing import List, Tuple  # noqa
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode  # type: ignore
+
+from benchmarks.bench_http_transport import percentile
+from mypytools.server.mypy_diagnostics import Diagnostic, format_diagnostic
+from mypytools.server.mypy_file_cache import MypyFileCache
+from mypytools.server.mypy_fingerprints import fingerprint_cache
+from mypytools.server.mypy_http_client import MypyServerClient
+from mypytools.server.mypy_http_request_handler import HTTP_SOCKET_FILENAME, HttpServerThread
+
+MESSAGES = [
+    'Incompatible types in assignment (expression has type "str", variable has type "int")',
+    'Argument 1 to "get" of "Session" has incompatible type "Optional[str]"; expected "str"',
+    'Item "None" of "Optional[User]" has no attribute "email"',
+    'Name "request" is not defined',
+]
+
+
+def make_diagnostics(rand, path, max_errors):
+    # type: (random.Random, str, int) -> List[Diagnostic]
+    """ None for most files, and a long tail of files with many. """
+    if rand.random() < 0.6:
+        return []
+    count = min(max_errors, int(rand.paretovariate(1.0)))
+    return [Diagnostic(path, rand.randint(1, 2000), None, 'error', None, rand.choice(MESSAGES))
+            for _ in range(count)]
+
+
+def make_project(root, files, hit_ratio, max_errors, seed):
+    # type: (str, int, float, int, int) -> Tuple[MypyFileCache, List[Tuple[str, str]]]
+    """ The cache of results and each file's path and content hash. """
+    rand = random.Random(seed)
+    file_cache = MypyFileCache()
+    hashes = []     # type: List[Tuple[str, str]]
+    for i in range(files):
+        path = os.path.join(root, 'src', 'module_{}.py'.format(i))
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('x = {}\n'.format(i))
+        file_hash = fingerprint_cache.get(path)
+        hashes.append((path, file_hash))
+        if rand.random() < hit_ratio:
+            diagnostics = make_diagnostics(rand, path, max_errors)
+            output = '\n'.join(format_diagnostic(diagnostic) for diagnostic in diagnostics)
+            file_cache.store(path, file_hash, output, diagnostics)
+    return file_cache, hashes
+
+
+def make_requests(rand, hashes, endpoint, requests, batch):
+    # type: (random.Random, List[Tuple[str, str]], str, int, int) -> List[Tuple[str, str, bytes]]
+    chosen = [rand.choice(hashes) for _ in range(requests)]
+    if endpoint == 'file':
+        return [('GET', '/v1/file/{}/{}'.format(hashlib.md5(path.encode('utf-8')).hexdigest(), file_hash), b'')
+                for path, file_hash in chosen]
+    if endpoint == 'path':
+        return [('GET', '/v1/path?' + urlencode({'path': path}), b'') for path, _ in chosen]
+    return [('POST', '/v1/check', json.dumps({'paths': [path for path, _ in rand.sample(hashes, batch)]}).encode('utf-8'))
+            for _ in range(requests)]
+
+
+@click.command()
+@click.option('--files', default=5000, help='Source files in the project.')
+@click.option('--hit-ratio', default=0.9, help='Fraction of the files with cached results.')
+@click.option('--max-errors', default=200, help='Most diagnostics in one cached result.')
+@click.option('--requests', default=5000)
+@click.option('--concurrency', default=8, help='Clients sending requests at once.')
+@click.option('--endpoint', type=click.Choice(['file', 'path', 'check']), default='path')
+@click.option('--batch', default=10, help='Paths in each /v1/check request.')
+@click.option('--transport', type=click.Choice(['tcp', 'unix']), default='unix')
+@click.option('--seed', default=0)
+@click.option('--max-p99-ms', type=float, default=None)
+def main(files, hit_ratio, max_errors, requests, concurrency, endpoint, batch, transport, seed, max_p99_ms):
+    # type: (int, float, int, int, int, str, int, str, int, float) -> None
+    root = tempfile.mkdtemp()
+    # The tcp clients get a root without the socket in it.
+    client_root = root if transport == 'unix' else tempfile.mkdtemp()
+    file_cache, hashes = make_project(root, files, hit_ratio, max_errors, seed)
+    work = make_requests(random.Random(seed), hashes, endpoint, requests, min(batch, files))
+
+    if transport == 'unix':
+        thread = HttpServerThread(file_cache, address=os.path.join(root, HTTP_SOCKET_FILENAME), root_dir=root)
+    else:
+        thread = HttpServerThread(file_cache, address=('127.0.0.1', 0), root_dir=root)
+    thread.start()
+    thread.ready.wait()
+    port = None if transport == 'unix' else thread.server_address[1]
+
+    latencies = []  # type: List[float]
+    statuses = Counter()    # type: Counter
+    lock = Lock()
+
+    def run_client(requests):
+        # type: (List[Tuple[str, str, bytes]]) -> None
+        client = MypyServerClient(client_root, port)
+        client_latencies = []   # type: List[float]
+        client_statuses = Counter()     # type: Counter
+        for method, path, body in requests:
+            start = time.time()
+            try:
+                status = client.request(method, path, body or None)[0]  # type: object
+            except socket.error as e:
+                status = type(e).__name__
+            client_latencies.append(time.time() - start)
+            client_statuses[status] += 1
+        with lock:
+            latencies.extend(client_latencies)
+            statuses.update(client_statuses)
+
+    clients = [Thread(target=run_client, args=(work[i::concurrency],)) for i in range(concurrency)]
+    try:
+        start = time.time()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.time() - start
+    finally:
+        thread.stop()
+        shutil.rmtree(root)
+        if client_root != root:
+            shutil.rmtree(client_root)
+
+    latencies.sort()
+    print('{} {} requests from {} clients over {}: {:.0f} req/s'.format(
+        requests, endpoint, concurrency, transport, requests / elapsed))
+    print('p50 {:.2f}ms  p95 {:.2f}ms  p99 {:.2f}ms  max {:.2f}ms'.format(
+        1e3 * percentile(latencies, 0.5), 1e3 * percentile(latencies, 0.95),
+        1e3 * percentile(latencies, 0.99), 1e3 * latencies[-1]))
+    print('responses: {}'.format(', '.join('{} x{}'.format(status, count)
+                                           for status, count in sorted(statuses.items(), key=str))))
+    p99_ms = 1e3 * percentile(latencies, 0.99)
+    failed = sum(count for status, count in statuses.items() if not isinstance(status, int))
+    if max_p99_ms is not None and (p99_ms > max_p99_ms or failed > 0):
+        print('Load test failed: p99 {:.2f}ms (max {}ms), {} failed requests'.format(p99_ms, max_p99_ms, failed))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
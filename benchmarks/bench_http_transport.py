@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+""" Compares result lookup latency over TCP and the unix socket.
+
+Serves a MypyFileCache holding one file's diagnostics on 127.0.0.1 and on
+a unix socket, then times `--requests` lookups of it through each with
+MypyServerClient. Every request opens a new connection, like the arcanist
+linter's curl calls do.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+import click
+from typing import List  # noqa
+
+from mypytools.server.mypy_diagnostics import Diagnostic
+from mypytools.server.mypy_file_cache import MypyFileCache
+from mypytools.server.mypy_http_client import MypyServerClient
+from mypytools.server.mypy_http_request_handler import HTTP_SOCKET_FILENAME, HttpServerThread
+
+FILENAME = '/project/app/models/user.py'
+
+
+def percentile(sorted_values, fraction):
+    # type: (List[float], float) -> float
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+@click.command()
+@click.option('--requests', default=2000)
+@click.option('--errors', default=20, help='Diagnostics in the cached result.')
+def main(requests, errors):
+    # type: (int, int) -> None
+    root = tempfile.mkdtemp()
+    # The tcp client gets a root without the socket in it.
+    tcp_root = tempfile.mkdtemp()
+    file_cache = MypyFileCache()
+    diagnostics = [Diagnostic(FILENAME, line, None, 'error', None, 'Incompatible types in assignment')
+                   for line in range(errors)]
+    file_cache.store(FILENAME, 'f00', '', diagnostics)
+    path = '/v1/file/{}/f00'.format(hashlib.md5(FILENAME.encode('utf-8')).hexdigest())
+
+    threads = [HttpServerThread(file_cache, address=('127.0.0.1', 0), root_dir=root),
+               HttpServerThread(file_cache, address=os.path.join(root, HTTP_SOCKET_FILENAME), root_dir=root)]
+    for thread in threads:
+        thread.start()
+        thread.ready.wait()
+    tcp_thread, unix_thread = threads
+    try:
+        clients = [('tcp', MypyServerClient(tcp_root, tcp_thread.server_address[1])),
+                   ('unix', MypyServerClient(root, None))]
+        for name, client in clients:
+            assert client.get(path)[0] == 200
+            latencies = []  # type: List[float]
+            for _ in range(requests):
+                start = time.time()
+                client.get(path)
+                latencies.append(time.time() - start)
+            latencies.sort()
+            print('{:<5} mean {:7.1f}us  p50 {:7.1f}us  p99 {:7.1f}us'.format(
+                name, 1e6 * sum(latencies) / len(latencies), 1e6 * percentile(latencies, 0.5),
+                1e6 * percentile(latencies, 0.99)))
+    finally:
+        for thread in threads:
+            thread.stop()
+        shutil.rmtree(root)
+        shutil.rmtree(tcp_root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+""" Tracks how long the command line tools take to import.
+
+Each module is imported in a fresh interpreter with `-X importtime` and
+the cumulative time of the module itself is reported, along with the
+slowest imports it pulled in. Pass `--max-ms` to exit with an error when
+any module is slower, e.g. to catch regressions in CI.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import argparse
+import os
+import subprocess
+import sys
+
+MYPY = False
+if MYPY:
+    from typing import Dict, List, Tuple  # noqa
+
+MODULES = [
+    'bin.check_mypy_annotations',
+    'bin.print_mypy_coverage',
+    'mypytools.config',
+    'mypytools.source_utils',
+]
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module):
+    # type: (str) -> Dict[str, int]
+    """ Cumulative import time in microseconds for every module imported. """
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        stderr=subprocess.STDOUT, cwd=ROOT_DIR, universal_newlines=True)
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def measure(module, runs):
+    # type: (str, int) -> Tuple[float, List[Tuple[int, str]]]
+    samples = []
+    times = {}  # type: Dict[str, int]
+    for _ in range(runs):
+        times = import_times(module)
+        samples.append(times[module])
+    samples.sort()
+    slowest = sorted(((t, name) for name, t in times.items() if name != module), reverse=True)[:3]
+    return samples[len(samples) // 2] / 1000, slowest
+
+
+def main():
+    # type: () -> None
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    failed = False
+    for module in MODULES:
+        median_ms, slowest = measure(module, args.runs)
+        details = ', '.join('{} {:.1f}ms'.format(name, t / 1000) for t, name in slowest)
+        print('{:<30} {:6.1f}ms  ({})'.format(module, median_ms, details))
+        if args.max_ms is not None and median_ms > args.max_ms:
+            failed = True
+    if failed:
+        print('Import time regression: over {}ms'.format(args.max_ms))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+""" Measures how quickly function signatures are checked for annotations.
+
+Generates a module with `--functions` functions, mixing decorators,
+multi-line signatures, type comments and bodies of `--body-lines` lines, and
+checks every function the way check_mypy_annotations does: whether it's
+annotated and, if not, the line to report. `legacy` is the old
+is_func_def_annotated followed by find_first_line_of_func, which scans each
+signature twice. `index` reads each signature once with read_signature.
+`tokenize` is a single tokenize pass over the whole file, for comparison
+with building the index from the tokenizer.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import ast
+import io
+import time
+import tokenize
+
+import click
+from typing import List, Tuple  # noqa
+
+from mypytools import source_utils
+
+
+def generate_source(num_functions, body_lines):
+    # type: (int, int) -> str
+    lines = []  # type: List[str]
+    for i in range(num_functions):
+        if i % 3 == 0:
+            lines.append('@decorator("(", key=")",')
+            lines.append('           other=[1, 2])')
+        lines.append('def func{}(a,'.format(i))
+        lines.append('          b=(1, 2)):')
+        if i % 2 == 0:
+            lines.append('    # type: (int, Tuple[int, int]) -> int')
+        lines.extend(['    a = [a, ")"]'] * body_lines)
+        lines.append('    return a')
+        lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+def legacy_is_func_def_annotated(func, lines):
+    # type: (ast.FunctionDef, List[str]) -> bool
+    if getattr(func, 'returns', None):
+        return True
+
+    for arg in func.args.args:
+        if getattr(arg, 'annotation', None):
+            return True
+
+    first_line_num = source_utils.find_first_line_of_func(lines, func.lineno)
+    first_line = lines[first_line_num]
+    if source_utils.is_line_annotated(first_line):
+        return True
+
+    end_line_of_def = lines[first_line_num - 1]
+    function_definition, rest = end_line_of_def.split(':', 1)
+    if source_utils.is_line_annotated(rest):
+        return True
+
+    return False
+
+
+def legacy(lines, funcs):
+    # type: (List[str], List[ast.FunctionDef]) -> List[Tuple[bool, int]]
+    return [(legacy_is_func_def_annotated(func, lines), source_utils.find_first_line_of_func(lines, func.lineno))
+            for func in funcs]
+
+
+def indexed(lines, funcs):
+    # type: (List[str], List[ast.FunctionDef]) -> List[Tuple[bool, int]]
+    results = []    # type: List[Tuple[bool, int]]
+    for func in funcs:
+        signature = source_utils.read_signature(lines, func)
+        results.append((signature.is_annotated, signature.signature_end_line + 1))
+    return results
+
+
+@click.command()
+@click.option('--functions', default=5000)
+@click.option('--body-lines', default=10)
+def main(functions, body_lines):
+    # type: (int, int) -> None
+    source = generate_source(functions, body_lines)
+    lines, tree = source_utils.parse_source(source)
+    funcs = [node for node in ast.walk(tree) if isinstance(node, ast.FunctionDef)]
+    print('{} lines, {} functions'.format(len(lines) - 1, len(funcs)))
+
+    for name, check in [('legacy', legacy), ('index', indexed)]:
+        start = time.time()
+        results = check(lines, funcs)
+        elapsed = time.time() - start
+        print('{:<8} {:8.3f}s ({:.0f} functions/s)'.format(name, elapsed, len(funcs) / elapsed))
+        if name == 'legacy':
+            expected = results
+        assert results == expected
+
+    start = time.time()
+    for _ in tokenize.generate_tokens(io.StringIO(source).readline):
+        pass
+    print('{:<8} {:8.3f}s'.format('tokenize', time.time() - start))
+
+
+if __name__ == "__main__":
+    main()
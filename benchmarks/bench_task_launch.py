@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+""" Measures how long it takes to build the mypy command line for a task.
+
+`legacy` is how MypyTask.execute used to do it: two $PATH walks and a
+shlex.split of the joined flags for every task. `profile` looks up the
+prebuilt command for the file's src dir.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import shlex
+import timeit
+
+import click
+from typing import Any, Dict, List  # noqa
+
+from mypytools.server.mypy_toolchain import ProfileSet, Toolchain, which
+
+CONFIG = {
+    'root_dir': '/project',
+    'src_dirs': [
+        {'path': 'app/', 'strict_optional': True},
+        {'path': 'lib/'},
+        {'path': 'tests/', 'strict_optional': True, 'flags': ['--allow-untyped-defs']},
+    ],
+    'mypy_path': ['.', 'lib/'],
+    'global_flags': ['--py2', '--follow-imports=silent', '--ignore-missing-imports', '--incremental'],
+}   # type: Dict[str, Any]
+
+FILENAME = '/project/app/models/user.py'
+
+
+def legacy_command(filename):
+    # type: (str) -> List[str]
+    mypy_path = os.pathsep.join(os.path.join(CONFIG['root_dir'], path) for path in CONFIG['mypy_path'])
+    strict_dirs = [os.path.join(CONFIG['root_dir'], d['path']) for d in CONFIG['src_dirs'] if d.get('strict_optional')]
+    mypy_exec = which('mypy') or 'mypy'
+    python_exec = which('python') or 'python'
+    flags = list(CONFIG['global_flags'])
+    flags.append('--python-executable={}'.format(python_exec))
+    if any(filename.startswith(d) for d in strict_dirs):
+        flags.append('--strict-optional')
+    assert mypy_path
+    return shlex.split("{} {} {}".format(mypy_exec, ' '.join(flags), filename))
+
+
+@click.command()
+@click.option('--number', default=2000)
+def main(number):
+    # type: (int) -> None
+    profiles = ProfileSet.from_config(CONFIG, Toolchain(which('mypy') or 'mypy', which('python') or 'python'))
+
+    def profile_command():
+        # type: () -> List[str]
+        profile = profiles.profile_for(FILENAME)
+        profile.build_env()
+        return profile.build_command(FILENAME)
+
+    assert sorted(legacy_command(FILENAME)) == sorted(profile_command())
+    print('$PATH has {} entries'.format(len(os.environ['PATH'].split(os.pathsep))))
+    for name, func in [('legacy', lambda: legacy_command(FILENAME)), ('profile', profile_command)]:
+        seconds = min(timeit.repeat(func, number=number, repeat=3))
+        print('{:<8} {:8.2f}us per task'.format(name, 1e6 * seconds / number))
+
+
+if __name__ == "__main__":
+    main()
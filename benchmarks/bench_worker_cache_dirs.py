@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+""" Compares mypy incremental timings with one shared cache directory
+against a private cache directory per worker.
+
+Generates a synthetic project, then checks every module with `--workers`
+concurrent mypy processes, twice: once cold and once warm after touching
+a single leaf module. Requires mypy to be installed.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from threading import Lock, Thread
+
+import click
+from typing import Any, Dict, List  # noqa
+
+from mypytools.server.mypy_cache_dirs import CacheDirPool
+
+
+def generate_project(root, num_modules, imports_per_module):
+    # type: (str, int, int) -> List[str]
+    package = os.path.join(root, 'pkg')
+    os.makedirs(package)
+    open(os.path.join(package, '__init__.py'), 'w').close()
+    paths = []
+    for i in range(num_modules):
+        lines = []
+        for j in range(max(0, i - imports_per_module), i):
+            lines.append('from pkg.mod{0} import func{0}'.format(j))
+        lines.append('')
+        lines.append('def func{}(x: int) -> int:'.format(i))
+        calls = ' + '.join('func{}(x)'.format(j) for j in range(max(0, i - imports_per_module), i)) or 'x'
+        lines.append('    return {}'.format(calls))
+        path = os.path.join(package, 'mod{}.py'.format(i))
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        paths.append(path)
+    return paths
+
+
+def check_all(root, paths, num_workers, cache_dir_for_worker):
+    # type: (str, List[str], int, Any) -> float
+    remaining = list(paths)
+    lock = Lock()
+
+    def worker(index):
+        # type: (int) -> None
+        cache_dir = cache_dir_for_worker(index)
+        while True:
+            with lock:
+                if len(remaining) == 0:
+                    return
+                path = remaining.pop()
+            subprocess.call(['mypy', '--incremental', '--follow-imports=silent',
+                             '--cache-dir={}'.format(cache_dir), path],
+                            cwd=root, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    start = time.time()
+    threads = [Thread(target=worker, args=(i,)) for i in range(num_workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+
+def touch(path):
+    # type: (str) -> None
+    with open(path, 'a') as f:
+        f.write('\n')
+
+
+def run_scenario(name, num_modules, imports_per_module, num_workers, per_worker):
+    # type: (str, int, int, int, bool) -> None
+    root = tempfile.mkdtemp(prefix='mypy-cache-bench-')
+    try:
+        paths = generate_project(root, num_modules, imports_per_module)
+        baseline = os.path.join(root, '.mypy_cache')
+        if per_worker:
+            pool = CacheDirPool(baseline, os.path.join(baseline, 'workers'))
+            dirs = {}   # type: Dict[int, str]
+
+            def cache_dir_for_worker(index):
+                # type: (int) -> str
+                if index not in dirs:
+                    dirs[index] = pool.acquire()
+                return dirs[index]
+        else:
+            def cache_dir_for_worker(index):
+                # type: (int) -> str
+                return baseline
+
+        cold = check_all(root, paths, num_workers, cache_dir_for_worker)
+        touch(paths[-1])
+        warm = check_all(root, paths, num_workers, cache_dir_for_worker)
+        print('{:<12} cold: {:6.2f}s  warm: {:6.2f}s  ({:.0f}ms/file warm)'.format(
+            name, cold, warm, 1000 * warm / num_modules))
+    finally:
+        shutil.rmtree(root)
+
+
+@click.command()
+@click.option('--modules', default=60)
+@click.option('--imports', default=4)
+@click.option('--workers', default=4)
+def main(modules, imports, workers):
+    # type: (int, int, int) -> None
+    if subprocess.call(['mypy', '--version'], stdout=subprocess.PIPE) != 0:
+        print('mypy must be installed to run this benchmark')
+        sys.exit(1)
+    print('{} modules, {} imports each, {} workers'.format(modules, imports, workers))
+    run_scenario('shared', modules, imports, workers, per_worker=False)
+    run_scenario('per-worker', modules, imports, workers, per_worker=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,142 +2,113 @@
 from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
-from typing import Dict, List, Optional, Set    # noqa
 
-import ast
-import click
 import os
-import re
-import subprocess
 
-from mypytools import source_utils
-
-UNIFIED_DIFF_REGEX = re.compile(r'^(\d+)(,(\d+))?$')
-
-
-def visit_node(root, line_to_func_map):
-    # type: (ast.AST, Dict[int, Optional[ast.FunctionDef]]) -> None
-    active_function = None  # type: Optional[ast.FunctionDef]
-    to_visit = [(root, active_function)]
-    while len(to_visit) > 0:
-        curr_node, active_function = to_visit.pop()
-        for child_node in ast.iter_child_nodes(curr_node):
-            if not getattr(child_node, 'lineno', None):
-                continue
-            if isinstance(child_node, ast.FunctionDef):
-                line_to_func_map[child_node.lineno] = child_node
-                to_visit.append((child_node, child_node))
-            else:
-                line_to_func_map[child_node.lineno] = active_function   # type: ignore
-                to_visit.append((child_node, active_function))
-
-
-def fill_line_to_func_gaps(line_to_func_map, num_lines):
-    # type: (Dict[int, Optional[ast.FunctionDef]], int) -> None
-    active_function = None
-    curr_line = 1
-    for line_num in sorted(line_to_func_map):
-        for missing_line_num in range(curr_line, line_num):
-            line_to_func_map[missing_line_num] = active_function
-        active_function = line_to_func_map[line_num]
-        curr_line = line_num
-
-    if len(line_to_func_map) == 0:
-        curr_line = 0
-    for line_num in range(curr_line + 1, num_lines + 1):
-        line_to_func_map[line_num] = active_function
-
-
-def get_added_lines(filename, rev):
-    # type: (str, str) -> Set[int]
-    added_lines = subprocess.check_output("git diff --unified=0 {} {} | grep @@ | cut -d'+' -f2 | cut -f1 -d' '".format(rev, filename), universal_newlines=True, shell=True).split('\n')
-    results = set()
-    for line in added_lines:
-        result = UNIFIED_DIFF_REGEX.match(line)
-        if result is None:
-            continue
-        groups = result.groups()
-        start = int(groups[0])
-        if groups[2] is None:
-            results.add(start)
-        else:
-            num_lines = int(groups[2])
-            for i in range(num_lines):
-                results.add(start + i)
-    return results
-
-
-def get_modified_files(rev):
-    # type: (str) -> List[str]
-    relative_paths = subprocess.check_output("git diff --name-only {}".format(rev), shell=True, universal_newlines=True).split('\n')[0:-1]
-    repo_root = subprocess.check_output("git rev-parse --show-toplevel", shell=True, universal_newlines=True).split('\n')[0]
-
-    python_paths = []
-    for path in relative_paths:
-        abs_path = os.path.join(repo_root, path)
-        if path.endswith(".py"):
-            python_paths.append(abs_path)
-            continue
+# Keep this script quick to start, it runs on every lint. typing is only
+# needed by mypy and click is only imported when running from the shell.
+MYPY = False
+if MYPY:
+    from typing import Any, Dict, List, Optional, Tuple    # noqa
 
-        try:
-            with open(abs_path, 'r') as f:
-                first_line = f.readline().rstrip('\n')
-                if first_line.startswith('#!') and first_line.endswith('python'):
-                    python_paths.append(abs_path)
-                    continue
-        except IOError:
-            continue
-
-    return python_paths
+from mypytools import source_utils
+from mypytools.annotations import (  # noqa
+    FunctionSpans, expand_ranges, get_added_lines_by_file, parse_diff, process_source)
+from mypytools.source_cache import SOURCE_CACHE_FILENAME, SourceCache, read_source
 
 
-def process_source(lines, added_lines, line_to_func_map):
-    # type: (List[str], Set[int], Dict[int, Optional[ast.FunctionDef]]) -> List[int]
-    results = []    # type: List[int]
-    printed_funcs = set()   # type: Set[ast.FunctionDef]
-    for line_num in sorted(added_lines):
-        func_def = line_to_func_map[line_num]
-        if func_def is None or func_def in printed_funcs:
-            continue
+def _check_source(args):
+    # type: (Tuple[str, List[Tuple[int, int]]]) -> List[int]
+    """ The lines to report in a source that isn't cached. Only the
+    functions the added lines touch have their signatures read.
+    """
+    source, added_ranges = args
+    lines, tree = source_utils.parse_source(source)
+    added_lines = expand_ranges(added_ranges, len(lines) - 1)
+    return process_source(lines, added_lines, FunctionSpans(tree, added_lines))
 
-        if source_utils.is_func_def_annotated(func_def, lines):
-            continue
 
-        first_line_num = source_utils.find_first_line_of_func(lines, func_def.lineno)
+def get_source_cache():
+    # type: () -> SourceCache
+    """ The cache print_mypy_coverage.py and mypy_server.py store at the
+    root of the project. Outside of a project with a .mypy_server config
+    it's empty.
+    """
+    from mypytools.config import get_config
 
-        results.append(first_line_num)
-        printed_funcs.add(func_def)
-    return results
+    try:
+        root_dir = get_config()['root_dir']
+    except RuntimeError:
+        return SourceCache()
+    return SourceCache.load(os.path.join(root_dir, SOURCE_CACHE_FILENAME))
 
 
-def process_file(filename, rev):
-    # type: (str, str) -> None
-    line_to_func_map = {}   # type: Dict[int, Optional[ast.FunctionDef]]
+def check_annotations(rev, jobs=None, source_cache=None):
+    # type: (str, Optional[int], Optional[SourceCache]) -> None
+    import multiprocessing
 
-    try:
-        with open(filename, 'r') as f:
-            source = f.read()
-    except IOError:
-        return
+    if source_cache is None:
+        source_cache = get_source_cache()
 
-    lines, tree = source_utils.parse_source(source)
-    added_lines = get_added_lines(filename, rev)
-    visit_node(tree, line_to_func_map)
-    fill_line_to_func_gaps(line_to_func_map, len(lines))
-    error_lines = process_source(lines, added_lines, line_to_func_map)
-    for line_num in error_lines:
-        print('{}:{} Please add a mypy annotation!'.format(filename, line_num))
-
-
-@click.command()
-@click.argument('rev')
-def main(rev):
-    # type: (str) -> None
-    modified_files = get_modified_files(rev)
-    for filename in modified_files:
-        if filename == '':
+    # filename -> the lines to report in it
+    results = {}    # type: Dict[str, List[int]]
+    # (filename, (source, added ranges)) for the files that aren't cached
+    to_check = []   # type: List[Tuple[str, Tuple[str, List[Tuple[int, int]]]]]
+    for filename, added_ranges in sorted(get_added_lines_by_file(rev).items()):
+        try:
+            content_hash, source = read_source(filename)
+        except (IOError, UnicodeDecodeError):
             continue
-        process_file(filename, rev)
+        function_index = source_cache.get(content_hash)
+        if function_index is None:
+            to_check.append((filename, (source, added_ranges)))
+        else:
+            results[filename] = function_index.missing_annotations(added_ranges)
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(to_check))
+
+    # Files the other tools haven't indexed are only parsed as far as the
+    # diff needs, in parallel. A full index would read the signature of
+    # every function in the file, so it isn't worth building for the cache.
+    sources = [args for _, args in to_check]
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            checked = pool.map(_check_source, sources, chunksize=max(1, len(sources) // (jobs * 4)))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        checked = [_check_source(args) for args in sources]
+    for (filename, _), line_nums in zip(to_check, checked):
+        results[filename] = line_nums
+
+    for filename in sorted(results):
+        for line_num in results[filename]:
+            print('{}:{} Please add a mypy annotation!'.format(filename, line_num))
+
+
+def build_cli():
+    # type: () -> Any
+    import click
+
+    @click.command()
+    @click.argument('rev')
+    @click.option('--jobs', '-j', type=int, default=None,
+                  help='Number of files to check in parallel, defaults to the number of CPUs.')
+    @click.option('--cache/--no-cache', default=True,
+                  help='Reuse the functions print_mypy_coverage.py and mypy_server.py found in unchanged files.')
+    def cli(rev, jobs, cache):
+        # type: (str, Optional[int], bool) -> None
+        check_annotations(rev, jobs, source_cache=None if cache else SourceCache())
+    return cli
+
+
+def main():
+    # type: () -> None
+    build_cli()()
 
 
 if __name__ == "__main__":
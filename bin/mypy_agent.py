@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+import os
+
+import click
+from mypytools.config import load_config_file
+from mypytools.server.mypy_agent import MypyAgent
+
+
+@click.command()
+@click.argument('address')
+@click.option('--root-dir', default='.', help="Root of this machine's checkout of the project.")
+@click.option('--name', default=None, help="Name to report to the coordinator.")
+def main(address, root_dir, name):
+    # type: (str, str, str) -> None
+    # Tasks read the project's config, which shouldn't depend on where the
+    # agent was started from.
+    load_config_file(os.path.abspath(root_dir))
+    agent = MypyAgent(address, root_dir, name=name)
+    agent.connect()
+    print('Connected to {} as {}'.format(address, agent.name))
+    agent.serve_forever()
+
+if __name__ == "__main__":
+    main()
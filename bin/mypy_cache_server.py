@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+import click
+from mypytools.server.mypy_cache_server import make_cache_server
+
+
+@click.command()
+@click.option('--host', default='0.0.0.0')
+@click.option('--port', default=8999)
+@click.option('--max-entries', default=500000, help="Number of results to keep before evicting the oldest.")
+def main(host, port, max_entries):
+    # type: (str, int, int) -> None
+    httpd = make_cache_server(host, port, max_entries)
+    print('Serving mypy results on {}:{}'.format(host, port))
+    httpd.serve_forever()
+
+if __name__ == "__main__":
+    main()
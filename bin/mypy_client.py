@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import io
+import json
+import os
+import socket
+import sys
+import time
+
+# Keep this script quick to start, it runs on every save. typing is only
+# needed by mypy and click is only imported when running from the shell.
+MYPY = False
+if MYPY:
+    from typing import Any, Dict, List, Optional, Sequence, Tuple    # noqa
+
+from mypytools.config import get_config
+from mypytools.server.mypy_diagnostics import Diagnostic, format_diagnostic
+from mypytools.server.mypy_http_client import MypyServerClient
+
+DEFAULT_TIMEOUT = 30.0
+# How often to ask about pending checks, backing off up to MAX_POLL_INTERVAL.
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 0.5
+# How many times to ask again about pending checks before giving up, in
+# case the server dropped them.
+MAX_RETRIES = 20
+
+
+def _post_json(client, path, obj):
+    # type: (MypyServerClient, str, Any) -> Any
+    status, body = client.request('POST', path, json.dumps(obj).encode('utf-8'))
+    if status != 200:
+        raise socket.error('Unexpected response from the mypy server: {}'.format(status))
+    return json.loads(body.decode('utf-8'))
+
+
+def query_server(client, paths, timeout=DEFAULT_TIMEOUT, buffers=None, max_retries=MAX_RETRIES):
+    # type: (MypyServerClient, List[str], float, Optional[Dict[str, str]], int) -> Dict[str, Dict[str, Any]]
+    """ The server's result for each absolute path, keyed by path. Files
+    in `buffers` are checked with those contents instead of what's on disk.
+    Waits up to `timeout` seconds and `max_retries` requests for pending
+    checks. Raises socket.error if the server can't be reached or doesn't
+    know the endpoints.
+    """
+    buffers = buffers or {}
+    deadline = time.time() + timeout
+    results = {}    # type: Dict[str, Dict[str, Any]]
+    remaining = list(paths)
+    delay = POLL_INTERVAL
+    for retry in range(max_retries + 1):
+        files = [path for path in remaining if path not in buffers]
+        if len(files) > 0:
+            for result in _post_json(client, '/v1/check', {'paths': files}):
+                results[result['path']] = result
+        for path in remaining:
+            if path in buffers:
+                results[path] = _post_json(client, '/v1/buffer', {'path': path, 'contents': buffers[path]})
+        remaining = [path for path in remaining if results[path]['status'] == 'pending']
+        if len(remaining) == 0 or retry == max_retries or time.time() + delay > deadline:
+            break
+        time.sleep(delay)
+        delay = min(2 * delay, MAX_POLL_INTERVAL)
+    return results
+
+
+def run_mypy(paths, buffers=None):
+    # type: (List[str], Optional[Dict[str, str]]) -> List[Diagnostic]
+    """ Checks the files with mypy here, with the flags the server would
+    have used. Raises RuntimeError if mypy can't be run, e.g. outside a
+    project with a .mypy_server config.
+    """
+    from mypytools.server.mypy_task import BufferTask, MypyTask
+    from mypytools.server.mypy_toolchain import get_profiles
+
+    # The tasks would only report this as a failure of each file.
+    get_profiles()
+    buffers = buffers or {}
+    diagnostics = []    # type: List[Diagnostic]
+    for path in paths:
+        if path in buffers:
+            task = BufferTask(path, buffers[path])  # type: MypyTask
+        else:
+            task = MypyTask(path, include_error_context=False)
+        _, _, err, _, file_hash = task.execute()
+        if err:
+            sys.stderr.write(err)
+        if not file_hash:
+            raise RuntimeError('Failed to check {}'.format(path))
+        diagnostics.extend(task.diagnostics or [])
+    return diagnostics
+
+
+def check_files(filenames, timeout=DEFAULT_TIMEOUT, client=None, shadow_files=()):
+    # type: (List[str], float, Optional[MypyServerClient], Sequence[Tuple[str, str]]) -> int
+    """ Prints the diagnostics for the files, and returns mypy's exit code
+    for them: 1 if there are errors, 2 if some files couldn't be checked.
+    Like mypy's --shadow-file, each (source, shadow) pair checks the
+    contents of shadow in place of source, e.g. an editor's unsaved buffer.
+    """
+    paths = [os.path.abspath(filename) for filename in filenames]
+    buffers = {}    # type: Dict[str, str]
+    for source, shadow in shadow_files:
+        with io.open(shadow, 'r', encoding='utf-8', newline='') as f:
+            buffers[os.path.abspath(source)] = f.read()
+    # Print paths the way they were given, like mypy does.
+    given_paths = dict(zip(paths, filenames))
+    if client is None:
+        try:
+            config = get_config()
+        except RuntimeError as e:
+            print("Can't check files: {}".format(e), file=sys.stderr)
+            return 2
+        client = MypyServerClient(config['root_dir'], config.get('port'))
+
+    exit_code = 0
+    try:
+        results = query_server(client, paths, timeout, buffers)
+    except socket.error as e:
+        print('mypy server unreachable ({}), running mypy directly'.format(e), file=sys.stderr)
+        try:
+            diagnostics = run_mypy(paths, buffers)
+        except RuntimeError as e:
+            print("Can't check files: {}".format(e), file=sys.stderr)
+            return 2
+    else:
+        diagnostics = []
+        messages = {
+            'missing': "can't read file",
+            'unchecked': "not in a src dir the mypy server checks",
+            'pending': "the mypy server is still checking it",
+            'timed_out': "mypy timed out checking it",
+        }
+        for path in paths:
+            result = results[path]
+            if result['status'] == 'done':
+                diagnostics.extend(Diagnostic(**diagnostic) for diagnostic in result['diagnostics'])
+                continue
+            print('{}: {}'.format(given_paths[path], messages[result['status']]), file=sys.stderr)
+            exit_code = 2
+
+    # Files checked together report the same errors in what they import.
+    seen = set()
+    for diagnostic in diagnostics:
+        if diagnostic in seen:
+            continue
+        seen.add(diagnostic)
+        print(format_diagnostic(diagnostic._replace(path=given_paths.get(diagnostic.path, diagnostic.path))))
+        if diagnostic.severity == 'error' and exit_code == 0:
+            exit_code = 1
+    return exit_code
+
+
+def build_cli():
+    # type: () -> Any
+    import click
+
+    @click.command()
+    @click.argument('files', nargs=-1, required=True, type=click.Path())
+    @click.option('--timeout', default=DEFAULT_TIMEOUT,
+                  help='Seconds to wait for the server to finish checking the files.')
+    @click.option('--shadow-file', nargs=2, multiple=True, type=click.Path(),
+                  help='Check the contents of the second file in place of the first, like mypy\'s --shadow-file.')
+    def cli(files, timeout, shadow_file):
+        # type: (Tuple[str, ...], float, Tuple[Tuple[str, str], ...]) -> None
+        sys.exit(check_files(list(files), timeout, shadow_files=shadow_file))
+    return cli
+
+
+def main():
+    # type: () -> None
+    build_cli()()
+
+
+if __name__ == "__main__":
+    main()
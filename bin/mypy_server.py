@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 import multiprocessing
+from typing import Optional  # noqa
 
 import click
 from mypytools.server import mypy_server
@@ -8,9 +9,21 @@ from mypytools.server import mypy_server
 @click.command()
 @click.option('--compact', is_flag=True, default=False, help="Print mypy errors without surrounding code context.")
 @click.option('--num-workers', default=multiprocessing.cpu_count())
-def main(compact, num_workers):
-    # type: (bool, int) -> None
-    mypy_server.run_server(compact=compact, num_workers=num_workers)
+@click.option('--agent-address', default=None,
+              help="Accept remote agents on host:port or unix:/path/to/socket.")
+@click.option('--warm-start', is_flag=True, default=False,
+              help="Check every file in the background at startup to warm the cache.")
+@click.option('--autoscale', is_flag=True, default=False,
+              help="Adjust the number of workers, up to --num-workers, to the load and free memory.")
+@click.option('--memory-budget', default=None, type=float,
+              help="Kill and re-queue tasks when mypy processes use more than this many MB in total.")
+@click.option('--unix-socket', is_flag=True, default=False,
+              help="Also serve the HTTP API on .mypy_server.sock in the project root.")
+def main(compact, num_workers, agent_address, warm_start, autoscale, memory_budget, unix_socket):
+    # type: (bool, int, Optional[str], bool, bool, Optional[float], bool) -> None
+    mypy_server.run_server(compact=compact, num_workers=num_workers, agent_address=agent_address,
+                           warm_start=warm_start, autoscale=autoscale, memory_budget=memory_budget,
+                           unix_socket=unix_socket)
 
 if __name__ == "__main__":
     main()
@@ -2,14 +2,24 @@
 from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
-from typing import Dict, Optional, List, Set  # noqa
 
-from mypytools import source_utils
-from mypytools.config import config
+from mypytools import annotations, source_utils
+from mypytools.annotations import FunctionIndex, is_python_file
+from mypytools.cache_files import code_version
+from mypytools.config import get_config
+from mypytools.coverage_cache import CACHE_FILENAME, CoverageCache, file_hash
+from mypytools.source_cache import SOURCE_CACHE_FILENAME, SourceCache, read_source
 
-import ast
-import click
+import json
 import os
+import sys
+
+# typing is only needed by mypy and click only when running from the shell.
+MYPY = False
+if MYPY:
+    from typing import Any, Callable, Dict, IO, Iterable, Iterator, Optional, List, Set, Tuple  # noqa
+
+CSV_COLUMNS = ['path', 'type', 'annotated', 'scanned', 'coverage']
 
 
 class SourceObj(object):
@@ -31,21 +41,29 @@ class SourceObj(object):
         # type: (SourceObj) -> None
         self.children[child.name] = child
         child.parent = self
-        self.refresh()
 
-    def refresh(self):
+    def aggregate(self):
         # type: () -> None
-        if len(self.children) > 0:
-            self.num_annotated_funcs = 0
-            self.num_scanned_funcs = 0
+        """ Sets the totals of every directory from its children in a single
+        bottom-up pass. Call it once all the files have been added.
+        """
+        to_visit = [self]
+        # Parents come before their children, so going backwards visits
+        # every child before its parent.
+        visit_order = []    # type: List[SourceObj]
+        while len(to_visit) > 0:
+            node = to_visit.pop()
+            visit_order.append(node)
+            to_visit.extend(node.children.values())
 
-            for child_name in self.children:
-                child = self.children[child_name]
-                self.num_annotated_funcs += child.num_annotated_funcs
-                self.num_scanned_funcs += child.num_scanned_funcs
-
-        if self.parent:
-            self.parent.refresh()
+        for node in reversed(visit_order):
+            if len(node.children) == 0:
+                continue
+            node.num_annotated_funcs = 0
+            node.num_scanned_funcs = 0
+            for child in node.children.values():
+                node.num_annotated_funcs += child.num_annotated_funcs
+                node.num_scanned_funcs += child.num_scanned_funcs
 
     def sorted_output(self, indent, output_lines, max_depth=None):
         # type: (int, List[str], Optional[int]) -> None
@@ -70,9 +88,140 @@ class SourceObj(object):
         self.sorted_output(indent, output_lines, max_depth)
         print('\n'.join(output_lines))
 
+    def to_json(self, path='', max_depth=None):
+        # type: (str, Optional[int]) -> Dict[str, Any]
+        result = {
+            'name': self.name,
+            'path': path,
+            'type': 'dir' if len(self.children) > 0 else 'file',
+            'annotated': self.num_annotated_funcs,
+            'scanned': self.num_scanned_funcs,
+        }   # type: Dict[str, Any]
+        if len(self.children) > 0 and (max_depth is None or max_depth > 1):
+            child_max_depth = None if max_depth is None else max_depth - 1
+            result['children'] = [
+                child.to_json(child_path(path, name), child_max_depth)
+                for name, child in sorted(self.children.items())]
+        return result
+
+
+def child_path(parent_path, name):
+    # type: (str, str) -> str
+    """ Joins tree paths. The root's path is empty, and absolute paths
+    show up as a child of the root with an empty name.
+    """
+    if parent_path == '':
+        return name or '/'
+    return parent_path.rstrip('/') + '/' + name
+
+
+def iter_nodes(root, max_depth=None):
+    # type: (SourceObj, Optional[int]) -> Iterator[Tuple[str, SourceObj]]
+    """ Yields (path, node) for the tree in pre-order, sorted by name. """
+    to_visit = [('', root, 1)]
+    while len(to_visit) > 0:
+        path, node, depth = to_visit.pop()
+        yield path, node
+        if max_depth is not None and depth >= max_depth:
+            continue
+        for name, child in sorted(node.children.items(), reverse=True):
+            to_visit.append((child_path(path, name), child, depth + 1))
+
+
+def write_csv(root, out, max_depth=None):
+    # type: (SourceObj, IO[str], Optional[int]) -> None
+    import csv
+
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(CSV_COLUMNS)
+    for path, node in iter_nodes(root, max_depth):
+        writer.writerow([
+            path,
+            'dir' if len(node.children) > 0 else 'file',
+            node.num_annotated_funcs,
+            node.num_scanned_funcs,
+            '{:.4f}'.format(node.coverage()),
+        ])
+
+
+def _coverage(num_annotated_funcs, num_scanned_funcs):
+    # type: (int, int) -> float
+    if num_scanned_funcs == 0:
+        return 0.0
+    return float(num_annotated_funcs) / float(num_scanned_funcs)
+
+
+def flatten_json(tree):
+    # type: (Dict[str, Any]) -> Dict[str, Tuple[str, int, int]]
+    """ Maps each path in a JSON tree to its (type, annotated, scanned). """
+    results = {}    # type: Dict[str, Tuple[str, int, int]]
+    to_visit = [tree]
+    while len(to_visit) > 0:
+        node = to_visit.pop()
+        results[node['path']] = (node['type'], node['annotated'], node['scanned'])
+        to_visit.extend(node.get('children', []))
+    return results
+
+
+def compare_to_baseline(root, baseline):
+    # type: (SourceObj, Dict[str, Any]) -> Dict[str, Any]
+    """ Lists the directories whose counts changed since the baseline
+    JSON tree and the files whose coverage went down, and counts the files
+    in the baseline and how many of them are still in the tree.
+    """
+    baseline_nodes = flatten_json(baseline)
+    directories = []    # type: List[Dict[str, Any]]
+    dropped_files = []  # type: List[Dict[str, Any]]
+    matched_files = 0
+    for path, node in iter_nodes(root):
+        is_dir = len(node.children) > 0
+        old = baseline_nodes.get(path)
+        if not is_dir and old is not None:
+            matched_files += 1
+        if old is None:
+            old_annotated, old_scanned = 0, 0
+        else:
+            old_annotated, old_scanned = old[1], old[2]
+        change = {  # type: Dict[str, Any]
+            'path': path,
+            'annotated': node.num_annotated_funcs,
+            'scanned': node.num_scanned_funcs,
+            'baseline_annotated': old_annotated,
+            'baseline_scanned': old_scanned,
+            'coverage_delta': node.coverage() - _coverage(old_annotated, old_scanned),
+        }
+        if is_dir:
+            if (old_annotated, old_scanned) != (node.num_annotated_funcs, node.num_scanned_funcs):
+                directories.append(change)
+        elif old is not None and change['coverage_delta'] < 0:
+            dropped_files.append(change)
+    return {
+        'directories': directories,
+        'dropped_files': dropped_files,
+        'baseline_files': sum(1 for node_type, _, _ in baseline_nodes.values() if node_type == 'file'),
+        'matched_files': matched_files,
+    }
+
+
+def format_change(change):
+    # type: (Dict[str, Any]) -> str
+    return '{path}: {baseline_annotated}/{baseline_scanned} -> {annotated}/{scanned} ({delta:+.2f}%)'.format(
+        delta=100.0 * change['coverage_delta'], **change)
+
+
+def print_baseline_report(report):
+    # type: (Dict[str, Any]) -> None
+    print('Directory changes:')
+    for change in report['directories']:
+        print('    ' + format_change(change))
+    print('Files with lower coverage:')
+    for change in report['dropped_files']:
+        print('    ' + format_change(change))
+
 
 def add_new_leaf_node(root, path, num_annotated_funcs, num_scanned_funcs):
     # type: (SourceObj, str, int, int) -> None
+    # Directory totals aren't updated until root.aggregate() is called.
     path_parts = path.split('/')
     curr = root
     for part in path_parts:
@@ -83,53 +232,132 @@ def add_new_leaf_node(root, path, num_annotated_funcs, num_scanned_funcs):
         curr = next_dir
     curr.num_annotated_funcs = num_annotated_funcs
     curr.num_scanned_funcs = num_scanned_funcs
-    curr.refresh()
 
 
-def process_source(root, path, source):
-    # type: (SourceObj, str, str) -> None
-    lines, tree = source_utils.parse_source(source)
-    num_scanned_funcs = 0
-    num_annotated_funcs = 0
+def count_annotated_funcs(source):
+    # type: (str) -> Tuple[int, int]
+    """ Returns the number of annotated functions and the number of functions. """
+    function_index = FunctionIndex.from_source(source)
+    return function_index.num_annotated_funcs, function_index.num_funcs
 
-    for node in ast.walk(tree):
-        if not isinstance(node, ast.FunctionDef):
-            continue
-
-        num_scanned_funcs += 1
-        if source_utils.is_func_def_annotated(node, lines):
-            num_annotated_funcs += 1
 
+def process_source(root, path, source):
+    # type: (SourceObj, str, str) -> None
+    num_annotated_funcs, num_scanned_funcs = count_annotated_funcs(source)
     add_new_leaf_node(root, path, num_annotated_funcs, num_scanned_funcs)
 
 
-def process_file(root, filename):
-    # type: (SourceObj, str) -> None
+def scan_file(filename):
+    # type: (str) -> Tuple[str, int, int]
     with open(filename, 'r') as f:
         source = f.read()
-    process_source(root, filename, source)
+    num_annotated_funcs, num_scanned_funcs = count_annotated_funcs(source)
+    return filename, num_annotated_funcs, num_scanned_funcs
 
 
-def is_python_file(path):
-    # type: (str) -> bool
-    if path.endswith('.py'):
-        return True
+def index_file(filename):
+    # type: (str) -> Tuple[str, str, FunctionIndex]
+    content_hash, source = read_source(filename)
+    return filename, content_hash, FunctionIndex.from_source(source)
+
+
+def map_files(func, paths, jobs=None):
+    # type: (Callable[[str], Any], List[str], Optional[int]) -> Iterable[Any]
+    """ Yields func(path) for each path as soon as it's done, spreading the
+    work across jobs processes.
+    """
+    import multiprocessing
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if jobs <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield func(path)
+        return
+
+    pool = multiprocessing.Pool(min(jobs, len(paths)))
     try:
-        with open(path, 'rb') as f:
-            first_line = f.readline().rstrip(b'\n')
-            if first_line.startswith(b'#!') and first_line.endswith(b'python'):
-                return True
-    except IOError:
-        pass
-    return False
-
-
-@click.command()
-@click.option('--max-depth', default=None, type=int)
-def main(max_depth):
-    # type: (Optional[int]) -> None
+        for result in pool.imap_unordered(func, paths, chunksize=max(1, min(64, len(paths) // (jobs * 4)))):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def scan_files(paths, jobs=None):
+    # type: (List[str], Optional[int]) -> Iterable[Tuple[str, int, int]]
+    """ Yields (path, annotated, scanned) for each file. """
+    return map_files(scan_file, paths, jobs)
+
+
+def index_files(paths, jobs=None):
+    # type: (List[str], Optional[int]) -> Iterable[Tuple[str, str, FunctionIndex]]
+    """ Yields (path, content hash, function index) for each file. """
+    return map_files(index_file, paths, jobs)
+
+
+# Bump this when the counting changes in a way the code hash below
+# wouldn't notice, e.g. a change in a library it depends on.
+CACHE_VERSION = 1
+
+
+def cache_version():
+    # type: () -> str
+    """ Identifies the code that produced cached counts, so the cache is
+    thrown away whenever this script or the code it counts with change.
+    """
+    return code_version(str(CACHE_VERSION), [__file__, annotations.__file__, source_utils.__file__])
+
+
+def scan_files_cached(paths, cache, jobs=None, source_cache=None):
+    # type: (List[str], CoverageCache, Optional[int], Optional[SourceCache]) -> Iterable[Tuple[str, int, int]]
+    """ Like scan_files, but only parses files that changed since they
+    were cached, and updates the cache with the new counts. Files that
+    were parsed by another tool sharing the source cache aren't parsed
+    again either.
+    """
+    if source_cache is None:
+        source_cache = SourceCache()
+    to_scan = []    # type: List[str]
+    # filename -> (mtime, size) from before the file was scanned.
+    file_stats = {}     # type: Dict[str, Tuple[float, int]]
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        counts = cache.get(path, st.st_mtime, st.st_size)
+        if counts is None:
+            content_hash = file_hash(path)
+            file_stats[path] = (st.st_mtime, st.st_size)
+            counts = cache.get_by_hash(path, content_hash)
+            if counts is None:
+                function_index = source_cache.get(content_hash)
+                if function_index is None:
+                    to_scan.append(path)
+                    continue
+                counts = function_index.num_annotated_funcs, function_index.num_funcs
+            cache.set(path, st.st_mtime, st.st_size, content_hash, counts[0], counts[1])
+        yield path, counts[0], counts[1]
+
+    for path, content_hash, function_index in index_files(to_scan, jobs):
+        source_cache.set(content_hash, function_index)
+        mtime, size = file_stats[path]
+        num_annotated_funcs, num_scanned_funcs = function_index.num_annotated_funcs, function_index.num_funcs
+        cache.set(path, mtime, size, content_hash, num_annotated_funcs, num_scanned_funcs)
+        yield path, num_annotated_funcs, num_scanned_funcs
+    cache.retain(paths)
+
+
+def print_coverage(max_depth, jobs=None, use_cache=True, output_format='text', baseline_path=None):
+    # type: (Optional[int], Optional[int], bool, str, Optional[str]) -> int
+    """ Prints the coverage tree, or how it changed since the baseline JSON.
+    Returns the exit code: 1 if coverage went down since the baseline, 2
+    if none of the baseline's files are in the tree.
+    """
     root = SourceObj('root')
 
+    config = get_config()
     src_dirs = [os.path.join(config['root_dir'], d['path']) for d in config['src_dirs']]
 
     paths = set()   # type: Set[str]
@@ -141,10 +369,71 @@ def main(max_depth):
                     continue
                 paths.add(path)
 
-    for path in paths:
-        process_file(root, path)
+    if use_cache:
+        cache = CoverageCache.load(os.path.join(config['root_dir'], CACHE_FILENAME), cache_version())
+        source_cache = SourceCache.load(os.path.join(config['root_dir'], SOURCE_CACHE_FILENAME))
+        results = scan_files_cached(sorted(paths), cache, jobs, source_cache)
+    else:
+        results = scan_files(sorted(paths), jobs)
+    # The machine readable formats are relative to the root so they can be
+    # compared between checkouts, e.g. against a baseline written on CI.
+    relative_paths = output_format != 'text' or baseline_path is not None
+    for path, num_annotated_funcs, num_scanned_funcs in results:
+        if relative_paths:
+            path = os.path.relpath(path, config['root_dir'])
+        add_new_leaf_node(root, path, num_annotated_funcs, num_scanned_funcs)
+    root.aggregate()
+    if use_cache:
+        cache.save()
+        source_cache.save()
+
+    if baseline_path is not None:
+        with open(baseline_path, 'r') as f:
+            report = compare_to_baseline(root, json.load(f))
+        if report['baseline_files'] > 0 and report['matched_files'] == 0:
+            # Comparing would report every file as new and never fail.
+            print('None of the files in {} are in this tree, was it written for another project or with '
+                  'absolute paths?'.format(baseline_path), file=sys.stderr)
+            return 2
+        if output_format == 'json':
+            print(json.dumps(report, indent=2, sort_keys=True))
+        else:
+            print_baseline_report(report)
+        root_dropped = any(change['path'] == '' and change['coverage_delta'] < 0
+                           for change in report['directories'])
+        return 1 if root_dropped or len(report['dropped_files']) > 0 else 0
+
+    if output_format == 'json':
+        print(json.dumps(root.to_json(max_depth=max_depth), indent=2, sort_keys=True))
+    elif output_format == 'csv':
+        write_csv(root, sys.stdout, max_depth)
+    else:
+        root.sorted_print(indent=0, max_depth=max_depth)
+    return 0
+
+
+def build_cli():
+    # type: () -> Any
+    import click
+
+    @click.command()
+    @click.option('--max-depth', default=None, type=int)
+    @click.option('--jobs', '-j', default=None, type=int,
+                  help='Number of processes to scan files with, defaults to the number of CPUs.')
+    @click.option('--cache/--no-cache', default=True,
+                  help='Reuse the counts for files that haven\'t changed since the last run.')
+    @click.option('--format', 'output_format', default='text', type=click.Choice(['text', 'json', 'csv']))
+    @click.option('--baseline', default=None, type=click.Path(exists=True, dir_okay=False),
+                  help='A previous --format=json output to compare against. Exits with 1 if coverage dropped.')
+    def cli(max_depth, jobs, cache, output_format, baseline):
+        # type: (Optional[int], Optional[int], bool, str, Optional[str]) -> None
+        sys.exit(print_coverage(max_depth, jobs, cache, output_format, baseline))
+    return cli
+
 
-    root.sorted_print(indent=0, max_depth=max_depth)
+def main():
+    # type: () -> None
+    build_cli()()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,272 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import ast
+import bisect
+import os
+import re
+import subprocess
+
+MYPY = False
+if MYPY:
+    from typing import Dict, List, Optional, Set, Tuple  # noqa
+
+from mypytools import source_utils
+
+HUNK_HEADER_REGEX = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def _first_line(node):
+    # type: (ast.AST) -> int
+    decorators = getattr(node, 'decorator_list', None)
+    if decorators:
+        return min(decorator.lineno for decorator in decorators)
+    return node.lineno  # type: ignore
+
+
+def _last_line(node):
+    # type: (ast.AST) -> Optional[int]
+    return getattr(node, 'end_lineno', None)
+
+
+def _find_innermost(first_lines, last_lines, parents, line_num):
+    # type: (List[int], List[int], List[int], int) -> int
+    index = bisect.bisect_right(first_lines, line_num) - 1
+    while index >= 0 and last_lines[index] < line_num:
+        index = parents[index]
+    return index
+
+
+class FunctionSpans(object):
+    """ The (first, last) line spans of the function definitions in a
+    module, sorted by first line, for mapping lines back to the innermost
+    function they're in.
+
+    When given the added lines, statements that don't overlap any of them
+    are skipped, so the cost scales with the size of the diff rather than
+    the size of the file. That needs end line numbers, so older Pythons
+    visit every statement.
+    """
+
+    def __init__(self, tree, added_lines=None):
+        # type: (ast.AST, Optional[Set[int]]) -> None
+        self.first_lines = []   # type: List[int]
+        self.last_lines = []    # type: List[int]
+        self.funcs = []     # type: List[ast.FunctionDef]
+        # The index of the enclosing function's span, or -1.
+        self.parents = []   # type: List[int]
+        self._added_lines = None if added_lines is None else sorted(added_lines)
+        self._visit(tree)
+
+    def _overlaps_added_lines(self, first, last):
+        # type: (int, int) -> bool
+        if self._added_lines is None:
+            return True
+        index = bisect.bisect_left(self._added_lines, first)
+        return index < len(self._added_lines) and self._added_lines[index] <= last
+
+    def _visit(self, root):
+        # type: (ast.AST) -> None
+        to_visit = [(root, -1)]
+        while len(to_visit) > 0:
+            node, parent = to_visit.pop()
+            if isinstance(node, ast.FunctionDef):
+                last_line = _last_line(node)
+                if last_line is None:
+                    last_line = max(getattr(n, 'lineno', 0) for n in ast.walk(node))
+                self.first_lines.append(_first_line(node))
+                self.last_lines.append(last_line)
+                self.funcs.append(node)
+                self.parents.append(parent)
+                parent = len(self.funcs) - 1
+
+            children = []
+            for child in ast.iter_child_nodes(node):
+                # Function definitions are always statements, so there's
+                # no need to look inside expressions.
+                if isinstance(child, ast.expr):
+                    continue
+                last_line = _last_line(child)
+                if (last_line is not None and hasattr(child, 'lineno') and
+                        not self._overlaps_added_lines(_first_line(child), last_line)):
+                    continue
+                children.append((child, parent))
+            # Visit in source order so the spans come out sorted.
+            to_visit.extend(reversed(children))
+
+    def find_index(self, line_num):
+        # type: (int) -> int
+        """ The index of the innermost function around the line, or -1. """
+        return _find_innermost(self.first_lines, self.last_lines, self.parents, line_num)
+
+    def find(self, line_num):
+        # type: (int) -> Optional[ast.FunctionDef]
+        index = self.find_index(line_num)
+        if index < 0:
+            return None
+        return self.funcs[index]
+
+
+class FunctionIndex(object):
+    """ The line spans of every function in a module and the line to report
+    for each one that's missing annotations. Unlike FunctionSpans it doesn't
+    hold on to the ast, so it's cheap to keep around and to store on disk.
+    """
+
+    def __init__(self, num_lines, first_lines, last_lines, parents, report_lines):
+        # type: (int, List[int], List[int], List[int], List[int]) -> None
+        self.num_lines = num_lines
+        self.first_lines = first_lines
+        self.last_lines = last_lines
+        self.parents = parents
+        # The line to report for each function, or 0 if it's annotated.
+        self.report_lines = report_lines
+
+    @classmethod
+    def from_source(cls, source):
+        # type: (str) -> FunctionIndex
+        lines, tree = source_utils.parse_source(source)
+        spans = FunctionSpans(tree)
+        report_lines = []   # type: List[int]
+        for func in spans.funcs:
+            signature = source_utils.read_signature(lines, func)
+            report_lines.append(0 if signature.is_annotated else signature.signature_end_line + 1)
+        return cls(len(lines) - 1, spans.first_lines, spans.last_lines, spans.parents, report_lines)
+
+    def to_tuple(self):
+        # type: () -> Tuple[int, List[int], List[int], List[int], List[int]]
+        return self.num_lines, self.first_lines, self.last_lines, self.parents, self.report_lines
+
+    @classmethod
+    def from_tuple(cls, data):
+        # type: (Tuple[int, List[int], List[int], List[int], List[int]]) -> FunctionIndex
+        return cls(*data)
+
+    @property
+    def num_funcs(self):
+        # type: () -> int
+        return len(self.report_lines)
+
+    @property
+    def num_annotated_funcs(self):
+        # type: () -> int
+        return sum(1 for line_num in self.report_lines if line_num == 0)
+
+    def find_index(self, line_num):
+        # type: (int) -> int
+        """ The index of the innermost function around the line, or -1. """
+        return _find_innermost(self.first_lines, self.last_lines, self.parents, line_num)
+
+    def missing_annotations(self, added_ranges):
+        # type: (List[Tuple[int, int]]) -> List[int]
+        """ The line to report for each function that the added lines touch
+        and that's missing annotations.
+        """
+        results = []    # type: List[int]
+        seen = set()    # type: Set[int]
+        for line_num in sorted(expand_ranges(added_ranges, self.num_lines)):
+            index = self.find_index(line_num)
+            if index < 0 or index in seen:
+                continue
+            seen.add(index)
+            if self.report_lines[index] != 0:
+                results.append(self.report_lines[index])
+        return results
+
+
+def parse_diff(diff):
+    # type: (str) -> Dict[str, List[Tuple[int, int]]]
+    """ Maps each file in a `git diff --unified=0` to the (first, last)
+    line ranges added to it. Deleted files and pure deletions are left out.
+    """
+    results = {}    # type: Dict[str, List[Tuple[int, int]]]
+    ranges = None   # type: Optional[List[Tuple[int, int]]]
+    # Lines left in the current hunk, so added lines that happen to look
+    # like diff headers aren't mistaken for them.
+    remaining = 0
+    for line in diff.split('\n'):
+        if remaining > 0:
+            if line.startswith(('+', '-', ' ')):
+                remaining -= 1
+            continue
+
+        if line.startswith('+++ '):
+            path = line[4:]
+            if path.startswith('"') and path.endswith('"'):
+                path = path[1:-1]
+            if path.startswith('b/'):
+                ranges = results.setdefault(path[2:], [])
+            else:
+                # The file was deleted.
+                ranges = None
+            continue
+
+        result = HUNK_HEADER_REGEX.match(line)
+        if result is None:
+            continue
+        old_count = 1 if result.group(2) is None else int(result.group(2))
+        start = int(result.group(3))
+        new_count = 1 if result.group(4) is None else int(result.group(4))
+        remaining = old_count + new_count
+        if ranges is not None and new_count > 0:
+            ranges.append((start, start + new_count - 1))
+    return dict((path, ranges) for path, ranges in results.items() if len(ranges) > 0)
+
+
+def expand_ranges(ranges, num_lines):
+    # type: (List[Tuple[int, int]], int) -> Set[int]
+    """ The line numbers in the (first, last) ranges, up to num_lines. """
+    lines = set()   # type: Set[int]
+    for first, last in ranges:
+        lines.update(range(first, min(last, num_lines) + 1))
+    return lines
+
+
+def is_python_file(path):
+    # type: (str) -> bool
+    if path.endswith('.py'):
+        return True
+    try:
+        with open(path, 'r') as f:
+            first_line = f.readline().rstrip('\n')
+    except (IOError, UnicodeDecodeError):
+        return False
+    return first_line.startswith('#!') and first_line.endswith('python')
+
+
+def get_added_lines_by_file(rev, cwd=None):
+    # type: (str, Optional[str]) -> Dict[str, List[Tuple[int, int]]]
+    """ The line ranges added to each modified Python file since rev, keyed
+    by absolute path, from a single git diff.
+    """
+    repo_root = subprocess.check_output(
+        ['git', 'rev-parse', '--show-toplevel'], cwd=cwd).decode('utf-8').rstrip('\n')
+    diff = subprocess.check_output(
+        ['git', '-c', 'core.quotePath=false', 'diff', '--unified=0', '--no-color', '--no-ext-diff',
+         '--src-prefix=a/', '--dst-prefix=b/', rev, '--'], cwd=cwd).decode('utf-8', 'replace')
+
+    results = {}    # type: Dict[str, List[Tuple[int, int]]]
+    for path, ranges in parse_diff(diff).items():
+        abs_path = os.path.join(repo_root, path)
+        if is_python_file(abs_path):
+            results[abs_path] = ranges
+    return results
+
+
+def process_source(lines, added_lines, function_spans):
+    # type: (List[str], Set[int], FunctionSpans) -> List[int]
+    results = []    # type: List[int]
+    printed_funcs = set()   # type: Set[ast.FunctionDef]
+    for line_num in sorted(added_lines):
+        func_def = function_spans.find(line_num)
+        if func_def is None or func_def in printed_funcs:
+            continue
+
+        signature = source_utils.read_signature(lines, func_def)
+        if signature.is_annotated:
+            continue
+
+        results.append(signature.signature_end_line + 1)
+        printed_funcs.add(func_def)
+    return results
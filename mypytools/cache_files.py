@@ -0,0 +1,47 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import hashlib
+import os
+from contextlib import contextmanager
+
+MYPY = False
+if MYPY:
+    from typing import IO, Iterator, List  # noqa
+
+
+def code_version(salt, module_files):
+    # type: (str, List[str]) -> str
+    """ Identifies the code in the module files, so caches of what it
+    computed are thrown away whenever it changes. The salt covers changes
+    the code wouldn't show, e.g. in a library it depends on.
+    """
+    version = hashlib.md5(salt.encode('utf-8'))
+    for module_file in module_files:
+        if module_file.endswith('.pyc'):
+            module_file = module_file[:-1]
+        try:
+            with open(module_file, 'rb') as f:
+                version.update(hashlib.md5(f.read()).hexdigest().encode('utf-8'))
+        except IOError:
+            version.update(module_file.encode('utf-8'))
+    return version.hexdigest()
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    # type: (str, str) -> Iterator[IO]
+    """ Opens a temporary file next to path that replaces it once it's
+    been written, so an interrupted run can't leave a truncated cache.
+    """
+    import tempfile
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.rename(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
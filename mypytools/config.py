@@ -5,30 +5,67 @@ from __future__ import absolute_import
 import json
 import os
 
-from typing import Dict, Any
+MYPY = False
+if MYPY:
+    from typing import Dict, Any, List, Optional  # noqa
 
+CONFIG_FILENAME = '.mypy_server'
+
+# Empty until load_config_file() or get_config() is called; nothing is
+# read at import time so importing the tools stays cheap.
 config = {}     # type: Dict[str, Any]
 
 
-def load_config_file():
-    # type: () -> None
-    global config
-    cwd = os.getcwd()
-    while True:
-        config_path = os.path.join(cwd, '.mypy_server')
+def _read_config_file(config_path):
+    # type: (str) -> Dict[str, Any]
+    with open(config_path, 'r') as f:
         try:
-            with open(config_path, 'r') as f:
-                config = json.load(f)
-                config['root_dir'] = cwd
-                break
-        except IOError:
-            new_cwd = os.path.dirname(cwd)
-            if new_cwd == cwd:
-                raise RuntimeError('Unable to find .mypy_server config file')
-            cwd = new_cwd
-            continue
+            return json.load(f)
         except ValueError:
             print('Error while loading the config file. Maybe a JSON syntax error?')
             raise
 
-load_config_file()
+
+def load_config_file(root_dir=None):
+    # type: (Optional[str]) -> None
+    # The config is updated in place so everyone holding a reference to it
+    # sees the new values when it's reloaded.
+    cwd = root_dir or os.getcwd()
+    while True:
+        config_path = os.path.join(cwd, CONFIG_FILENAME)
+        try:
+            new_config = _read_config_file(config_path)
+        except IOError:
+            new_config = None
+        if new_config is not None:
+            new_config['root_dir'] = cwd
+            config.clear()
+            config.update(new_config)
+            break
+        new_cwd = os.path.dirname(cwd)
+        if root_dir is not None or new_cwd == cwd:
+            raise RuntimeError('Unable to find .mypy_server config file')
+        cwd = new_cwd
+
+
+def get_config():
+    # type: () -> Dict[str, Any]
+    if 'root_dir' not in config:
+        load_config_file()
+    return config
+
+
+def reload_config_file():
+    # type: () -> None
+    load_config_file(root_dir=get_config()['root_dir'])
+
+
+def get_config_path():
+    # type: () -> str
+    return os.path.join(get_config()['root_dir'], CONFIG_FILENAME)
+
+
+def get_src_dirs():
+    # type: () -> List[str]
+    cfg = get_config()
+    return [os.path.join(cfg['root_dir'], d['path']) for d in cfg.get('src_dirs', [])]
@@ -0,0 +1,92 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import hashlib
+import json
+import os
+import time
+
+from mypytools.cache_files import atomic_write
+
+MYPY = False
+if MYPY:
+    from typing import Dict, Iterable, List, Optional, Tuple  # noqa
+
+CACHE_FILENAME = '.mypy_coverage_cache'
+
+# Files modified this close to when the cache was saved might change again
+# without their mtime moving, so their contents are always double checked.
+RACY_WINDOW = 2.0
+
+
+def file_hash(path):
+    # type: (str) -> str
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+class CoverageCache(object):
+    """ Annotation counts per file from earlier coverage runs.
+
+    Entries are reused while a file's mtime and size are unchanged, or
+    when its contents hash the same. The whole cache is thrown away when
+    the version changes, which callers derive from the code that does the
+    counting.
+    """
+
+    def __init__(self, path, version):
+        # type: (str, str) -> None
+        self.path = path
+        self.version = version
+        # filename -> [mtime, size, content hash, annotated, scanned]
+        self.entries = {}   # type: Dict[str, List]
+        self.saved_at = 0.0
+
+    @classmethod
+    def load(cls, path, version):
+        # type: (str, str) -> CoverageCache
+        cache = cls(path, version)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return cache
+        if not isinstance(data, dict) or data.get('version') != version:
+            return cache
+        cache.entries = data.get('files', {})
+        cache.saved_at = data.get('saved_at', 0.0)
+        return cache
+
+    def get(self, filename, mtime, size):
+        # type: (str, float, int) -> Optional[Tuple[int, int]]
+        entry = self.entries.get(filename)
+        if entry is None or entry[0] != mtime or entry[1] != size:
+            return None
+        if mtime >= self.saved_at - RACY_WINDOW:
+            return None
+        return entry[3], entry[4]
+
+    def get_by_hash(self, filename, content_hash):
+        # type: (str, str) -> Optional[Tuple[int, int]]
+        entry = self.entries.get(filename)
+        if entry is None or entry[2] != content_hash:
+            return None
+        return entry[3], entry[4]
+
+    def set(self, filename, mtime, size, content_hash, num_annotated_funcs, num_scanned_funcs):
+        # type: (str, float, int, str, int, int) -> None
+        self.entries[filename] = [mtime, size, content_hash, num_annotated_funcs, num_scanned_funcs]
+
+    def retain(self, filenames):
+        # type: (Iterable[str]) -> None
+        """ Forgets every file that isn't in filenames. """
+        filenames = set(filenames)
+        for filename in list(self.entries):
+            if filename not in filenames:
+                del self.entries[filename]
+
+    def save(self):
+        # type: () -> None
+        with atomic_write(self.path) as f:
+            json.dump({'version': self.version, 'saved_at': time.time(), 'files': self.entries}, f)
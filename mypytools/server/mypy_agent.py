@@ -0,0 +1,178 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import json
+import os
+import socket
+import time
+import traceback
+from threading import Lock, Thread
+
+from typing import Any, Dict, Optional, Tuple, Union
+
+from mypytools.server.mypy_task import MypyTask
+
+# How often agents tell the coordinator they're still alive.
+HEARTBEAT_INTERVAL = 5.0
+
+Message = Dict[str, Any]
+
+
+def parse_address(address):
+    # type: (str) -> Tuple[int, Union[str, Tuple[str, int]]]
+    """ Turn an address given on the command line into a socket family
+    and address. Accepts either `host:port` or `unix:/path/to/socket`.
+    """
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError('Invalid agent address: {}'.format(address))
+    return socket.AF_INET, (host, int(port))
+
+
+def send_message(sock, lock, message):
+    # type: (socket.socket, Lock, Message) -> None
+    data = (json.dumps(message) + '\n').encode('utf-8')
+    with lock:
+        sock.sendall(data)
+
+
+def close_socket(sock):
+    # type: (socket.socket) -> None
+    # Shut the socket down before closing it, so that readers blocked in
+    # another thread wake up and the other side sees EOF straight away.
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+        pass
+    sock.close()
+
+
+def decode_message(line):
+    # type: (bytes) -> Message
+    return json.loads(line.decode('utf-8'))
+
+
+class MypyAgent(object):
+    """ Runs MypyTasks on behalf of a remote mypy_server.
+
+    The agent connects to the coordinator, then loops reading newline
+    delimited JSON messages. Tasks reference files relative to the project
+    root so the agent's checkout doesn't need to live at the same path.
+    """
+
+    def __init__(self, address, root_dir, name=None, heartbeat_interval=HEARTBEAT_INTERVAL):
+        # type: (str, str, Optional[str], float) -> None
+        self.address = address
+        self.root_dir = os.path.abspath(root_dir)
+        self.name = name or '{}-{}'.format(socket.gethostname(), os.getpid())
+        self.heartbeat_interval = heartbeat_interval
+        self._sock = None           # type: Optional[socket.socket]
+        self._send_lock = Lock()
+        self._current_task = None   # type: Optional[Tuple[int, Any]]
+        self._task_thread = None    # type: Optional[Thread]
+        self._running = False
+
+    def _make_task(self, filename):
+        # type: (str) -> Any
+        return MypyTask(filename)
+
+    def _send(self, message):
+        # type: (Message) -> None
+        assert self._sock is not None
+        send_message(self._sock, self._send_lock, message)
+
+    def _heartbeat(self):
+        # type: () -> None
+        while self._running:
+            try:
+                self._send({'type': 'heartbeat'})
+            except socket.error:
+                return
+            time.sleep(self.heartbeat_interval)
+
+    def _run_task(self, message):
+        # type: (Message) -> None
+        filename = os.path.join(self.root_dir, message['path'])
+        task = self._make_task(filename)
+        self._current_task = (message['id'], task)
+        try:
+            exit_code, output, error, context, file_hash = task.execute()
+        except Exception:
+            # Without a result the coordinator would wait on this task
+            # forever, so tell it the task failed instead.
+            exit_code, output, error, context, file_hash = -1, '', traceback.format_exc(), '', ''
+        finally:
+            self._current_task = None
+
+        # Report paths relative to the coordinator's checkout.
+        coordinator_root = message['root_dir']
+        output = output.replace(self.root_dir, coordinator_root)
+        context = context.replace(self.root_dir, coordinator_root)
+        try:
+            self._send({
+                'type': 'result',
+                'id': message['id'],
+                'exit_code': exit_code,
+                'output': output,
+                'error': error,
+                'context': context,
+                'file_hash': file_hash,
+                'timed_out': task.timed_out,
+                # Tasks that couldn't run have no file hash.
+                'failed': not file_hash,
+            })
+        except socket.error:
+            pass
+
+    def _interrupt(self, message):
+        # type: (Message) -> None
+        current_task = self._current_task
+        if current_task is not None and current_task[0] == message['id']:
+            current_task[1].interrupt()
+
+    def connect(self):
+        # type: () -> None
+        family, address = parse_address(self.address)
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.connect(address)
+        self._running = True
+        self._send({'type': 'hello', 'name': self.name})
+        heartbeat_thread = Thread(target=self._heartbeat)
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
+
+    def serve_forever(self):
+        # type: () -> None
+        if self._sock is None:
+            self.connect()
+        assert self._sock is not None
+        reader = self._sock.makefile('rb')
+        try:
+            for line in iter(reader.readline, b''):
+                message = decode_message(line)
+                if message['type'] == 'task':
+                    # Run the task on its own thread so we can keep reading
+                    # interrupts while mypy is running.
+                    self._task_thread = Thread(target=self._run_task, args=(message,))
+                    self._task_thread.daemon = True
+                    self._task_thread.start()
+                elif message['type'] == 'interrupt':
+                    self._interrupt(message)
+                elif message['type'] == 'shutdown':
+                    break
+        except socket.error:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        # type: () -> None
+        self._running = False
+        if self._sock is not None:
+            close_socket(self._sock)
+        current_task = self._current_task
+        if current_task is not None:
+            current_task[1].interrupt()
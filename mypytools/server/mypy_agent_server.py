@@ -0,0 +1,235 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import socket
+import time
+from threading import Event, Lock
+
+from typing import Any, Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from watchdog.utils import BaseThread
+
+from mypytools.server.mypy_agent import (
+    HEARTBEAT_INTERVAL, Message, close_socket, decode_message, parse_address, send_message)
+from mypytools.server.mypy_task import MypyTask
+from mypytools.server.mypy_worker import MypyWorker
+if TYPE_CHECKING:
+    from mypytools.server.mypy_event_handler import MypyEventHandler
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty  # type: ignore
+
+# An agent that hasn't sent anything in this long is considered dead.
+AGENT_TIMEOUT = 6 * HEARTBEAT_INTERVAL
+
+
+class AgentConnection(BaseThread):
+    """ Reads messages from a single agent and tracks its health. """
+
+    def __init__(self, sock, peer):
+        # type: (socket.socket, Any) -> None
+        self._sock = sock
+        self._send_lock = Lock()
+        self.agent_name = str(peer)
+        self.alive = True
+        self.connected_at = time.time()
+        self.last_seen = self.connected_at
+        self.tasks_completed = 0
+        self.tasks_failed = 0
+        self.results = Queue()  # type: Queue[Optional[Message]]
+        self.on_close = None    # type: Optional[Callable[[], None]]
+        super(AgentConnection, self).__init__()
+
+    def send(self, message):
+        # type: (Message) -> None
+        send_message(self._sock, self._send_lock, message)
+
+    def is_healthy(self, timeout=AGENT_TIMEOUT):
+        # type: (float) -> bool
+        return self.alive and time.time() - self.last_seen < timeout
+
+    def health(self):
+        # type: () -> Dict[str, Any]
+        return {
+            'name': self.agent_name,
+            'alive': self.alive,
+            'connected_at': self.connected_at,
+            'last_seen': self.last_seen,
+            'tasks_completed': self.tasks_completed,
+            'tasks_failed': self.tasks_failed,
+        }
+
+    def run(self):
+        # type: () -> None
+        reader = self._sock.makefile('rb')
+        try:
+            for line in iter(reader.readline, b''):
+                message = decode_message(line)
+                self.last_seen = time.time()
+                if message['type'] == 'hello':
+                    self.agent_name = message['name']
+                elif message['type'] == 'result':
+                    self.results.put(message)
+        except (socket.error, ValueError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        # type: () -> None
+        if not self.alive:
+            return
+        self.alive = False
+        close_socket(self._sock)
+        # Wake up anyone waiting on a result.
+        self.results.put(None)
+        if self.on_close is not None:
+            self.on_close()
+
+
+class RemoteMypyWorker(MypyWorker):
+    """ A worker that forwards its tasks to a connected agent. """
+    is_remote = True
+
+    def __init__(self, connection, event_handler, root_dir, agent_timeout=AGENT_TIMEOUT):
+        # type: (AgentConnection, MypyEventHandler, str, float) -> None
+        self.connection = connection
+        self.event_handler = event_handler
+        self.root_dir = root_dir
+        self.agent_timeout = agent_timeout
+        self._task_id = 0
+        super(RemoteMypyWorker, self).__init__(
+            event_handler.task_pool, event_handler.task_cond, event_handler.file_cache, event_handler.compact,
+            event_handler.background_queue)
+        connection.on_close = self.stop
+        self.on_exit = event_handler.remove_worker
+
+    def on_thread_stop(self):
+        # type: () -> None
+        self.connection.close()
+        super(RemoteMypyWorker, self).on_thread_stop()
+
+    def interrupt_current_task(self):
+        # type: () -> None
+        if self.current_task is None:
+            return
+        self.current_task.interrupted = True
+        try:
+            self.connection.send({'type': 'interrupt', 'id': self._task_id})
+        except socket.error:
+            self.connection.close()
+
+    def _execute_task(self, task):
+        # type: (MypyTask) -> Optional[Tuple[int, str, str, str, str]]
+        self._task_id += 1
+        try:
+            self.connection.send({
+                'type': 'task',
+                'id': self._task_id,
+                'path': os.path.relpath(task.filename, self.root_dir),
+                'root_dir': self.root_dir,
+            })
+        except socket.error:
+            self.connection.close()
+            return None
+
+        while True:
+            try:
+                message = self.connection.results.get(timeout=HEARTBEAT_INTERVAL)
+            except Empty:
+                if not self.connection.is_healthy(self.agent_timeout):
+                    print('Agent {} stopped responding, disconnecting'.format(self.connection.agent_name))
+                    self.connection.tasks_failed += 1
+                    self.connection.close()
+                    return None
+                continue
+
+            if message is None:
+                # The agent went away; the task gets handed to someone else.
+                self.connection.tasks_failed += 1
+                return None
+            if message['id'] != self._task_id:
+                # A stale result for a task we've already given up on.
+                continue
+
+            if message.get('failed', False):
+                # The agent couldn't run the task, and would fail the same
+                # way if it were handed out again.
+                self.connection.tasks_failed += 1
+                return -1, '', message['error'], '', ''
+            self.connection.tasks_completed += 1
+            task.timed_out = message.get('timed_out', False)
+            return (message['exit_code'], message['output'], message['error'],
+                    message['context'], message['file_hash'])
+
+
+class AgentServerThread(BaseThread):
+    """ Accepts connections from remote agents and adds a worker for each. """
+
+    def __init__(self, event_handler, address, root_dir, agent_timeout=AGENT_TIMEOUT):
+        # type: (MypyEventHandler, str, str, float) -> None
+        self.event_handler = event_handler
+        self.address = address
+        self.root_dir = root_dir
+        self.agent_timeout = agent_timeout
+        self.bound_address = None   # type: Any
+        self.ready = Event()
+        self.connections = []       # type: List[AgentConnection]
+        self._sock = None           # type: Optional[socket.socket]
+        super(AgentServerThread, self).__init__()
+
+    def agents(self):
+        # type: () -> List[Dict[str, Any]]
+        return [connection.health() for connection in self.connections]
+
+    def _listen(self):
+        # type: () -> socket.socket
+        family, address = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_UNIX:
+            assert isinstance(address, str)
+            if os.path.exists(address):
+                os.unlink(address)
+        else:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen(16)
+        self.bound_address = sock.getsockname()
+        return sock
+
+    def _on_disconnect(self, connection, worker):
+        # type: (AgentConnection, RemoteMypyWorker) -> None
+        if connection in self.connections:
+            self.connections.remove(connection)
+        print('Agent {} disconnected after {} tasks ({} agents connected)'.format(
+            connection.agent_name, connection.tasks_completed, len(self.connections)))
+        worker.stop()
+
+    def run(self):
+        # type: () -> None
+        self._sock = self._listen()
+        self.ready.set()
+        while self.should_keep_running():
+            try:
+                sock, peer = self._sock.accept()
+            except socket.error:
+                break
+            connection = AgentConnection(sock, peer)
+            worker = RemoteMypyWorker(connection, self.event_handler, self.root_dir, self.agent_timeout)
+            connection.on_close = lambda c=connection, w=worker: self._on_disconnect(c, w)
+            self.connections.append(connection)
+            connection.start()
+            worker.start()
+            self.event_handler.add_worker(worker)
+            print('Agent {} connected ({} agents connected)'.format(connection.agent_name, len(self.connections)))
+
+    def on_thread_stop(self):
+        # type: () -> None
+        if self._sock is not None:
+            close_socket(self._sock)
+        for connection in list(self.connections):
+            connection.close()
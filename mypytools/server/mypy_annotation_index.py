@@ -0,0 +1,89 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from typing import List, Optional, Tuple
+
+from mypytools.annotations import FunctionIndex, get_added_lines_by_file
+from mypytools.source_cache import SourceCache
+
+StatKey = Tuple[int, int, float]
+
+# Seconds between writing newly parsed sources back to the source cache.
+DEFAULT_SAVE_INTERVAL = 60.0
+
+
+class AnnotationIndex(object):
+    """ Keeps the function indexes of files between annotation checks so
+    only files that changed since the last check get parsed again. Entries
+    are dropped on file events and double checked against the file's stat.
+    The indexes themselves come from a SourceCache, so contents that were
+    parsed before, here or by the command line tools, aren't parsed again.
+    Newly parsed sources are written back at most every save_interval
+    seconds, and by save() at shutdown.
+    """
+
+    def __init__(self, source_cache=None, max_entries=1024, save_interval=DEFAULT_SAVE_INTERVAL):
+        # type: (Optional[SourceCache], int, float) -> None
+        self.source_cache = source_cache if source_cache is not None else SourceCache()
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        self._entries = OrderedDict()   # type: OrderedDict[str, Tuple[StatKey, FunctionIndex]]
+        self._lock = Lock()
+        self._last_saved = time.time()
+
+    def invalidate(self, path):
+        # type: (str) -> None
+        with self._lock:
+            self._entries.pop(os.path.abspath(path), None)
+
+    def get(self, path):
+        # type: (str) -> Optional[FunctionIndex]
+        """ None if the file can't be read or parsed. """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = (st.st_ino, st.st_size, st.st_mtime)
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None and entry[0] == key:
+                self._entries[path] = entry
+                return entry[1]
+
+        try:
+            function_index = self.source_cache.parse_file(path)
+        except (IOError, SyntaxError, ValueError, UnicodeDecodeError):
+            return None
+
+        with self._lock:
+            self._entries[path] = (key, function_index)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return function_index
+
+    def check(self, rev, cwd=None):
+        # type: (str, Optional[str]) -> List[Tuple[str, int]]
+        """ The (path, line) of every function touched since rev that's
+        missing annotations. Raises CalledProcessError if git fails.
+        """
+        results = []    # type: List[Tuple[str, int]]
+        for path, added_ranges in sorted(get_added_lines_by_file(rev, cwd).items()):
+            function_index = self.get(path)
+            if function_index is None:
+                continue
+            results.extend((path, line_num) for line_num in function_index.missing_annotations(added_ranges))
+        if time.time() - self._last_saved >= self.save_interval:
+            self.save()
+        return results
+
+    def save(self):
+        # type: () -> None
+        """ Writes the source cache back, if anything was parsed. """
+        self._last_saved = time.time()
+        self.source_cache.save()
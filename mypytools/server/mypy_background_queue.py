@@ -0,0 +1,90 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from collections import OrderedDict
+
+from typing import List, Optional
+
+from mypytools.server.mypy_task import MypyTask
+
+
+class BackgroundQueue(object):
+    """ Low priority tasks that workers only pick up between typechecking
+    cycles, e.g. the warm start check of the whole project.
+
+    Access is guarded by the event handler's task condition.
+    """
+
+    def __init__(self, name, report_every=0.1):
+        # type: (str, float) -> None
+        self.name = name
+        # filename -> task, in the order they'll be checked. Dependents of a
+        # changed module are discarded one by one while workers wait on the
+        # task condition, so membership has to be cheap.
+        self._tasks = OrderedDict()     # type: OrderedDict[str, MypyTask]
+        self.total = 0
+        self.completed = 0
+        self.report_every = report_every
+        self._last_reported = 0
+
+    def __len__(self):
+        # type: () -> int
+        return len(self._tasks)
+
+    @property
+    def tasks(self):
+        # type: () -> List[MypyTask]
+        return list(self._tasks.values())
+
+    def extend(self, tasks):
+        # type: (List[MypyTask]) -> None
+        for task in tasks:
+            if task.filename not in self._tasks:
+                self._tasks[task.filename] = task
+                self.total += 1
+
+    def pop(self):
+        # type: () -> Optional[MypyTask]
+        if len(self._tasks) == 0:
+            return None
+        return self._tasks.popitem(last=False)[1]
+
+    def _move_to_front(self, tasks):
+        # type: (List[MypyTask]) -> int
+        """ Returns how many of the tasks weren't queued. """
+        queued = self._tasks
+        self._tasks = OrderedDict((task.filename, task) for task in tasks)
+        added = sum(1 for filename in self._tasks if filename not in queued)
+        for filename, task in queued.items():
+            if filename not in self._tasks:
+                self._tasks[filename] = task
+        return added
+
+    def prioritize(self, tasks):
+        # type: (List[MypyTask]) -> None
+        # Moves the tasks, queued or not, ahead of everything else.
+        self.total += self._move_to_front(tasks)
+
+    def requeue(self, task):
+        # type: (MypyTask) -> None
+        # It was counted when it was first queued.
+        self._move_to_front([task])
+
+    def discard(self, task):
+        # type: (MypyTask) -> None
+        # Called when a foreground task supersedes a background one.
+        if self._tasks.pop(task.filename, None) is not None:
+            self.task_done()
+
+    def task_done(self):
+        # type: () -> None
+        self.completed += 1
+        step = max(1, int(self.total * self.report_every))
+        if self.completed == self.total:
+            print('{}: done, checked {} files'.format(self.name, self.total))
+        elif self.completed - self._last_reported >= step:
+            print('{}: {}/{} files checked'.format(self.name, self.completed, self.total))
+        else:
+            return
+        self._last_reported = self.completed
@@ -0,0 +1,125 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import shutil
+import time
+from threading import Lock, Thread
+
+from typing import List, Optional
+
+
+def _sync_key(path):
+    # type: (str) -> int
+    # mypy's .meta.json files say which .data.json they belong to, so copy
+    # the data first to never leave a meta file pointing at old data.
+    return 1 if path.endswith('.meta.json') else 0
+
+
+def sync_newer_files(src_dir, dst_dir, exclude=None):
+    # type: (str, str, Optional[str]) -> int
+    """ Copy every file in src_dir that's missing or older in dst_dir.
+
+    Files are copied to a temporary name and renamed into place so a mypy
+    process reading dst_dir never sees a half written file. Returns the
+    number of files copied. `exclude` is a directory under src_dir to skip.
+    """
+    copied = 0
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        if exclude is not None:
+            dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != exclude]
+        rel_dir = os.path.relpath(dirpath, src_dir)
+        target_dir = os.path.normpath(os.path.join(dst_dir, rel_dir))
+        for filename in sorted(filenames, key=_sync_key):
+            src_path = os.path.join(dirpath, filename)
+            dst_path = os.path.join(target_dir, filename)
+            try:
+                src_mtime = os.stat(src_path).st_mtime
+                if os.path.exists(dst_path) and os.stat(dst_path).st_mtime >= src_mtime:
+                    continue
+                if not os.path.isdir(target_dir):
+                    os.makedirs(target_dir)
+                tmp_path = '{}.{}.tmp'.format(dst_path, os.getpid())
+                shutil.copy2(src_path, tmp_path)
+                os.rename(tmp_path, dst_path)
+                copied += 1
+            except (IOError, OSError):
+                # mypy may be rewriting or removing the file under us;
+                # we'll pick it up on the next sync.
+                continue
+    return copied
+
+
+class CacheDirPool(object):
+    """ Hands out a private mypy cache directory to each worker.
+
+    Concurrent mypy processes writing to one `--cache-dir` clobber each
+    other's entries, which throws away most of the benefit of
+    `--incremental`. Instead each worker leases its own directory, seeded
+    from the shared baseline cache, and the worker directories are merged
+    back into the baseline every `merge_interval` seconds so new workers
+    (and plain `mypy` runs) start warm. `workers_dir` may live inside the
+    baseline directory; it's skipped when seeding.
+    """
+
+    def __init__(self, baseline_dir, workers_dir, merge_interval=60.0):
+        # type: (str, str, float) -> None
+        self.baseline_dir = baseline_dir
+        self.workers_dir = workers_dir
+        self.merge_interval = merge_interval
+        self._free_slots = []   # type: List[int]
+        self._num_slots = 0
+        self._lock = Lock()
+        self._last_merge = time.time()
+        self._merge_thread = None   # type: Optional[Thread]
+
+    def slot_dir(self, slot):
+        # type: (int) -> str
+        return os.path.join(self.workers_dir, 'worker-{}'.format(slot))
+
+    def acquire(self):
+        # type: () -> str
+        with self._lock:
+            if len(self._free_slots) > 0:
+                slot = self._free_slots.pop()
+            else:
+                slot = self._num_slots
+                self._num_slots += 1
+        cache_dir = self.slot_dir(slot)
+        # Pick up anything other workers have merged since this slot was used.
+        if os.path.isdir(self.baseline_dir):
+            sync_newer_files(self.baseline_dir, cache_dir, exclude=self.workers_dir)
+        elif not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        return cache_dir
+
+    def release(self, cache_dir):
+        # type: (str) -> None
+        slot = int(os.path.basename(cache_dir).split('-')[-1])
+        with self._lock:
+            self._free_slots.append(slot)
+
+    def merge(self):
+        # type: () -> int
+        copied = 0
+        with self._lock:
+            slots = range(self._num_slots)
+        for slot in slots:
+            slot_dir = self.slot_dir(slot)
+            if os.path.isdir(slot_dir):
+                copied += sync_newer_files(slot_dir, self.baseline_dir)
+        return copied
+
+    def maybe_merge(self):
+        # type: () -> None
+        # Merging touches a lot of files, so do it in the background and
+        # at most once per merge_interval.
+        if time.time() - self._last_merge < self.merge_interval:
+            return
+        if self._merge_thread is not None and self._merge_thread.is_alive():
+            return
+        self._last_merge = time.time()
+        self._merge_thread = Thread(target=self.merge)
+        self._merge_thread.daemon = True
+        self._merge_thread.start()
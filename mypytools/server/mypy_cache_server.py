@@ -0,0 +1,107 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import json
+import re
+import sys
+from collections import OrderedDict
+from threading import Lock
+
+from typing import Any, Optional
+
+if sys.version_info[0] > 2:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+else:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class ResultStore(object):
+    """ An LRU map from cache key to the JSON encoded result. """
+
+    def __init__(self, max_entries):
+        # type: (int) -> None
+        self.max_entries = max_entries
+        self._results = OrderedDict()   # type: OrderedDict[str, bytes]
+        self._lock = Lock()
+
+    def get(self, key):
+        # type: (str) -> Optional[bytes]
+        with self._lock:
+            result = self._results.pop(key, None)
+            if result is not None:
+                self._results[key] = result
+            return result
+
+    def put(self, key, result):
+        # type: (str, bytes) -> None
+        with self._lock:
+            self._results.pop(key, None)
+            self._results[key] = result
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def __len__(self):
+        # type: () -> int
+        return len(self._results)
+
+
+class MypyCacheRequestHandler(BaseHTTPRequestHandler):
+    result_path_regex = re.compile(r'^/v1/result/([0-9a-f]+)$')
+    max_body_size = 16 * 1024 * 1024
+
+    def _set_headers(self, response_code):
+        # type: (int) -> None
+        self.send_response(response_code)
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+
+    def do_GET(self):
+        # type: () -> None
+        result = self.result_path_regex.match(self.path)
+        if result is None:
+            self._set_headers(response_code=404)
+            return
+
+        output = self.server.store.get(result.group(1))     # type: ignore
+        if output is None:
+            self._set_headers(response_code=404)
+            return
+
+        self._set_headers(response_code=200)
+        self.wfile.write(output)
+
+    def do_PUT(self):
+        # type: () -> None
+        result = self.result_path_regex.match(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        if result is None or length > self.max_body_size:
+            self._set_headers(response_code=400)
+            return
+
+        body = self.rfile.read(length)
+        try:
+            json.loads(body.decode('utf-8'))
+        except ValueError:
+            self._set_headers(response_code=400)
+            return
+
+        self.server.store.put(result.group(1), body)    # type: ignore
+        self._set_headers(response_code=204)
+
+    def log_message(self, format, *args):
+        # type: (str, *Any) -> None
+        return
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_cache_server(host, port, max_entries):
+    # type: (str, int, int) -> ThreadedHTTPServer
+    httpd = ThreadedHTTPServer((host, port), MypyCacheRequestHandler)
+    httpd.store = ResultStore(max_entries)  # type: ignore
+    return httpd
@@ -0,0 +1,82 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import re
+import sys
+from collections import namedtuple, OrderedDict
+
+# Used by mypy_client.py, which runs on every save, so typing is only
+# needed by mypy.
+MYPY = False
+if MYPY:
+    from typing import Any, Dict, List, Optional, Tuple  # noqa
+
+# Matches lines like `path.py:12:5: error: Some message  [error-code]`.
+# The column and error code are only there with the matching mypy flags.
+DIAGNOSTIC_REGEX = re.compile(
+    r'^(?P<path>.+?):(?P<line>\d+):(?:(?P<column>\d+):)?\s(?P<severity>error|warning|note):\s'
+    r'(?P<message>.*?)(?:\s\s\[(?P<code>[a-z0-9\-]+)\])?$')
+
+Diagnostic = namedtuple('Diagnostic', ['path', 'line', 'column', 'severity', 'code', 'message'])
+
+if sys.version_info[0] > 2:
+    intern = sys.intern
+else:
+    intern = intern  # noqa
+
+
+def parse_diagnostic(line):
+    # type: (str) -> Optional[Diagnostic]
+    result = DIAGNOSTIC_REGEX.match(line)
+    if result is None:
+        return None
+    column = result.group('column')
+    return Diagnostic(
+        # Many diagnostics share a path and a severity, so only keep one copy.
+        intern(result.group('path')),
+        int(result.group('line')),
+        None if column is None else int(column),
+        intern(result.group('severity')),
+        result.group('code'),
+        result.group('message'))
+
+
+def parse_mypy_output(output):
+    # type: (str) -> List[Diagnostic]
+    diagnostics = []
+    for line in output.split('\n'):
+        diagnostic = parse_diagnostic(line)
+        if diagnostic is not None:
+            diagnostics.append(diagnostic)
+    return diagnostics
+
+
+def diagnostic_to_json(diagnostic):
+    # type: (Diagnostic) -> Dict[str, Any]
+    return dict(diagnostic._asdict())
+
+
+def format_diagnostic(diagnostic):
+    # type: (Diagnostic) -> str
+    """ The line mypy printed for the diagnostic. """
+    column = '' if diagnostic.column is None else '{}:'.format(diagnostic.column)
+    code = '' if diagnostic.code is None else '  [{}]'.format(diagnostic.code)
+    return '{}:{}:{} {}: {}{}'.format(
+        diagnostic.path, diagnostic.line, column, diagnostic.severity, diagnostic.message, code)
+
+
+def group_output_by_path(output):
+    # type: (str) -> Dict[str, Tuple[List[str], List[Diagnostic]]]
+    """ Splits mypy's output into the lines and diagnostics for each file
+    they refer to, in the order the files first appear.
+    """
+    groups = OrderedDict()  # type: Dict[str, Tuple[List[str], List[Diagnostic]]]
+    for line in output.split('\n'):
+        diagnostic = parse_diagnostic(line)
+        if diagnostic is None:
+            continue
+        lines, diagnostics = groups.setdefault(diagnostic.path, ([], []))
+        lines.append(line)
+        diagnostics.append(diagnostic)
+    return groups
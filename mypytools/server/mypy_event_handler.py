@@ -3,17 +3,24 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 from threading import Condition
+import hashlib
+import io
 import os
 import sys
 
 from findimports import ModuleGraph, Module
-from typing import List, Optional, Set, TYPE_CHECKING
+from typing import Any, Dict, List, Optional, Set, TYPE_CHECKING
 from watchdog.events import FileSystemEvent
 from watchdog.utils import BaseThread
 
-from mypytools.server.mypy_task import MypyTask
+from mypytools.config import config, get_src_dirs, reload_config_file
+from mypytools.server.mypy_background_queue import BackgroundQueue
+from mypytools.server.mypy_fingerprints import fingerprint_cache
+from mypytools.server.mypy_task import BufferTask, MypyTask
+from mypytools.server.mypy_toolchain import get_profiles, load_profiles
 from mypytools.server.mypy_worker import MypyWorker
 if TYPE_CHECKING:
+    from mypytools.server.mypy_cache_dirs import CacheDirPool
     from mypytools.server.mypy_file_cache import MypyFileCache
     from mypytools.server.mypy_queueing_handler import MypyQueueingHandler
 
@@ -33,8 +40,8 @@ def print_divider(text=None, newline_before=False):
 
 
 class MypyEventHandler(BaseThread):
-    def __init__(self, dep_graph, queueing_handler, file_cache, compact, num_workers):
-        # type: (ModuleGraph, MypyQueueingHandler, MypyFileCache, bool, int) -> None
+    def __init__(self, dep_graph, queueing_handler, file_cache, compact, num_workers, cache_dir_pool=None):
+        # type: (ModuleGraph, MypyQueueingHandler, MypyFileCache, bool, int, Optional[CacheDirPool]) -> None
         self.dep_graph = dep_graph
         self.worker_pool = []   # type: List[MypyWorker]
         self.task_pool = []     # type: List[MypyTask]
@@ -43,6 +50,12 @@ class MypyEventHandler(BaseThread):
         self.file_cache = file_cache
         self.compact = compact
         self.num_workers = num_workers
+        # How many local workers to run, adjusted by the resource monitor.
+        self.target_workers = num_workers
+        self.cycle_active = False
+        self.background_queue = BackgroundQueue('Warm start')
+        self.buffer_tasks = []  # type: List[BufferTask]
+        self.cache_dir_pool = cache_dir_pool
         super(MypyEventHandler, self).__init__()
 
     def on_deleted(self, event):
@@ -57,6 +70,7 @@ class MypyEventHandler(BaseThread):
         # type: (MypyTask, Optional[int]) -> None
         if task in self.task_pool:
             return
+        self.background_queue.discard(task)
         if index is None:
             self.task_pool.append(task)
         else:
@@ -111,29 +125,127 @@ class MypyEventHandler(BaseThread):
         dependencies_to_check.update({os.path.abspath(module_.filename) for module_ in modified_modules})
         return dependencies_to_check
 
+    def add_worker(self, worker):
+        # type: (MypyWorker) -> None
+        self.task_cond.acquire()
+        worker.run_tasks = self.cycle_active
+        worker.run_background = not self.cycle_active
+        self.worker_pool.append(worker)
+        self.task_cond.notify_all()
+        self.task_cond.release()
+
+    def remove_worker(self, worker):
+        # type: (MypyWorker) -> None
+        self.task_cond.acquire()
+        if worker in self.worker_pool:
+            self.worker_pool.remove(worker)
+        self.task_cond.notify_all()
+        self.task_cond.release()
+
+    def _transitive_imports(self, root_module):
+        # type: (Module) -> Set[str]
+        modules = self.dep_graph.modules
+        seen = set()    # type: Set[str]
+        to_visit = list(root_module.imports)
+        while len(to_visit) > 0:
+            modname = to_visit.pop()
+            module_ = modules.get(modname) or modules.get('{}.__init__'.format(modname))
+            if module_ is None or module_.modname in seen:
+                continue
+            seen.add(module_.modname)
+            to_visit.extend(module_.imports)
+        seen.discard(root_module.modname)
+        return {os.path.abspath(modules[modname].filename) for modname in seen}
+
+    def _dependency_fingerprint(self, filename, file_hashes):
+        # type: (str, Dict[str, str]) -> str
+        remote = self.file_cache.remote
+        assert remote is not None
+        module_ = self._find_modified_module(filename)
+        if module_ is None:
+            return ''
+        fingerprint = hashlib.md5()
+        for dependency in sorted(self._transitive_imports(module_)):
+            if dependency not in file_hashes:
+                try:
+                    file_hashes[dependency] = fingerprint_cache.get(dependency)
+                except (IOError, OSError):
+                    file_hashes[dependency] = ''
+            # Relative to the root, so checkouts in other directories match.
+            fingerprint.update('{}:{}\n'.format(os.path.relpath(dependency, remote.root_dir),
+                                                 file_hashes[dependency]).encode('utf-8'))
+        return fingerprint.hexdigest()
+
+    def _fingerprint_tasks(self, tasks):
+        # type: (List[MypyTask]) -> None
+        # Results in the remote cache are only valid for the exact contents
+        # of everything a file imports, so tag each task with a fingerprint
+        # of its dependencies. Hashes are shared across the whole cycle.
+        file_hashes = {}    # type: Dict[str, str]
+        for task in tasks:
+            task.dependency_fingerprint = self._dependency_fingerprint(task.filename, file_hashes)
+
+    def local_workers(self):
+        # type: () -> List[MypyWorker]
+        # Remote workers come and go with their agents, so they don't count
+        # towards the number of workers we run. Neither do workers that have
+        # been asked to stop but are finishing off a task.
+        return [worker for worker in self.worker_pool if not worker.is_remote and worker.should_keep_running()]
+
     def _ensure_workers(self):
         # type: () -> None
-        while len(self.worker_pool) < self.num_workers:
-            worker = MypyWorker(self.task_pool, self.task_cond, self.file_cache, self.compact)
+        local_workers = self.local_workers()
+        while len(local_workers) < self.target_workers:
+            worker = MypyWorker(self.task_pool, self.task_cond, self.file_cache, self.compact,
+                                self.background_queue, self.cache_dir_pool, self.buffer_tasks)
+            worker.run_tasks = self.cycle_active
+            worker.run_background = not self.cycle_active
+            worker.on_exit = self.remove_worker
             self.worker_pool.append(worker)
+            local_workers.append(worker)
             worker.start()
 
+    def scale_workers(self, target):
+        # type: (int) -> None
+        # Must be called with task_cond held.
+        print('Scaling from {} to {} workers'.format(len(self.local_workers()), target))
+        self.target_workers = target
+        local_workers = self.local_workers()
+        if len(local_workers) < target:
+            self._ensure_workers()
+            return
+        # Stop idle workers first. Busy ones finish their task before exiting.
+        local_workers.sort(key=lambda worker: worker.current_task is not None)
+        for worker in local_workers[target:]:
+            worker.stop()
+
     def _disable_workers(self):
         # type: () -> None
         # Prevent workers from consuming any tasks in the queue until we're ready.
+        # Background tasks can run again until the next cycle starts.
+        self.cycle_active = False
         for worker in self.worker_pool:
             worker.run_tasks = False
+            worker.run_background = True
+        self.task_cond.notify_all()
 
     def _enable_workers(self):
         # type: () -> None
         # Mark all workers to start running tasks and interrupt any
         # workers with tasks that will need to be re-run.
+        # Background tasks yield straight away and get re-queued.
+        self.cycle_active = True
         for worker in self.worker_pool:
             worker.run_tasks = True
+            worker.run_background = False
             if worker.current_task is None:
                 continue
-            if worker.current_task in self.task_pool:
-                worker.current_task.interrupt()
+            if worker.current_task_is_background or worker.current_task in self.task_pool:
+                worker.interrupt_current_task()
+            else:
+                # The run predates this cycle's changes, so what it says
+                # about other files may already be stale.
+                worker.current_task.credit_siblings = False
         self.task_cond.notify_all()
 
     def _wait_until_tasks_completed(self):
@@ -156,17 +268,154 @@ class MypyEventHandler(BaseThread):
             while not all_clear:
                 all_clear = True
                 for worker in self.worker_pool:
-                    if worker.current_task is not None:
+                    task = worker.current_task
+                    if task is not None and not worker.current_task_is_background and not task.is_buffer:
                         all_clear = False
                         break
                 if not all_clear:
                     self.task_cond.wait()
 
+    def _add_src_dir(self, src_dir):
+        # type: (str) -> None
+        old_stdout = sys.stdout
+        old_stderr = sys.stderr
+        sys.stdout = io.StringIO()  # type: ignore
+        sys.stderr = io.StringIO()  # type: ignore
+        try:
+            self.dep_graph.parsePathname(src_dir)
+        finally:
+            sys.stdout = old_stdout
+            sys.stderr = old_stderr
+
+    def _remove_src_dir(self, src_dir):
+        # type: (str) -> None
+        modules = self.dep_graph.modules
+        for modname in list(modules):
+            if os.path.abspath(modules[modname].filename).startswith(src_dir):
+                del modules[modname]
+
+    def apply_config_change(self, old_config):
+        # type: (Dict[str, Any]) -> None
+        # Must be called with task_cond held, after the new config is loaded.
+        old_profiles = get_profiles()
+        new_profiles = load_profiles(config)
+
+        old_src_dirs = {os.path.join(old_config['root_dir'], d['path']) for d in old_config.get('src_dirs', [])}
+        new_src_dirs = set(get_src_dirs())
+        for src_dir in old_src_dirs - new_src_dirs:
+            print('Removing {}'.format(src_dir))
+            self._remove_src_dir(src_dir)
+        for src_dir in new_src_dirs - old_src_dirs:
+            print('Adding {}'.format(src_dir))
+            self._add_src_dir(src_dir)
+        self.queueing_handler.src_dirs = sorted(new_src_dirs)
+
+        # Only results checked with different flags need to go.
+        def flags_changed(filename):
+            # type: (str) -> bool
+            return old_profiles.profile_for(filename).command != new_profiles.profile_for(filename).command
+        num_invalidated = self.file_cache.invalidate(flags_changed)
+        print('Invalidated {} cached results'.format(num_invalidated))
+
+        for key in ('port', 'remote_cache'):
+            if old_config.get(key) != config.get(key):
+                print('Restart the server to pick up the new {} setting'.format(key))
+
+    def on_config_changed(self):
+        # type: () -> None
+        print_divider('RELOADING CONFIG', newline_before=True)
+        self.task_cond.acquire()
+        old_config = dict(config)
+        try:
+            reload_config_file()
+        except (IOError, ValueError, RuntimeError):
+            print('Keeping the old config')
+        else:
+            self.apply_config_change(old_config)
+        print_divider('DONE')
+        self.task_cond.release()
+
+    def queue_warm_start(self):
+        # type: () -> None
+        # Queue up every file in the graph as a background check so the
+        # cache is warm by the time anyone asks for results.
+        self.task_cond.acquire()
+        tasks = [MypyTask(os.path.abspath(module_.filename)) for module_ in self.dep_graph.listModules()]
+        if self.file_cache.remote is not None:
+            self._fingerprint_tasks(tasks)
+        self.background_queue.extend(tasks)
+        print('Warm start: queued {} files'.format(len(tasks)))
+        self._ensure_workers()
+        for worker in self.worker_pool:
+            worker.run_background = not self.cycle_active
+        self.task_cond.notify_all()
+        self.task_cond.release()
+
+    def request_checks(self, filenames):
+        # type: (List[str]) -> Set[str]
+        """ Queues the files ahead of any other background work, unless a
+        check is already queued or running, e.g. when an editor asks about
+        files the server has no results for. Returns the files with a check
+        pending, leaving out the ones the server doesn't check.
+        """
+        self.task_cond.acquire()
+        try:
+            pending = {task.filename for task in self.task_pool}
+            pending.update(worker.current_task.filename for worker in self.worker_pool
+                           if worker.current_task is not None)
+            tasks = []
+            for filename in filenames:
+                if filename in pending:
+                    continue
+                if not self.queueing_handler.should_check_file(filename):
+                    continue
+                tasks.append(MypyTask(filename))
+                pending.add(filename)
+            if len(tasks) > 0:
+                if self.file_cache.remote is not None:
+                    self._fingerprint_tasks(tasks)
+                self.background_queue.prioritize(tasks)
+                self._ensure_workers()
+                for worker in self.worker_pool:
+                    worker.run_background = not self.cycle_active
+                self.task_cond.notify_all()
+            return pending.intersection(filenames)
+        finally:
+            self.task_cond.release()
+
+    def request_buffer_check(self, task):
+        # type: (BufferTask) -> bool
+        """ Queues a check of an editor's unsaved buffer ahead of all other
+        work, replacing any queued check of an older buffer for the file.
+        Returns False if the server doesn't check the file.
+        """
+        if not self.queueing_handler.should_check_file(task.filename):
+            return False
+        self.task_cond.acquire()
+        try:
+            for worker in self.worker_pool:
+                current_task = worker.current_task
+                if (current_task is not None and current_task == task and
+                        current_task.buffer_hash == task.buffer_hash):     # type: ignore
+                    return True
+            if self.file_cache.remote is not None:
+                self._fingerprint_tasks([task])
+            if task in self.buffer_tasks:
+                self.buffer_tasks[self.buffer_tasks.index(task)] = task
+            else:
+                self.buffer_tasks.append(task)
+            self._ensure_workers()
+            self.task_cond.notify_all()
+            return True
+        finally:
+            self.task_cond.release()
+
     def on_modified(self, event):
         # type: (FileSystemEvent) -> None
         print_divider('TYPECHECKING', newline_before=True)
 
         self.task_cond.acquire()
+        self.file_cache.clear_buffers()
 
         modified_module = self._find_modified_module(event.src_path)
         if modified_module is None:
@@ -181,12 +430,17 @@ class MypyEventHandler(BaseThread):
         for filename in dependencies_to_check:
             self._add_task(MypyTask(filename))
 
+        if self.file_cache.remote is not None:
+            self._fingerprint_tasks(self.task_pool)
+
         self._ensure_workers()
         self._enable_workers()
         self._wait_until_tasks_completed()
         self._disable_workers()
 
         print_divider('DONE')
+        if self.cache_dir_pool is not None:
+            self.cache_dir_pool.maybe_merge()
         self.task_cond.release()
 
     def run(self):
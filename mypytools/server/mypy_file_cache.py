@@ -3,24 +3,114 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 import hashlib
-from typing import Dict, Tuple, Optional
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Sequence, Tuple, Optional, TYPE_CHECKING
+
+from mypytools.server.mypy_diagnostics import Diagnostic
+if TYPE_CHECKING:
+    from mypytools.server.mypy_remote_cache import RemoteCacheClient
+
+
+# How many results of checking editors' unsaved buffers to keep.
+MAX_BUFFER_RESULTS = 256
+
+# What came of checking a file. Timed out results have no diagnostics, but
+# stop clients from waiting on a check that won't finish.
+RESULT_DONE = 'done'
+RESULT_TIMED_OUT = 'timed_out'
 
 
 class MypyFileCache(object):
-    def __init__(self):
-        # type: () -> None
-        self._cache = {}    # type: Dict[str, Tuple[str, str]]
+    def __init__(self, remote=None, max_buffer_results=MAX_BUFFER_RESULTS):
+        # type: (Optional[RemoteCacheClient], int) -> None
+        # filename hash -> (file hash, output, filename, diagnostics, status)
+        self._cache = {}    # type: Dict[str, Tuple[str, str, str, Tuple[Diagnostic, ...], str]]
+        # (filename, buffer hash) -> (output, diagnostics, status), kept
+        # apart so they don't replace the results for what's on disk.
+        self._buffers = OrderedDict()   # type: OrderedDict[Tuple[str, str], Tuple[str, Tuple[Diagnostic, ...], str]]
+        self.max_buffer_results = max_buffer_results
+        # An optional shared cache consulted before running mypy.
+        self.remote = remote
+        # Buffer results are looked up from the HTTP thread while workers
+        # and file events change the cache.
+        self._lock = Lock()
 
     def lookup(self, filename_hash, file_hash):
-        # type: (str, int) -> Optional[str]
+        # type: (str, str) -> Optional[str]
         result = self._cache.get(filename_hash)
         if result is None:
             return None
-        if result[0] != file_hash:
+        if result[0] != file_hash or result[4] != RESULT_DONE:
             return None
         return result[1]
 
-    def store(self, filename, file_hash, output):
-        # type: (str, str, str) -> None
-        self._cache[hashlib.md5(filename.encode('utf-8')).hexdigest()] = (file_hash, output)
+    def lookup_diagnostics(self, filename_hash, file_hash):
+        # type: (str, str) -> Optional[Tuple[Diagnostic, ...]]
+        result = self._cache.get(filename_hash)
+        if result is None:
+            return None
+        if result[0] != file_hash or result[4] != RESULT_DONE:
+            return None
+        return result[3]
+
+    def lookup_status(self, filename_hash, file_hash):
+        # type: (str, str) -> Optional[str]
+        """ One of the RESULT_ constants, None if there's no result. """
+        result = self._cache.get(filename_hash)
+        if result is None or result[0] != file_hash:
+            return None
+        return result[4]
+
+    def store(self, filename, file_hash, output, diagnostics=(), status=RESULT_DONE):
+        # type: (str, str, str, Sequence[Diagnostic], str) -> None
+        with self._lock:
+            self._cache[hashlib.md5(filename.encode('utf-8')).hexdigest()] = (
+                file_hash, output, filename, tuple(diagnostics), status)
+
+    def lookup_buffer(self, filename, buffer_hash):
+        # type: (str, str) -> Optional[Tuple[str, Tuple[Diagnostic, ...]]]
+        """ The status and diagnostics for the buffer, None if there's no
+        result.
+        """
+        # The result for the file on disk is just as good when the buffer
+        # hasn't been changed since it was saved.
+        filename_hash = hashlib.md5(filename.encode('utf-8')).hexdigest()
+        with self._lock:
+            entry = self._cache.get(filename_hash)
+            if entry is not None and entry[0] == buffer_hash:
+                return entry[4], entry[3]
+            result = self._buffers.get((filename, buffer_hash))
+        return None if result is None else (result[2], result[1])
+
+    def lookup_buffer_diagnostics(self, filename, buffer_hash):
+        # type: (str, str) -> Optional[Tuple[Diagnostic, ...]]
+        result = self.lookup_buffer(filename, buffer_hash)
+        if result is None or result[0] != RESULT_DONE:
+            return None
+        return result[1]
+
+    def store_buffer(self, filename, buffer_hash, output, diagnostics=(), status=RESULT_DONE):
+        # type: (str, str, str, Sequence[Diagnostic], str) -> None
+        with self._lock:
+            self._buffers.pop((filename, buffer_hash), None)
+            self._buffers[(filename, buffer_hash)] = (output, tuple(diagnostics), status)
+            while len(self._buffers) > self.max_buffer_results:
+                self._buffers.popitem(last=False)
+
+    def clear_buffers(self):
+        # type: () -> None
+        # Buffer results aren't rechecked when the files they import change.
+        with self._lock:
+            self._buffers.clear()
+
+    def invalidate(self, should_invalidate):
+        # type: (Callable[[str], bool]) -> int
+        with self._lock:
+            stale = [key for key, entry in self._cache.items() if should_invalidate(entry[2])]
+            for key in stale:
+                del self._cache[key]
+            for buffer_key in [buffer_key for buffer_key in self._buffers if should_invalidate(buffer_key[0])]:
+                del self._buffers[buffer_key]
+        return len(stale)
 
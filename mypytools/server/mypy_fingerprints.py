@@ -0,0 +1,71 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import hashlib
+import os
+import time
+from collections import namedtuple
+from threading import Lock
+
+from typing import Dict, Tuple
+
+# A file modified this recently might change again without its mtime or
+# size moving, so its hash isn't kept.
+RACY_WINDOW = 1.0
+
+# (inode, mtime in ns where the platform has it, size)
+StatKey = Tuple[int, float, int]
+
+Fingerprint = namedtuple('Fingerprint', ['mtime', 'size', 'content_hash'])
+
+
+class FingerprintCache(object):
+    """ The md5 of each file's contents by its stat, so a file is only read
+    again once it changes. The file watcher drops entries as files change,
+    and the stat catches anything it misses.
+    """
+
+    def __init__(self, racy_window=RACY_WINDOW):
+        # type: (float) -> None
+        self.racy_window = racy_window
+        self._entries = {}  # type: Dict[str, Tuple[StatKey, Fingerprint]]
+        self._lock = Lock()
+
+    def invalidate(self, path):
+        # type: (str) -> None
+        with self._lock:
+            self._entries.pop(os.path.abspath(path), None)
+
+    def fingerprint(self, path):
+        # type: (str) -> Fingerprint
+        """ Raises IOError/OSError if the file can't be read. """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        key = (st.st_ino, getattr(st, 'st_mtime_ns', st.st_mtime), st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+
+        # If the file changes while it's read, its mtime moves past the one
+        # in the key and the next lookup hashes it again.
+        read_at = time.time()
+        with open(path, 'rb') as f:
+            fingerprint = Fingerprint(st.st_mtime, st.st_size, hashlib.md5(f.read()).hexdigest())
+        with self._lock:
+            if read_at - st.st_mtime > self.racy_window:
+                self._entries[path] = (key, fingerprint)
+            else:
+                self._entries.pop(path, None)
+        return fingerprint
+
+    def get(self, path):
+        # type: (str) -> str
+        """ The md5 of the file's contents. Raises IOError/OSError if it
+        can't be read.
+        """
+        return self.fingerprint(path).content_hash
+
+
+fingerprint_cache = FingerprintCache()
@@ -0,0 +1,85 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import socket
+import sys
+
+# Imported by editors on every save, so typing is only needed by mypy.
+MYPY = False
+if MYPY:
+    from typing import Optional, Tuple  # noqa
+
+if sys.version_info[0] > 2:
+    from http.client import HTTPConnection
+else:
+    from httplib import HTTPConnection
+
+# Where the HTTP API is also served with --unix-socket, relative to the
+# project root. Clients use it instead of TCP when it's there.
+HTTP_SOCKET_FILENAME = '.mypy_server.sock'
+
+DEFAULT_TIMEOUT = 5.0
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """ An HTTPConnection to a server listening on a unix socket. """
+
+    def __init__(self, path, timeout=DEFAULT_TIMEOUT):
+        # type: (str, float) -> None
+        HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        # type: () -> None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class MypyServerClient(object):
+    """ Makes requests to a running mypy_server.py. Goes through the unix
+    socket in the project root when the server was started with
+    --unix-socket, and over TCP on the configured port otherwise.
+    """
+
+    def __init__(self, root_dir, port, timeout=DEFAULT_TIMEOUT):
+        # type: (str, Optional[int], float) -> None
+        self.socket_path = os.path.join(root_dir, HTTP_SOCKET_FILENAME)
+        self.port = port
+        self.timeout = timeout
+
+    def _request(self, connection, method, path, body=None):
+        # type: (HTTPConnection, str, str, Optional[bytes]) -> Tuple[int, bytes]
+        try:
+            connection.request(method, path, body)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def request(self, method, path, body=None):
+        # type: (str, str, Optional[bytes]) -> Tuple[int, bytes]
+        """ The status and body of the response. Raises socket.error if the
+        server can't be reached either way.
+        """
+        if os.path.exists(self.socket_path):
+            try:
+                return self._request(UnixHTTPConnection(self.socket_path, self.timeout), method, path, body)
+            except socket.error:
+                # The socket may be left over from a server that's gone.
+                if self.port is None:
+                    raise
+        if self.port is None:
+            raise socket.error('No mypy server socket at {}'.format(self.socket_path))
+        return self._request(HTTPConnection('127.0.0.1', self.port, timeout=self.timeout), method, path, body)
+
+    def get(self, path):
+        # type: (str) -> Tuple[int, bytes]
+        return self.request('GET', path)
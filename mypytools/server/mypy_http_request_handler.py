@@ -2,24 +2,43 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
+import errno
+import hashlib
 import json
+import os
+import socket
+import subprocess
 import sys
 import re
-from typing import Any
+from threading import Event
+from typing import Any, List, Optional, Set, Tuple, Union, TYPE_CHECKING
 
 from watchdog.utils import BaseThread
 
-from mypytools.config import config
-from mypytools.server.mypy_file_cache import MypyFileCache
+from mypytools.config import get_config
+from mypytools.server.mypy_annotation_index import AnnotationIndex
+from mypytools.server.mypy_diagnostics import Diagnostic, diagnostic_to_json
+from mypytools.server.mypy_file_cache import RESULT_DONE, RESULT_TIMED_OUT, MypyFileCache
+from mypytools.server.mypy_fingerprints import fingerprint_cache
+from mypytools.server.mypy_http_client import HTTP_SOCKET_FILENAME
+from mypytools.server.mypy_task import BufferTask
+if TYPE_CHECKING:
+    from mypytools.server.mypy_event_handler import MypyEventHandler
 
 if sys.version_info[0] > 2:
     from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import TCPServer
+    from urllib.parse import parse_qs, urlparse
 else:
     from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
-
+    from SocketServer import TCPServer
+    from urlparse import parse_qs, urlparse
 
 class MypyHttpRequestHandler(BaseHTTPRequestHandler):
     file_path_regex = re.compile(r'^/file/([0-9a-f]+)/([0-9a-f]+)$')
+    v1_file_path_regex = re.compile(r'^/v1/file/([0-9a-f]+)/([0-9a-f]+)$')
+    # Anything git accepts as a revision, as long as it can't be taken for an option.
+    rev_regex = re.compile(r'^[\w./~^@{}:-]+$')
 
     def _set_headers(self, response_code):
         # type: (int) -> None
@@ -27,8 +46,185 @@ class MypyHttpRequestHandler(BaseHTTPRequestHandler):
         self.send_header('Content-type', 'application/json')
         self.end_headers()
 
+    def _write_json(self, obj):
+        # type: (Any) -> None
+        self.wfile.write(json.dumps(obj).encode('utf-8'))
+
+    def _get_diagnostics(self, file_name_hash, file_content_hash):
+        # type: (str, str) -> None
+        file_cache = self.server.file_cache     # type: ignore
+        diagnostics = file_cache.lookup_diagnostics(file_name_hash, file_content_hash)
+
+        if diagnostics is None:
+            if file_cache.lookup_status(file_name_hash, file_content_hash) == RESULT_TIMED_OUT:
+                self._set_headers(response_code=504)
+                self._write_json({'status': RESULT_TIMED_OUT})
+                return
+            self._set_headers(response_code=404)
+            return
+
+        self._set_headers(response_code=200)
+        self._write_json([diagnostic_to_json(diagnostic) for diagnostic in diagnostics])
+
+    def _read_json(self):
+        # type: () -> Any
+        """ Raises ValueError if the body isn't JSON. """
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    def _is_under_root(self, path):
+        # type: (str) -> bool
+        root_dir = os.path.join(os.path.abspath(self.server.root_dir), '')     # type: ignore
+        return os.path.isabs(path) and os.path.normpath(path).startswith(root_dir)
+
+    def _lookup_path(self, path):
+        # type: (str) -> Tuple[Optional[str], Optional[str], Tuple[Diagnostic, ...]]
+        """ The server's hash of the file, None if it can't be read, and the
+        status and diagnostics of the result for that exact content, if
+        there is one yet.
+        """
+        try:
+            content_hash = fingerprint_cache.get(path)
+        except (IOError, OSError):
+            return None, None, ()
+        file_cache = self.server.file_cache     # type: ignore
+        name_hash = hashlib.md5(path.encode('utf-8')).hexdigest()
+        status = file_cache.lookup_status(name_hash, content_hash)
+        if status != RESULT_DONE:
+            return content_hash, status, ()
+        return content_hash, status, file_cache.lookup_diagnostics(name_hash, content_hash)
+
+    def _get_path_diagnostics(self, query):
+        # type: (str) -> None
+        paths = parse_qs(query).get('path', [])
+        if len(paths) != 1 or not self._is_under_root(paths[0]):
+            self._set_headers(response_code=400)
+            root_dir = self.server.root_dir     # type: ignore
+            self._write_json({'error': 'Expected a single absolute path under {}'.format(root_dir)})
+            return
+
+        path = os.path.normpath(paths[0])
+        content_hash, status, diagnostics = self._lookup_path(path)
+        if status == RESULT_TIMED_OUT:
+            self._set_headers(response_code=504)
+            self._write_json({'path': path, 'hash': content_hash, 'status': status})
+            return
+        if status is None:
+            self._set_headers(response_code=404)
+            self._write_json({'path': path, 'hash': content_hash})
+            return
+
+        self._set_headers(response_code=200)
+        self._write_json({
+            'path': path,
+            'hash': content_hash,
+            'diagnostics': [diagnostic_to_json(diagnostic) for diagnostic in diagnostics],
+        })
+
+    def _post_check(self):
+        # type: () -> None
+        try:
+            paths = [os.path.normpath(path) for path in self._read_json()['paths']]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self._set_headers(response_code=400)
+            self._write_json({'error': 'Expected {"paths": [...]}'})
+            return
+
+        results = []
+        unchecked = []  # type: List[str]
+        for path in paths:
+            if not self._is_under_root(path):
+                results.append({'path': path, 'hash': None, 'status': 'missing', 'diagnostics': None})
+                continue
+            content_hash, status, diagnostics = self._lookup_path(path)
+            result = {'path': path, 'hash': content_hash, 'status': status or 'missing', 'diagnostics': None}
+            if status == RESULT_DONE:
+                result['diagnostics'] = [diagnostic_to_json(diagnostic) for diagnostic in diagnostics]
+            elif status is None and content_hash is not None:
+                unchecked.append(path)
+            results.append(result)
+
+        # Files without results jump the queue, unless the server doesn't
+        # check them at all.
+        event_handler = getattr(self.server, 'event_handler', None)    # type: Optional[MypyEventHandler]
+        pending = set()     # type: Set[str]
+        if event_handler is not None and len(unchecked) > 0:
+            pending = event_handler.request_checks(unchecked)
+        for result in results:
+            if result['status'] == 'missing' and result['hash'] is not None:
+                result['status'] = 'pending' if result['path'] in pending else 'unchecked'
+
+        self._set_headers(response_code=200)
+        self._write_json(results)
+
+    def _post_buffer(self):
+        # type: () -> None
+        try:
+            body = self._read_json()
+            path = os.path.normpath(body['path'])
+            task = BufferTask(path, body['contents'])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            task = None
+        if task is None or not self._is_under_root(path):
+            self._set_headers(response_code=400)
+            self._write_json({'error': 'Expected {"path": <absolute path>, "contents": ...}'})
+            return
+
+        result = {'path': path, 'hash': task.buffer_hash, 'status': RESULT_DONE, 'diagnostics': None}
+        file_cache = self.server.file_cache     # type: ignore
+        buffer_result = file_cache.lookup_buffer(path, task.buffer_hash)
+        if buffer_result is not None:
+            result['status'] = buffer_result[0]
+            if buffer_result[0] == RESULT_DONE:
+                result['diagnostics'] = [diagnostic_to_json(diagnostic) for diagnostic in buffer_result[1]]
+        else:
+            event_handler = getattr(self.server, 'event_handler', None)    # type: Optional[MypyEventHandler]
+            if event_handler is not None and event_handler.request_buffer_check(task):
+                result['status'] = 'pending'
+            else:
+                result['status'] = 'unchecked'
+
+        self._set_headers(response_code=200)
+        self._write_json(result)
+
+    def _get_annotations(self, query):
+        # type: (str) -> None
+        annotation_index = getattr(self.server, 'annotation_index', None)     # type: Optional[AnnotationIndex]
+        if annotation_index is None:
+            self._set_headers(response_code=404)
+            return
+
+        revs = parse_qs(query).get('rev', [])
+        if len(revs) != 1 or self.rev_regex.match(revs[0]) is None or revs[0].startswith('-'):
+            self._set_headers(response_code=400)
+            self._write_json({'error': 'Expected a single rev'})
+            return
+
+        try:
+            missing = annotation_index.check(revs[0], cwd=self.server.root_dir)     # type: ignore
+        except (subprocess.CalledProcessError, OSError) as e:
+            self._set_headers(response_code=400)
+            self._write_json({'error': str(e)})
+            return
+
+        self._set_headers(response_code=200)
+        self._write_json([{'path': path, 'line': line} for path, line in missing])
+
     def do_GET(self):
         # type: () -> None
+        url = urlparse(self.path)
+        if url.path == '/annotations':
+            self._get_annotations(url.query)
+            return
+        if url.path == '/v1/path':
+            self._get_path_diagnostics(url.query)
+            return
+
+        result = self.v1_file_path_regex.match(self.path)
+        if result is not None:
+            self._get_diagnostics(result.group(1), result.group(2))
+            return
+
         result = self.file_path_regex.match(self.path)
         if result is None:
             self._set_headers(response_code=404)
@@ -44,26 +240,120 @@ class MypyHttpRequestHandler(BaseHTTPRequestHandler):
             return
 
         self._set_headers(response_code=200)
-        output = json.dumps({'output': output})
-        if sys.version_info[0] > 2:
-            output = bytes(output, encoding='utf-8')
-        self.wfile.write(output)
+        self._write_json({'output': output})
+
+    def do_POST(self):
+        # type: () -> None
+        url = urlparse(self.path)
+        if url.path == '/v1/check':
+            self._post_check()
+            return
+        if url.path == '/v1/buffer':
+            self._post_buffer()
+            return
+        self._set_headers(response_code=404)
 
     def log_message(self, format, *args):
         # type: (str, *Any) -> None
         return
 
 
+class UnixHTTPServer(HTTPServer):
+    address_family = socket.AF_UNIX
+
+    def __init__(self, path, handler_class):
+        # type: (str, Any) -> None
+        # The stubs only know (host, port) addresses.
+        HTTPServer.__init__(self, path, handler_class)  # type: ignore
+
+    def server_bind(self):
+        # type: () -> None
+        # HTTPServer.server_bind expects a host and port.
+        TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def get_request(self):
+        # type: () -> Tuple[socket.socket, Tuple[str, int]]
+        request, _ = self.socket.accept()
+        # Unix sockets have no peer address, but request handlers expect one.
+        return request, ('localhost', 0)
+
+
+def remove_stale_socket(path):
+    # type: (str) -> None
+    """ Removes a socket left behind by a server that didn't shut down
+    cleanly. Raises socket.error if a server is still listening on it.
+    """
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error as e:
+        if e.errno == errno.ECONNREFUSED:
+            os.unlink(path)
+            return
+        if e.errno == errno.ENOENT:
+            return
+        raise
+    finally:
+        probe.close()
+    raise socket.error(errno.EADDRINUSE, 'A mypy server is already running on {}'.format(path))
+
+
+# A (host, port) to serve on, a unix socket path, or None for the configured port.
+Address = Union[None, str, Tuple[str, int]]
+
+
 class HttpServerThread(BaseThread):
-    def __init__(self, file_cache):
-        # type: (MypyFileCache) -> None
+    """ Serves the HTTP API on a TCP address, by default 127.0.0.1 and the
+    configured port, or on a unix socket when address is a path.
+    """
+
+    def __init__(self, file_cache, annotation_index=None, address=None, root_dir=None, event_handler=None):
+        # type: (MypyFileCache, Optional[AnnotationIndex], Address, Optional[str], Optional[MypyEventHandler]) -> None
         self.file_cache = file_cache
+        self.annotation_index = annotation_index
+        # Queues checks of files clients ask about that have no results.
+        self.event_handler = event_handler
+        self.address = address
+        self.root_dir = root_dir
+        self.server_address = None  # type: Any
+        self.ready = Event()
+        self._httpd = None  # type: Optional[HTTPServer]
         super(HttpServerThread, self).__init__()
 
+    def _make_server(self):
+        # type: () -> HTTPServer
+        address = self.address
+        if address is None:
+            address = ('127.0.0.1', get_config()['port'])
+        if not isinstance(address, str):
+            return HTTPServer(address, MypyHttpRequestHandler)
+        remove_stale_socket(address)
+        return UnixHTTPServer(address, MypyHttpRequestHandler)
+
     def run(self):
         # type: () -> None
-        server_address = ('127.0.0.1', config['port'])
-        httpd = HTTPServer(server_address, MypyHttpRequestHandler)
+        try:
+            httpd = self._make_server()
+        except socket.error as e:
+            print('Unable to serve HTTP on {}: {}'.format(self.address or 'the configured port', e))
+            self.ready.set()
+            return
         httpd.file_cache = self.file_cache  # type: ignore
+        httpd.annotation_index = self.annotation_index  # type: ignore
+        httpd.event_handler = self.event_handler    # type: ignore
+        httpd.root_dir = self.root_dir or get_config()['root_dir']     # type: ignore
+        self.server_address = httpd.server_address
+        self._httpd = httpd
+        self.ready.set()
         httpd.serve_forever()
 
+    def on_thread_stop(self):
+        # type: () -> None
+        if self._httpd is None:
+            return
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if isinstance(self.server_address, str) and os.path.exists(self.server_address):
+            os.unlink(self.server_address)
@@ -0,0 +1,97 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import hashlib
+import os
+from array import array
+from collections import OrderedDict
+from threading import Lock
+
+from typing import Optional, Tuple
+
+
+class LineIndex(object):
+    """ The byte offset of the start of every line in a file, for rendering
+    lines by slicing its contents.
+
+    The contents are read into memory rather than mapped: the content hash
+    reads the whole file anyway, and immutable bytes can be shared between
+    workers without one of them closing a map another is still reading.
+    """
+
+    def __init__(self, data, offsets, content_hash):
+        # type: (bytes, array, str) -> None
+        self._data = data
+        self._offsets = offsets
+        self.content_hash = content_hash
+
+    @classmethod
+    def build(cls, path):
+        # type: (str) -> LineIndex
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        offsets = array('l', [0])
+        position = data.find(b'\n')
+        while position != -1:
+            offsets.append(position + 1)
+            position = data.find(b'\n', position + 1)
+        return cls(data, offsets, hashlib.md5(data).hexdigest())
+
+    @property
+    def num_lines(self):
+        # type: () -> int
+        if self._offsets[-1] == len(self._data):
+            return len(self._offsets) - 1
+        return len(self._offsets)
+
+    def line(self, line_num):
+        # type: (int) -> str
+        """ The text of a 1-indexed line without its newline. """
+        if line_num < 1 or line_num > self.num_lines:
+            return ''
+        start = self._offsets[line_num - 1]
+        end = self._offsets[line_num] if line_num < len(self._offsets) else len(self._data)
+        return self._data[start:end].decode('utf-8', 'replace').rstrip('\r\n')
+
+
+def _stat_key(path):
+    # type: (str) -> Tuple[int, int, float]
+    st = os.stat(path)
+    return st.st_ino, st.st_size, st.st_mtime
+
+
+class LineIndexCache(object):
+    """ Shares LineIndexes between tasks, keeping the most recently used. """
+
+    def __init__(self, max_entries=256):
+        # type: (int) -> None
+        self.max_entries = max_entries
+        self._indexes = OrderedDict()   # type: OrderedDict[str, Tuple[Tuple[int, int, float], LineIndex]]
+        self._lock = Lock()
+
+    def get(self, path, content_hash=None):
+        # type: (str, Optional[str]) -> LineIndex
+        """ Raises IOError/OSError if the file can't be read. Pass the
+        content hash when it's known to catch changes the stat misses.
+        """
+        key = _stat_key(path)
+        with self._lock:
+            entry = self._indexes.pop(path, None)
+            if entry is not None:
+                if entry[0] == key and (content_hash is None or entry[1].content_hash == content_hash):
+                    self._indexes[path] = entry
+                    return entry[1]
+
+        index = LineIndex.build(path)
+        with self._lock:
+            # Tasks still using a replaced or evicted index keep it alive.
+            self._indexes.pop(path, None)
+            self._indexes[path] = (key, index)
+            while len(self._indexes) > self.max_entries:
+                self._indexes.popitem(last=False)
+        return index
+
+
+line_index_cache = LineIndexCache()
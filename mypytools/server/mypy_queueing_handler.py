@@ -2,17 +2,28 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
-from Queue import Queue
-from typing import Optional, List
+import os
+import sys
+
+from typing import Optional, List, Union
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue  # type: ignore
 
 from watchdog.events import PatternMatchingEventHandler, FileSystemEvent, FileModifiedEvent
 
+from mypytools.config import get_config_path
+from mypytools.server.mypy_annotation_index import AnnotationIndex
 from mypytools.server.mypy_event_handler import MypyEventHandler
+from mypytools.server.mypy_fingerprints import fingerprint_cache
 
 
 class MypyQueueingHandler(PatternMatchingEventHandler):
     patterns = ['*']
-    ignore_patterns = ['*.swp', '*/.venv/*', '*/venv/*', '*/.mypy_cache/*']
+    ignore_patterns = ['*.swp', '*/.venv/*', '*/venv/*', '*/.mypy_cache/*',
+                       '*/.mypy_coverage_cache*', '*/.mypy_source_cache*', '*/.mypy_server.sock']
     ignore_directories = True
 
     def __init__(self, src_dirs):
@@ -20,10 +31,25 @@ class MypyQueueingHandler(PatternMatchingEventHandler):
         self.events = Queue()       # type: Queue[FileSystemEvent]
         self.last_deleted = None    # type: Optional[str]
         self.event_handler = None   # type: Optional[MypyEventHandler]
+        # Parsed sources for the annotation check, dropped as files change.
+        self.annotation_index = None    # type: Optional[AnnotationIndex]
         self.src_dirs = src_dirs
+        self.config_path = get_config_path()
+        self.config_changed = False
         super(MypyQueueingHandler, self).__init__()
 
-    def _should_check_file(self, path):
+    def _check_config_file(self, event):
+        # type: (FileSystemEvent) -> bool
+        if os.path.abspath(event.src_path) != self.config_path:
+            return False
+        # Only the most recent file event gets handled, so track config
+        # changes separately to make sure they're never dropped.
+        self.config_changed = True
+        self.events.put(event)
+        self._notify_event_handler()
+        return True
+
+    def should_check_file(self, path):
         # type: (str) -> bool
         in_src_dir = False
         for src_dir in self.src_dirs:
@@ -53,9 +79,21 @@ class MypyQueueingHandler(PatternMatchingEventHandler):
         self.event_handler.task_cond.notify_all()
         self.event_handler.task_cond.release()
 
+    def _invalidate(self, path):
+        # type: (Union[bytes, str]) -> None
+        # The annotation check and clients asking by path look at any
+        # changed file, not just the ones in src dirs, so this happens
+        # before events get filtered.
+        if not isinstance(path, str):
+            path = path.decode(sys.getfilesystemencoding())
+        fingerprint_cache.invalidate(path)
+        if self.annotation_index is not None:
+            self.annotation_index.invalidate(path)
+
     def on_deleted(self, event):
         # type: (FileSystemEvent) -> None
-        if not self._should_check_file(event.src_path):
+        self._invalidate(event.src_path)
+        if not self.should_check_file(event.src_path):
             return
         self.last_deleted = event.src_path
         self.events.put(event)
@@ -63,7 +101,10 @@ class MypyQueueingHandler(PatternMatchingEventHandler):
 
     def on_created(self, event):
         # type: (FileSystemEvent) -> None
-        if not self._should_check_file(event.src_path):
+        self._invalidate(event.src_path)
+        if self._check_config_file(event):
+            return
+        if not self.should_check_file(event.src_path):
             return
         self.events.put(event)
         self._notify_event_handler()
@@ -72,11 +113,20 @@ class MypyQueueingHandler(PatternMatchingEventHandler):
 
     def on_modified(self, event):
         # type: (FileSystemEvent) -> None
-        if not self._should_check_file(event.src_path):
+        self._invalidate(event.src_path)
+        if self._check_config_file(event):
+            return
+        if not self.should_check_file(event.src_path):
             return
         self.events.put(event)
         self._notify_event_handler()
 
+    def on_moved(self, event):
+        # type: (FileSystemEvent) -> None
+        # Editors often save by renaming a temporary file over the original.
+        self._invalidate(event.dest_path)
+        self._check_config_file(FileModifiedEvent(event.dest_path))
+
     @property
     def has_new_events(self):
         # type: () -> bool
@@ -92,6 +142,12 @@ class MypyQueueingHandler(PatternMatchingEventHandler):
                 break
         assert event is not None
 
+        if self.config_changed:
+            self.config_changed = False
+            receiver.on_config_changed()
+            if os.path.abspath(event.src_path) == self.config_path:
+                return
+
         if event.event_type == 'deleted':
             receiver.on_deleted(event)
         elif event.event_type == 'created':
@@ -0,0 +1,141 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import socket
+import time
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from watchdog.utils import BaseThread
+
+try:
+    from queue import Queue
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError, URLError
+except ImportError:
+    from Queue import Queue  # type: ignore
+    from urllib2 import Request, urlopen, HTTPError, URLError  # type: ignore
+
+# Paths in mypy output are rewritten relative to this marker so results can
+# be shared between checkouts that live in different places.
+ROOT_MARKER = '<root>'
+
+DEFAULT_TIMEOUT = 0.5
+DEFAULT_RETRY_AFTER = 30.0
+
+
+def remote_cache_key(path, file_hash, dependency_fingerprint, flags, mypy_version):
+    # type: (str, str, str, List[str], str) -> str
+    """ `path` is relative to the root of the checkout. Output names the
+    file and its module, so files with the same contents can't share it,
+    and results from one version of mypy don't stand for another's.
+    """
+    key = hashlib.sha1()
+    for part in [path, file_hash, dependency_fingerprint, mypy_version] + sorted(flags):
+        key.update(part.encode('utf-8'))
+        key.update(b'\0')
+    return key.hexdigest()
+
+
+class RemoteCacheClient(BaseThread):
+    """ Reads and writes typechecking results in a shared cache server.
+
+    Lookups block for at most `timeout` seconds, and after any failure the
+    cache is skipped entirely for `retry_after` seconds, so an unreachable
+    cache costs one timeout rather than one per task. Stores happen on this
+    thread in the background.
+    """
+
+    def __init__(self, url, root_dir, timeout=DEFAULT_TIMEOUT, retry_after=DEFAULT_RETRY_AFTER):
+        # type: (str, str, float, float) -> None
+        self.url = url.rstrip('/')
+        self.root_dir = root_dir
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._down_until = 0.0
+        self._pending = Queue()     # type: Queue[Tuple[str, Dict[str, Any]]]
+        super(RemoteCacheClient, self).__init__()
+
+    @classmethod
+    def from_config(cls, config):
+        # type: (Dict[str, Any]) -> Optional[RemoteCacheClient]
+        remote_config = config.get('remote_cache')
+        if not remote_config:
+            return None
+        return cls(remote_config['url'],
+                   config['root_dir'],
+                   timeout=remote_config.get('timeout', DEFAULT_TIMEOUT),
+                   retry_after=remote_config.get('retry_after', DEFAULT_RETRY_AFTER))
+
+    def _result_url(self, key):
+        # type: (str) -> str
+        return '{}/v1/result/{}'.format(self.url, key)
+
+    def _available(self):
+        # type: () -> bool
+        return time.time() >= self._down_until
+
+    def _mark_down(self):
+        # type: () -> None
+        self._down_until = time.time() + self.retry_after
+
+    def _key(self, filename, file_hash, dependency_fingerprint, flags, mypy_version):
+        # type: (str, str, str, List[str], str) -> str
+        return remote_cache_key(os.path.relpath(filename, self.root_dir), file_hash, dependency_fingerprint,
+                                flags, mypy_version)
+
+    def lookup(self, filename, file_hash, dependency_fingerprint, flags, mypy_version):
+        # type: (str, str, str, List[str], str) -> Optional[Tuple[int, str]]
+        if not self._available():
+            return None
+        key = self._key(filename, file_hash, dependency_fingerprint, flags, mypy_version)
+        try:
+            response = urlopen(self._result_url(key), timeout=self.timeout)
+            result = json.loads(response.read().decode('utf-8'))
+        except HTTPError as e:
+            if e.code != 404:
+                self._mark_down()
+            return None
+        except (URLError, socket.error, ValueError):
+            self._mark_down()
+            return None
+        output = result['output'].replace(ROOT_MARKER, self.root_dir)
+        return result['exit_code'], output
+
+    def store(self, filename, file_hash, dependency_fingerprint, flags, mypy_version, exit_code, output):
+        # type: (str, str, str, List[str], str, int, str) -> None
+        if not self._available():
+            return
+        key = self._key(filename, file_hash, dependency_fingerprint, flags, mypy_version)
+        self._pending.put((key, {
+            'exit_code': exit_code,
+            'output': output.replace(self.root_dir, ROOT_MARKER),
+        }))
+
+    def _put(self, key, result):
+        # type: (str, Dict[str, Any]) -> None
+        request = Request(self._result_url(key), data=json.dumps(result).encode('utf-8'))
+        request.add_header('Content-type', 'application/json')
+        request.get_method = lambda: 'PUT'  # type: ignore
+        try:
+            urlopen(request, timeout=self.timeout).read()
+        except (URLError, socket.error):
+            self._mark_down()
+
+    def flush(self):
+        # type: () -> None
+        self._pending.join()
+
+    def run(self):
+        # type: () -> None
+        while True:
+            key, result = self._pending.get()
+            try:
+                if self._available():
+                    self._put(key, result)
+            finally:
+                self._pending.task_done()
@@ -0,0 +1,170 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import multiprocessing
+import os
+import time
+
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from watchdog.utils import BaseThread
+
+if TYPE_CHECKING:
+    from mypytools.server.mypy_event_handler import MypyEventHandler
+    from mypytools.server.mypy_worker import MypyWorker
+
+# Until we've seen a mypy process, assume each one needs this much memory.
+DEFAULT_TASK_MB = 512
+# Always try to leave this much memory free for everything else.
+DEFAULT_MIN_FREE_MB = 1024
+# How long the 1 minute load average takes to show new workers' load.
+LOAD_AVERAGE_WINDOW = 60.0
+
+
+def available_memory_mb():
+    # type: () -> Optional[float]
+    """ Memory available to new processes, or None if we can't tell. """
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except IOError:
+        pass
+    return None
+
+
+def process_rss_mb(pid):
+    # type: (int) -> Optional[float]
+    try:
+        with open('/proc/{}/status'.format(pid), 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except IOError:
+        pass
+    return None
+
+
+def load_average():
+    # type: () -> float
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return 0.0
+
+
+class ResourceMonitor(BaseThread):
+    """ Periodically resizes the worker pool to fit the machine.
+
+    Workers are added while there's spare CPU and memory for another mypy
+    process, and removed when the load average or free memory says the
+    machine is under pressure. If `memory_budget_mb` is set, the resident
+    memory of running mypy processes is also tracked and the biggest one
+    is killed (and its task re-queued) when they go over budget together.
+    """
+
+    def __init__(self, event_handler, max_workers, autoscale=True, memory_budget_mb=None,
+                 min_free_mb=DEFAULT_MIN_FREE_MB, interval=1.0):
+        # type: (MypyEventHandler, int, bool, Optional[float], float, float) -> None
+        self.event_handler = event_handler
+        self.max_workers = max_workers
+        self.min_workers = 1
+        self.autoscale = autoscale
+        self.memory_budget_mb = memory_budget_mb
+        self.min_free_mb = min_free_mb
+        self.interval = interval
+        self.cpu_count = multiprocessing.cpu_count()
+        self.task_mb = float(DEFAULT_TASK_MB)
+        # (time, count) of the workers added within the last
+        # LOAD_AVERAGE_WINDOW, which the readings may not account for yet.
+        self._recently_added = []   # type: List[Tuple[float, int]]
+        super(ResourceMonitor, self).__init__()
+
+    def _num_recently_added(self, now):
+        # type: (float) -> int
+        self._recently_added = [(added_at, count) for added_at, count in self._recently_added
+                                if now - added_at < LOAD_AVERAGE_WINDOW]
+        return sum(count for _, count in self._recently_added)
+
+    def compute_target(self, current, free_mb, load, now=None):
+        # type: (int, Optional[float], float, Optional[float]) -> int
+        if now is None:
+            now = time.time()
+        if (free_mb is not None and free_mb < self.min_free_mb) or load > self.cpu_count * 1.5:
+            # The workers we added are showing up in the readings.
+            self._recently_added = []
+            return max(self.min_workers, current - 1)
+
+        # Workers we've just added haven't shown up in the load average,
+        # and may not have started a mypy process yet, so the room they'll
+        # take is already spoken for.
+        cpu_room = int(self.cpu_count - load)
+        if free_mb is None:
+            room = cpu_room
+        else:
+            room = min(cpu_room, int((free_mb - self.min_free_mb) // self.task_mb))
+        room -= self._num_recently_added(now)
+        target = max(self.min_workers, min(self.max_workers, current + max(0, room)))
+        if target > current:
+            self._recently_added.append((now, target - current))
+        return target
+
+    def _task_memory(self, workers):
+        # type: (List[MypyWorker]) -> List[Tuple[float, MypyWorker]]
+        usage = []
+        for worker in workers:
+            task = worker.current_task
+            pid = None if task is None else task.pid
+            if pid is None:
+                continue
+            rss_mb = process_rss_mb(pid)
+            if rss_mb is None:
+                continue
+            usage.append((rss_mb, worker))
+        return usage
+
+    def enforce_memory_budget(self, usage):
+        # type: (List[Tuple[float, MypyWorker]]) -> Optional[MypyWorker]
+        total_mb = sum(rss_mb for rss_mb, _ in usage)
+        if self.memory_budget_mb is None or total_mb <= self.memory_budget_mb:
+            return None
+        # A task that's over budget on its own would just be killed
+        # again every time it ran, so let the last one finish.
+        if len(usage) < 2:
+            return None
+        rss_mb, worker = max(usage, key=lambda u: u[0])
+        print('mypy processes using {:.0f}MB, over the {:.0f}MB budget. Re-queueing {}'.format(
+            total_mb, self.memory_budget_mb, worker.current_task.filename if worker.current_task else ''))
+        worker.interrupt_current_task()
+        return worker
+
+    def check(self):
+        # type: () -> None
+        handler = self.event_handler
+        handler.task_cond.acquire()
+        workers = handler.local_workers()
+        handler.task_cond.release()
+
+        usage = self._task_memory(workers)
+        for rss_mb, _ in usage:
+            self.task_mb = max(self.task_mb, rss_mb)
+
+        handler.task_cond.acquire()
+        try:
+            target = handler.target_workers
+            if self.autoscale:
+                target = self.compute_target(len(workers), available_memory_mb(), load_average())
+            if self.enforce_memory_budget(usage) is not None:
+                target = min(target, len(usage) - 1)
+            if target != handler.target_workers:
+                handler.scale_workers(max(self.min_workers, target))
+        finally:
+            handler.task_cond.release()
+
+    def run(self):
+        # type: () -> None
+        while self.should_keep_running():
+            self.check()
+            time.sleep(self.interval)
@@ -4,7 +4,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import absolute_import
 
-from typing import List  # noqa
+from typing import List, Optional  # noqa
 
 import io
 import os
@@ -14,11 +14,18 @@ import sys
 from findimports import ModuleGraph
 from watchdog.observers import Observer
 
-from mypytools.config import config
+from mypytools.config import config, get_src_dirs, load_config_file
+from mypytools.server.mypy_agent_server import AgentServerThread
+from mypytools.server.mypy_annotation_index import AnnotationIndex
+from mypytools.server.mypy_cache_dirs import CacheDirPool
 from mypytools.server.mypy_event_handler import MypyEventHandler
 from mypytools.server.mypy_file_cache import MypyFileCache
-from mypytools.server.mypy_http_request_handler import HttpServerThread
+from mypytools.server.mypy_http_request_handler import HTTP_SOCKET_FILENAME, HttpServerThread
 from mypytools.server.mypy_queueing_handler import MypyQueueingHandler
+from mypytools.server.mypy_remote_cache import RemoteCacheClient
+from mypytools.server.mypy_resource_monitor import ResourceMonitor
+from mypytools.server.mypy_toolchain import load_profiles
+from mypytools.source_cache import SOURCE_CACHE_FILENAME, SourceCache
 
 
 def build_dependency_graph(src_dirs, silence):
@@ -42,9 +49,13 @@ def build_dependency_graph(src_dirs, silence):
         sys.stderr = old_stderr
 
 
-def run_server(compact, num_workers):
-    # type: (bool, int) -> None
-    src_dirs = [os.path.join(config['root_dir'], d['path']) for d in config.get('src_dirs', [])]
+def run_server(compact, num_workers, agent_address=None, warm_start=False, autoscale=False, memory_budget=None,
+               unix_socket=False):
+    # type: (bool, int, Optional[str], bool, bool, Optional[float], bool) -> None
+    load_config_file()
+    src_dirs = get_src_dirs()
+    # Resolve mypy and build the command for each src dir once, up front.
+    load_profiles(config)
 
     sys.stdout.write("Initializing mypy server with {} workers...".format(num_workers))
     sys.stdout.flush()
@@ -57,15 +68,57 @@ def run_server(compact, num_workers):
     sys.stdout.write("Done!\n")
     sys.stdout.flush()
 
-    file_cache = MypyFileCache()
+    remote_cache = RemoteCacheClient.from_config(config)
+    if remote_cache is not None:
+        remote_cache.start()
+        print('Sharing results with the cache at {}'.format(remote_cache.url))
+    file_cache = MypyFileCache(remote=remote_cache)
+
+    # Give each worker its own incremental cache so they don't fight over one.
+    cache_dir_pool = None
+    if '--incremental' in config.get('global_flags', []):
+        cache_dir_pool = CacheDirPool(os.path.join(config['root_dir'], '.mypy_cache'),
+                                      os.path.join(config['root_dir'], '.mypy_cache', 'workers'))
 
     queueing_handler = MypyQueueingHandler(src_dirs)
-    mypy_handler = MypyEventHandler(g, queueing_handler, file_cache, compact, num_workers)
+    # Shared with check_mypy_annotations.py and print_mypy_coverage.py.
+    source_cache = SourceCache.load(os.path.join(config['root_dir'], SOURCE_CACHE_FILENAME))
+    annotation_index = AnnotationIndex(source_cache)
+    queueing_handler.annotation_index = annotation_index
+    mypy_handler = MypyEventHandler(g, queueing_handler, file_cache, compact, num_workers, cache_dir_pool)
     queueing_handler.event_handler = mypy_handler
+    if autoscale:
+        # Start small and let the resource monitor add workers as it can.
+        mypy_handler.target_workers = 1
     mypy_handler.start()
 
-    http_server_thread = HttpServerThread(file_cache)
-    http_server_thread.start()
+    if autoscale or memory_budget is not None:
+        resource_monitor = ResourceMonitor(mypy_handler, num_workers, autoscale=autoscale,
+                                           memory_budget_mb=memory_budget)
+        resource_monitor.start()
+    if warm_start:
+        mypy_handler.queue_warm_start()
+
+    http_server_threads = [HttpServerThread(file_cache, annotation_index, root_dir=config['root_dir'],
+                                            event_handler=mypy_handler)]
+    if unix_socket:
+        socket_path = os.path.join(config['root_dir'], HTTP_SOCKET_FILENAME)
+        http_server_threads.append(HttpServerThread(file_cache, annotation_index, socket_path, config['root_dir'],
+                                                    event_handler=mypy_handler))
+    for http_server_thread in http_server_threads:
+        http_server_thread.start()
+    if unix_socket:
+        unix_server_thread = http_server_threads[-1]
+        unix_server_thread.ready.wait()
+        if unix_server_thread.server_address is None:
+            # Most likely another server is already checking this project.
+            sys.exit(1)
+        print('Serving HTTP on {}'.format(socket_path))
+
+    if agent_address is not None:
+        agent_server_thread = AgentServerThread(mypy_handler, agent_address, config['root_dir'])
+        agent_server_thread.start()
+        print('Accepting remote agents on {}'.format(agent_address))
 
     observer = Observer()
     observer.schedule(queueing_handler, path=config['root_dir'], recursive=True)
@@ -76,6 +129,10 @@ def run_server(compact, num_workers):
             time.sleep(1)
     except KeyboardInterrupt:
         observer.stop()
+        # Removes the unix socket, so clients don't try it.
+        for http_server_thread in http_server_threads:
+            http_server_thread.stop()
+        annotation_index.save()
 
     observer.join()
 
@@ -4,130 +4,165 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 import hashlib
-
 import os
-import shlex
 import tempfile
+import time
 import traceback
 from collections import defaultdict
+from threading import Timer
 
 from subprocess import Popen, PIPE
 
 from typing import Optional, Tuple, List, Dict
 
-from mypytools.config import config
-
-
-STRICT_OPTIONAL_DIRS = [os.path.join(config['root_dir'], d['path']) for d in config['src_dirs'] if d.get('strict_optional')]
-
-
-# From https://stackoverflow.com/a/377028
-def which(program):
-    # type: (str) -> Optional[str]
-    def is_exe(fpath):
-        return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
+from mypytools.config import get_config
+from mypytools.server.mypy_diagnostics import Diagnostic, parse_mypy_output
+from mypytools.server.mypy_fingerprints import fingerprint_cache
+from mypytools.server.mypy_line_index import line_index_cache
+from mypytools.server.mypy_toolchain import CommandProfile, get_profiles, mypy_version
 
-    fpath, fname = os.path.split(program)
-    if fpath:
-        if is_exe(program):
-            return program
-    else:
-        for path in os.environ["PATH"].split(os.pathsep):
-            path = path.strip('"')
-            exe_file = os.path.join(path, program)
-            if is_exe(exe_file):
-                return exe_file
-    return None
+# Defaults for the task_timeout and max_reruns config settings. A task
+# that runs for longer than task_timeout seconds in total is killed, and a
+# file that changes during a run is checked again at most max_reruns times.
+DEFAULT_TASK_TIMEOUT = 300.0
+DEFAULT_MAX_RERUNS = 3
+# Seconds to wait before rerunning mypy on a file that changed during the
+# last run, doubled for each rerun.
+RERUN_BACKOFF = 0.5
 
 
 class MypyTask(object):
+    # Whether this checks an editor's unsaved buffer instead of the file.
+    is_buffer = False
+
     def __init__(self, filename, include_error_context=True):
         # type: (str, bool) -> None
         self.filename = filename
         self._proc = None   # type: Optional[Popen]
         self.include_error_context = include_error_context
+        # Identifies the contents of everything this file imports, used to
+        # key results in the remote cache.
+        self.dependency_fingerprint = ''
+        self.interrupted = False
+        # Set when the task was killed for running past the task timeout.
+        self.timed_out = False
+        # The mypy cache directory to use, set by the worker running the task.
+        self.cache_dir = None   # type: Optional[str]
+        # mypy's output parsed into records, set once the task has run.
+        self.diagnostics = None     # type: Optional[List[Diagnostic]]
+        # Whether errors this run finds in other files can be credited to
+        # them. Cleared if the files change while the task is running.
+        self.credit_siblings = True
+
+    @property
+    def profile(self):
+        # type: () -> CommandProfile
+        return get_profiles().profile_for(self.filename)
+
+    def flags(self):
+        # type: () -> List[str]
+        return list(self.profile.flags)
+
+    def mypy_version(self):
+        # type: () -> str
+        return mypy_version(self.profile.command[0])
 
-    def _should_use_strict_optional(self, path):
-        # type: (str) -> bool
-        for strict_path in STRICT_OPTIONAL_DIRS:
-            if path.startswith(strict_path):
-                return True
-        return False
+    def build_command(self):
+        # type: () -> List[str]
+        return self.profile.build_command(self.filename, self.cache_dir)
 
     def _get_file_hash(self):
         # type: () -> str
-        with open(self.filename, 'rb') as f:
-            return hashlib.md5(f.read()).hexdigest()
+        return fingerprint_cache.get(self.filename)
+
+    def _run(self, cmd, env, deadline):
+        # type: (List[str], Dict[str, str], Optional[float]) -> Tuple[int, str, str]
+        self._proc = Popen(cmd, stdout=PIPE, stderr=PIPE, env=env, universal_newlines=True)
+        timer = None
+        if deadline is not None:
+            timer = Timer(max(0.0, deadline - time.time()), self._time_out)
+            timer.daemon = True
+            timer.start()
+        try:
+            out, err = self._proc.communicate()
+            return self._proc.wait(), out, err
+        finally:
+            if timer is not None:
+                timer.cancel()
 
     def execute(self):
         # type: () -> Tuple[int, str, str, str, str]
-        mypy_path = os.pathsep.join(os.path.join(config['root_dir'], path) for path in config.get('mypy_path', []))
-
-        mypy_exec = which('mypy')
-        python_exec = which('python')
-        if mypy_exec is None:
-            print("Couldn't find mypy executable. Is it installed and in your PATH?")
-            raise RuntimeError('Mypy executable missing.')
-
-        if python_exec is None:
-            print("Couldn't find python executable. Is it in your PATH?")
-            raise RuntimeError('Python executable missing.')
-
-        flags = config.get('global_flags', [])
-        flags.append('--python-executable={}'.format(python_exec))
-
-        if self._should_use_strict_optional(self.filename):
-            flags.append('--strict-optional')
-
-        cmd = shlex.split("{} {} {}".format(mypy_exec, ' '.join(flags), self.filename))
+        self.timed_out = False
         out = ''
         err = ''
         context = ''
         try:
-            before_file_hash = self._get_file_hash()
-            after_file_hash = ''
+            cmd = self.build_command()
+            env = self.profile.build_env()
+            config = get_config()
+            timeout = config.get('task_timeout', DEFAULT_TASK_TIMEOUT)
+            deadline = None if timeout is None else time.time() + timeout
+            max_reruns = config.get('max_reruns', DEFAULT_MAX_RERUNS)
+            after_file_hash = self._get_file_hash()
 
             exit_code = 0
-            while before_file_hash != after_file_hash:
+            for run in range(max_reruns + 1):
+                if run > 0:
+                    # Give whatever is rewriting the file a chance to finish.
+                    backoff = RERUN_BACKOFF * 2 ** (run - 1)
+                    if deadline is not None:
+                        backoff = min(backoff, max(0.0, deadline - time.time()))
+                    time.sleep(backoff)
+                    if self.interrupted:
+                        break
                 before_file_hash = after_file_hash
-                self._proc = Popen(cmd, stdout=PIPE, stderr=PIPE, env={'MYPY_PATH': mypy_path})
-                out, err = self._proc.communicate()
-                exit_code = self._proc.wait()
+                exit_code, out, err = self._run(cmd, env, deadline)
+                if self.timed_out or self.interrupted:
+                    break
                 # This still has an ABA problem, but ¯\_(ツ)_/¯
                 after_file_hash = self._get_file_hash()
-
+                if before_file_hash == after_file_hash:
+                    break
+            else:
+                # The result only stands for the contents before the last
+                # run, the next change to the file queues another check.
+                print('{} kept changing, giving up after {} runs'.format(self.filename, max_reruns + 1))
+
+            if self.timed_out:
+                self.diagnostics = []
+                return -1, '', err, context, before_file_hash
+
+            self.diagnostics = parse_mypy_output(out)
             if exit_code == 0:
                 return 0, out, err, context, before_file_hash
 
             if self.include_error_context:
-                context = self._find_context(out)
+                context = self._find_context(self.diagnostics, before_file_hash)
 
             return exit_code, out, err, context, before_file_hash
         except Exception:
-            traceback.print_exc()
-            return -1, out, err, context, ''
+            # No file hash means the task couldn't be run.
+            return -1, out, err + traceback.format_exc(), context, ''
         finally:
             self._proc = None
 
-    def _find_context(self, errors):
-        # type: (str) -> str
-        error_list = errors.split('\n')
+    def _find_context(self, diagnostics, file_hash=None):
+        # type: (List[Diagnostic], Optional[str]) -> str
         errors_by_path = defaultdict(list)  # type: Dict[str, List[Tuple[int, str]]]
-        for error in error_list:
-            error_parts = error.split(':')
-            if len(error_parts) != 4:
-                continue
-            path, line, _, message = error_parts
-            errors_by_path[path].append((int(line), message))
+        for diagnostic in diagnostics:
+            errors_by_path[diagnostic.path].append((diagnostic.line, diagnostic.message))
 
         results = []
         for path in errors_by_path:
-            results.extend(self._get_context_for_path(path, errors_by_path[path]))
+            # Only the checked file's hash is known, errors in its imports
+            # fall back to the stat check.
+            content_hash = file_hash if path == self.filename else None
+            results.extend(self._get_context_for_path(path, errors_by_path[path], content_hash))
         return '\n'.join(results)
 
-    def _get_context_for_path(self, path, parsed_errors):
-        # type: (str, List[Tuple[int, str]]) -> List[str]
-        result = []
+    def _get_context_for_path(self, path, parsed_errors, content_hash=None):
+        # type: (str, List[Tuple[int, str]], Optional[str]) -> List[str]
+        result = []  # type: List[str]
         template = """
   \033[91m\033[1mError\033[0m: {}
     \033[93m\033[1m{}\033[0m
@@ -137,44 +172,56 @@ class MypyTask(object):
 """
         target_context_lines_before = 2
         target_context_lines_after = 2
-        # We seed the context lines with an empty string to get the
-        # proper final padding before and after.
-        context_lines_before = ['']
-        context_lines_after = ['']
-
-        with open(path, 'r') as f:
-            lines = f.readlines()
-            # Insert a blank line so that 1-indexed line numbers from errors match.
-            lines.insert(0, '')
-
-            for line, message in parsed_errors:
-                begin_line = max(0, line - target_context_lines_before)
-                end_line = min(len(lines), line + target_context_lines_after + 1)
-
-                for num, l in enumerate(lines[begin_line:line]):
-                    context_lines_before.append('{} {}'.format(begin_line + num, l.rstrip('\n')))
-
-                context_line = '{} {}'.format(line, lines[line].rstrip('\n'))
-
-                for num, l in enumerate(lines[line + 1:end_line]):
-                    context_lines_after.append('{} {}'.format(line + num + 1, l.rstrip('\n')))
 
-                error_lines = [
-                    '\n'.join(context_lines_before),
-                    context_line,
-                    '\n'.join(context_lines_after),
-                ]
-
-                # Insert the location.
-                error_lines.insert(0, '{}:{}'.format(path, line))
+        try:
+            index = line_index_cache.get(path, content_hash)
+        except (IOError, OSError):
+            return result
+
+        for line, message in parsed_errors:
+            begin_line = max(1, line - target_context_lines_before)
+            end_line = min(index.num_lines, line + target_context_lines_after)
+
+            # We seed the context lines with an empty string to get the
+            # proper final padding before and after.
+            context_lines_before = ['']
+            context_lines_after = ['']
+            for num in range(begin_line, line):
+                context_lines_before.append('{} {}'.format(num, index.line(num)))
+
+            context_line = '{} {}'.format(line, index.line(line))
+
+            for num in range(line + 1, end_line + 1):
+                context_lines_after.append('{} {}'.format(num, index.line(num)))
+
+            error_lines = [
+                # The location.
+                '{}:{}'.format(path, line),
+                message,
+                '\n'.join(context_lines_before),
+                context_line,
+                '\n'.join(context_lines_after),
+            ]
+            result.append(template.format(*error_lines))
+        return result
 
-                # Insert the error message.
-                error_lines.insert(1, message)
+    @property
+    def pid(self):
+        # type: () -> Optional[int]
+        proc = self._proc
+        return None if proc is None else proc.pid
 
-                result.append(template.format(*error_lines))
-        return result
+    def _time_out(self):
+        # type: () -> None
+        self.timed_out = True
+        self._kill()
 
     def interrupt(self):
+        # type: () -> None
+        self.interrupted = True
+        self._kill()
+
+    def _kill(self):
         # type: () -> None
         if self._proc is None:
             return
@@ -190,9 +237,50 @@ class MypyTask(object):
         # type: (object) -> bool
         if not isinstance(other, MypyTask):
             raise NotImplemented
-        return self.filename == other.filename
+        return self.filename == other.filename and self.is_buffer == other.is_buffer
 
     def __hash__(self):
         # type: () -> int
         return self.filename.__hash__()
 
+
+
+class BufferTask(MypyTask):
+    """ Checks the unsaved contents of a file in an editor, using mypy's
+    --shadow-file so errors are still reported against the file's path.
+    """
+    is_buffer = True
+
+    def __init__(self, filename, contents):
+        # type: (str, str) -> None
+        super(BufferTask, self).__init__(filename, include_error_context=False)
+        self.contents = contents
+        self.buffer_hash = hashlib.md5(contents.encode('utf-8')).hexdigest()
+        self._shadow_path = None    # type: Optional[str]
+
+    def build_command(self):
+        # type: () -> List[str]
+        cmd = super(BufferTask, self).build_command()
+        assert self._shadow_path is not None
+        return cmd[:-1] + ['--shadow-file', self.filename, self._shadow_path] + cmd[-1:]
+
+    def _get_file_hash(self):
+        # type: () -> str
+        return self.buffer_hash
+
+    def execute(self):
+        # type: () -> Tuple[int, str, str, str, str]
+        try:
+            fd, shadow_path = tempfile.mkstemp(prefix='mypy_buffer_', suffix='.py')
+        except (IOError, OSError):
+            return -1, '', traceback.format_exc(), '', ''
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.contents.encode('utf-8'))
+            self._shadow_path = shadow_path
+            return super(BufferTask, self).execute()
+        except (IOError, OSError):
+            return -1, '', traceback.format_exc(), '', ''
+        finally:
+            self._shadow_path = None
+            os.unlink(shadow_path)
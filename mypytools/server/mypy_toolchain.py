@@ -0,0 +1,158 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import shlex
+import subprocess
+from collections import namedtuple
+
+from typing import Any, Dict, List, Optional
+
+from mypytools.config import get_config
+
+
+# From https://stackoverflow.com/a/377028
+def which(program):
+    # type: (str) -> Optional[str]
+    def is_exe(fpath):
+        # type: (str) -> bool
+        return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
+
+    fpath, fname = os.path.split(program)
+    if fpath:
+        if is_exe(program):
+            return program
+    else:
+        for path in os.environ["PATH"].split(os.pathsep):
+            path = path.strip('"')
+            exe_file = os.path.join(path, program)
+            if is_exe(exe_file):
+                return exe_file
+    return None
+
+
+class Toolchain(namedtuple('Toolchain', ['mypy_exec', 'python_exec'])):
+    @classmethod
+    def resolve(cls):
+        # type: () -> Toolchain
+        mypy_exec = which('mypy')
+        python_exec = which('python')
+        if mypy_exec is None:
+            print("Couldn't find mypy executable. Is it installed and in your PATH?")
+            raise RuntimeError('Mypy executable missing.')
+
+        if python_exec is None:
+            print("Couldn't find python executable. Is it in your PATH?")
+            raise RuntimeError('Python executable missing.')
+        return cls(mypy_exec, python_exec)
+
+
+_mypy_versions = {}     # type: Dict[str, str]
+
+
+def mypy_version(mypy_exec):
+    # type: (str) -> str
+    """ What `mypy --version` prints, or the executable's path if it can't
+    be run. Only asked once per executable.
+    """
+    version = _mypy_versions.get(mypy_exec)
+    if version is None:
+        try:
+            version = subprocess.check_output([mypy_exec, '--version'], universal_newlines=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            version = mypy_exec
+        _mypy_versions[mypy_exec] = version
+    return version
+
+
+class CommandProfile(namedtuple('CommandProfile', ['path', 'flags', 'command', 'env'])):
+    """ Everything needed to run mypy on files under `path`.
+
+    `flags` are the options that affect mypy's output, `command` is the
+    full argument list up to (but not including) the file to check.
+    """
+
+    def build_command(self, filename, cache_dir=None):
+        # type: (str, Optional[str]) -> List[str]
+        if cache_dir is None:
+            return list(self.command) + [filename]
+        return list(self.command) + ['--cache-dir={}'.format(cache_dir), filename]
+
+    def build_env(self):
+        # type: () -> Dict[str, str]
+        return dict(self.env)
+
+    @property
+    def follows_imports(self):
+        # type: () -> bool
+        """ Whether mypy reports all the errors in the files the checked one
+        imports. With --follow-imports=silent it only prints the notes
+        pointing at them from the checked file's errors.
+        """
+        follow_imports = 'normal'
+        for i, flag in enumerate(self.flags):
+            if flag.startswith('--follow-imports='):
+                follow_imports = flag.split('=', 1)[1]
+            elif flag == '--follow-imports' and i + 1 < len(self.flags):
+                follow_imports = self.flags[i + 1]
+            elif flag == '--silent-imports':
+                follow_imports = 'silent'
+        return follow_imports == 'normal'
+
+
+def make_profile(path, flags, toolchain, mypy_path):
+    # type: (str, List[str], Toolchain, str) -> CommandProfile
+    flags = shlex.split(' '.join(flags))
+    command = [toolchain.mypy_exec] + flags + ['--python-executable={}'.format(toolchain.python_exec)]
+    return CommandProfile(path, tuple(flags), tuple(command), (('MYPY_PATH', mypy_path),))
+
+
+class ProfileSet(object):
+    """ The command profile for each src dir, built once from the config. """
+
+    def __init__(self, profiles, default):
+        # type: (List[CommandProfile], CommandProfile) -> None
+        # Longest paths first so nested src dirs win over their parents.
+        self.profiles = sorted(profiles, key=lambda p: len(p.path), reverse=True)
+        self.default = default
+
+    @classmethod
+    def from_config(cls, config, toolchain):
+        # type: (Dict[str, Any], Toolchain) -> ProfileSet
+        root_dir = config['root_dir']
+        mypy_path = os.pathsep.join(os.path.join(root_dir, path) for path in config.get('mypy_path', []))
+        global_flags = list(config.get('global_flags', []))
+
+        profiles = []
+        for src_dir in config.get('src_dirs', []):
+            flags = global_flags + list(src_dir.get('flags', []))
+            if src_dir.get('strict_optional'):
+                flags.append('--strict-optional')
+            path = os.path.join(root_dir, src_dir['path'])
+            profiles.append(make_profile(path, flags, toolchain, mypy_path))
+        return cls(profiles, make_profile(root_dir, global_flags, toolchain, mypy_path))
+
+    def profile_for(self, filename):
+        # type: (str) -> CommandProfile
+        for profile in self.profiles:
+            if filename.startswith(profile.path):
+                return profile
+        return self.default
+
+
+_profiles = None    # type: Optional[ProfileSet]
+
+
+def load_profiles(config):
+    # type: (Dict[str, Any]) -> ProfileSet
+    global _profiles
+    _profiles = ProfileSet.from_config(config, Toolchain.resolve())
+    return _profiles
+
+
+def get_profiles():
+    # type: () -> ProfileSet
+    if _profiles is None:
+        return load_profiles(get_config())
+    return _profiles
@@ -3,45 +3,295 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 from threading import Condition
+import os
 import sys
-from typing import List, Optional
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
 
 from watchdog.utils import BaseThread
 
-from mypytools.server.mypy_file_cache import MypyFileCache
-from mypytools.server.mypy_task import MypyTask
+from mypytools.server.mypy_background_queue import BackgroundQueue
+from mypytools.server.mypy_cache_dirs import CacheDirPool
+from mypytools.server.mypy_diagnostics import (
+    Diagnostic, group_output_by_path, parse_diagnostic, parse_mypy_output)
+from mypytools.server.mypy_file_cache import RESULT_DONE, RESULT_TIMED_OUT, MypyFileCache
+from mypytools.server.mypy_fingerprints import fingerprint_cache
+from mypytools.server.mypy_task import BufferTask, MypyTask
+from mypytools.server.mypy_toolchain import get_profiles
+
+# (filename, file hash, output, diagnostics) for a file credited with
+# errors found while checking another one.
+SiblingResult = Tuple[str, str, str, List[Diagnostic]]
+
+
+def _without_cross_references(output):
+    # type: (str) -> str
+    """ Drops the notes explaining a diagnostic in another file, like
+    `b.py:1: note: "f" defined here`, which a check of b.py wouldn't print.
+    """
+    lines = []
+    owner = None    # type: Optional[str]
+    for line in output.split('\n'):
+        diagnostic = parse_diagnostic(line)
+        if diagnostic is None:
+            continue
+        if diagnostic.severity != 'note' or owner is None:
+            owner = diagnostic.path
+        elif diagnostic.path != owner:
+            continue
+        lines.append(line)
+    return '\n'.join(lines)
 
 
 class MypyWorker(BaseThread):
-    def __init__(self, task_pool, task_cond, file_cache, compact):
-        # type: (List[MypyTask], Condition, MypyFileCache, bool) -> None
+    is_remote = False
+
+    def __init__(self, task_pool, task_cond, file_cache, compact, background_queue=None, cache_dir_pool=None,
+                 buffer_tasks=None):
+        # type: (List[MypyTask], Condition, MypyFileCache, bool, Optional[BackgroundQueue], Optional[CacheDirPool], Optional[List[BufferTask]]) -> None
         self._task_pool = task_pool
+        # Checks of editors' unsaved buffers, which run ahead of everything.
+        self._buffer_tasks = buffer_tasks
         self._task_cond = task_cond
+        self._background_queue = background_queue
+        self._cache_dir_pool = cache_dir_pool
+        self.cache_dir = None   # type: Optional[str]
         self.run_tasks = False
+        self.run_background = False
         self.current_task = None    # type: Optional[MypyTask]
+        self.current_task_is_background = False
+        # Called once the worker thread has exited.
+        self.on_exit = None     # type: Optional[Callable[[MypyWorker], None]]
         self.file_cache = file_cache
         self.compact = compact
         super(MypyWorker, self).__init__()
 
     def run(self):
         # type: () -> None
-        while True:
-            self._run_next_task()
+        try:
+            while self.should_keep_running():
+                self._run_next_task()
+        finally:
+            if self.cache_dir is not None:
+                assert self._cache_dir_pool is not None
+                self._cache_dir_pool.release(self.cache_dir)
+                self.cache_dir = None
+            if self.on_exit is not None:
+                self.on_exit(self)
+
+    def on_thread_stop(self):
+        # type: () -> None
+        # Wake the worker up if it's waiting on the task pool so it can exit.
+        self._task_cond.acquire()
+        self._task_cond.notify_all()
+        self._task_cond.release()
+
+    def interrupt_current_task(self):
+        # type: () -> None
+        if self.current_task is not None:
+            self.current_task.interrupt()
+
+    def _has_foreground_task(self):
+        # type: () -> bool
+        return self.run_tasks and len(self._task_pool) > 0
+
+    def _has_background_task(self):
+        # type: () -> bool
+        return (self.run_background and self._background_queue is not None and
+                len(self._background_queue) > 0)
+
+    def _has_buffer_task(self):
+        # type: () -> bool
+        # The buffers only exist here, so remote workers can't check them.
+        return not self.is_remote and self._buffer_tasks is not None and len(self._buffer_tasks) > 0
+
+    def _pop_task(self):
+        # type: () -> MypyTask
+        if self._has_buffer_task():
+            assert self._buffer_tasks is not None
+            self.current_task_is_background = False
+            task = self._buffer_tasks.pop(0)    # type: MypyTask
+        elif self._has_foreground_task():
+            self.current_task_is_background = False
+            task = self._task_pool.pop(0)
+        else:
+            assert self._background_queue is not None
+            self.current_task_is_background = True
+            background_task = self._background_queue.pop()
+            assert background_task is not None
+            task = background_task
+        task.interrupted = False
+        task.timed_out = False
+        task.diagnostics = None
+        task.credit_siblings = True
+        return task
+
+    def _resolve_path(self, path):
+        # type: (str) -> Optional[str]
+        if os.path.isabs(path):
+            return path
+        # Relative paths are relative to wherever mypy ran, which we only
+        # know for local runs.
+        if self.is_remote:
+            return None
+        return os.path.abspath(path)
+
+    def _sibling_results(self, task, output, started_at):
+        # type: (MypyTask, str, float) -> List[SiblingResult]
+        # mypy reports errors it finds in the files it follows, and those
+        # are the same errors a run on that file would report as long as it
+        # was checked with the same command and hasn't changed since.
+        results = []    # type: List[SiblingResult]
+        profiles = get_profiles()
+        profile = profiles.profile_for(task.filename)
+        if not profile.follows_imports:
+            # Only the notes about the checked file's errors are printed,
+            # the other files' own errors are hidden.
+            return results
+        groups = group_output_by_path(_without_cross_references(output))
+        if len(groups) < 2:
+            return results
+        command = profile.command
+        for path, (lines, diagnostics) in groups.items():
+            filename = self._resolve_path(path)
+            if filename is None or filename == task.filename:
+                continue
+            if profiles.profile_for(filename).command != command:
+                continue
+            try:
+                fingerprint = fingerprint_cache.fingerprint(filename)
+            except (IOError, OSError):
+                continue
+            if fingerprint.mtime >= started_at:
+                continue
+            results.append((filename, fingerprint.content_hash, '\n'.join(lines) + '\n', diagnostics))
+        return results
+
+    def _credit_siblings(self, sibling_results):
+        # type: (Sequence[SiblingResult]) -> None
+        # Must be called with task_cond held.
+        for filename, file_hash, output, diagnostics in sibling_results:
+            self.file_cache.store(filename, file_hash, output, diagnostics)
+            # Any queued check of the file would just repeat the work.
+            subsumed_task = MypyTask(filename)
+            if subsumed_task in self._task_pool:
+                self._task_pool.remove(subsumed_task)
+            if self._background_queue is not None:
+                self._background_queue.discard(subsumed_task)
+
+    def _execute_task(self, task):
+        # type: (MypyTask) -> Optional[Tuple[int, str, str, str, str]]
+        # Returning None means the task couldn't be run and should be
+        # put back on the task pool for another worker to pick up.
+        remote = self.file_cache.remote
+        if remote is None:
+            return task.execute()
+
+        try:
+            file_hash = task._get_file_hash()
+        except (IOError, OSError):
+            return task.execute()
+
+        flags = task.flags()
+        version = task.mypy_version()
+        cached = remote.lookup(task.filename, file_hash, task.dependency_fingerprint, flags, version)
+        if cached is not None:
+            exit_code, output = cached
+            task.diagnostics = parse_mypy_output(output)
+            context = ''
+            if exit_code != 0 and task.include_error_context:
+                context = task._find_context(task.diagnostics, file_hash)
+            return exit_code, output, '', context, file_hash
+
+        result = task.execute()
+        exit_code, output, _, _, result_hash = result
+        # Negative exit codes mean mypy was killed or never ran.
+        if exit_code >= 0 and result_hash == file_hash:
+            remote.store(task.filename, file_hash, task.dependency_fingerprint, flags, version, exit_code, output)
+        return result
 
     def _run_next_task(self):
         # type: () -> None
         self._task_cond.acquire()
-        while len(self._task_pool) == 0 or not self.run_tasks:
+        while (not self._has_buffer_task() and not self._has_foreground_task() and
+               not self._has_background_task() and self.should_keep_running()):
             self._task_cond.wait()
-        self.current_task = self._task_pool.pop(0)
+        if not self.should_keep_running():
+            self._task_cond.release()
+            return
+        self.current_task = self._pop_task()
         self._task_cond.release()
 
-        exit_code, output, error, full_context, file_hash = self.current_task.execute()
+        if self._cache_dir_pool is not None:
+            if self.cache_dir is None:
+                self.cache_dir = self._cache_dir_pool.acquire()
+            self.current_task.cache_dir = self.cache_dir
+
+        started_at = time.time()
+        result = self._execute_task(self.current_task)
+        sibling_results = []    # type: List[SiblingResult]
+        # Errors in other files may be down to the unsaved buffer.
+        if (result is not None and not self.current_task.interrupted and not self.current_task.timed_out and
+                not self.current_task.is_buffer):
+            sibling_results = self._sibling_results(self.current_task, result[1], started_at)
 
         self._task_cond.acquire()
-        self.file_cache.store(self.current_task.filename, file_hash, output)
+        if result is None or self.current_task.interrupted:
+            # The task didn't finish, so put it back unless it's
+            # already been queued up again.
+            if self.current_task.is_buffer:
+                assert self._buffer_tasks is not None
+                if self.current_task not in self._buffer_tasks:
+                    self._buffer_tasks.insert(0, self.current_task)  # type: ignore
+            elif not self.current_task_is_background:
+                if self.current_task not in self._task_pool:
+                    self._task_pool.insert(0, self.current_task)
+            else:
+                assert self._background_queue is not None
+                self._background_queue.requeue(self.current_task)
+            self.current_task = None
+            self._task_cond.notify_all()
+            self._task_cond.release()
+            return
+
+        exit_code, output, error, full_context, file_hash = result
+        task = self.current_task
+        if not file_hash:
+            # The task failed before mypy could check the file, e.g. with a
+            # broken config. Running it again would fail the same way, so it's
+            # dropped until the file changes.
+            print('Failed to check {}:\n{}'.format(task.filename, error))
+            self.current_task = None
+            if self.current_task_is_background:
+                assert self._background_queue is not None
+                self._background_queue.task_done()
+            self._task_cond.notify_all()
+            self._task_cond.release()
+            return
+        diagnostics = task.diagnostics
+        if diagnostics is None:
+            diagnostics = parse_mypy_output(output)
+        # Timed out tasks aren't retried until the file changes again, but
+        # clients asking about the file are told why there's no result.
+        status = RESULT_TIMED_OUT if task.timed_out else RESULT_DONE
+        if task.is_buffer:
+            # Editors ask for these, there's nothing to print.
+            self.file_cache.store_buffer(task.filename, file_hash, output, diagnostics, status)
+            self.current_task = None
+            self._task_cond.notify_all()
+            self._task_cond.release()
+            return
+        self.file_cache.store(task.filename, file_hash, output, diagnostics, status)
+        if task.credit_siblings:
+            self._credit_siblings(sibling_results)
         self.current_task = None
-        if len(output) > 0:
+        if self.current_task_is_background:
+            # Background checks just warm the cache, keep them quiet.
+            assert self._background_queue is not None
+            self._background_queue.task_done()
+        elif task.timed_out:
+            print('Timed out checking {}'.format(task.filename))
+        elif len(output) > 0:
             if self.compact:
                 sys.stdout.write(output)
             else:
@@ -51,4 +301,3 @@ class MypyWorker(BaseThread):
             assert exit_code == 0
         self._task_cond.notify_all()
         self._task_cond.release()
-
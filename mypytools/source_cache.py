@@ -0,0 +1,136 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import hashlib
+import marshal
+import sys
+from collections import OrderedDict
+from threading import Lock
+
+from mypytools import annotations, source_utils
+from mypytools.annotations import FunctionIndex
+from mypytools.cache_files import atomic_write, code_version
+
+MYPY = False
+if MYPY:
+    from typing import Any, List, Optional, Tuple, Union  # noqa
+
+SOURCE_CACHE_FILENAME = '.mypy_source_cache'
+DEFAULT_MAX_ENTRIES = 10000
+
+# Bump this when FunctionIndex changes in a way the code hash below
+# wouldn't notice.
+CACHE_VERSION = 1
+
+
+def read_source(path):
+    # type: (str) -> Tuple[str, str]
+    """ The md5 of the file's contents and its source. Raises IOError if it
+    can't be read and UnicodeDecodeError if it isn't UTF-8.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    content_hash = hashlib.md5(data).hexdigest()
+    source = data if isinstance(data, str) else data.decode('utf-8')
+    if '\r' in source:
+        # The same line endings as reading the file in text mode.
+        source = source.replace('\r\n', '\n').replace('\r', '\n')
+    return content_hash, source
+
+
+def cache_version():
+    # type: () -> str
+    """ Identifies the code that built the cached indexes and the marshal
+    format they're stored in, so a stale store is thrown away.
+    """
+    return code_version('{} {}'.format(CACHE_VERSION, sys.version_info[:2]),
+                        [annotations.__file__, source_utils.__file__])
+
+
+class SourceCache(object):
+    """ Function indexes of parsed sources, by the md5 of their contents, so
+    a file is only parsed again when it changes. The least recently used
+    entries are dropped past max_entries.
+
+    It can be stored on disk with marshal, which the annotation checker,
+    the coverage printer and the server all share, so a file parsed by one
+    of them isn't parsed again by the others.
+    """
+
+    def __init__(self, path=None, max_entries=DEFAULT_MAX_ENTRIES):
+        # type: (Optional[str], int) -> None
+        self.path = path
+        self.max_entries = max_entries
+        # Entries loaded from disk stay tuples until they're used.
+        self._entries = OrderedDict()   # type: OrderedDict[str, Union[FunctionIndex, Tuple]]
+        self._changed = False
+        self._lock = Lock()
+
+    @classmethod
+    def load(cls, path, max_entries=DEFAULT_MAX_ENTRIES):
+        # type: (str, int) -> SourceCache
+        cache = cls(path, max_entries)
+        try:
+            with open(path, 'rb') as f:
+                version, entries = marshal.load(f)
+        except (IOError, EOFError, ValueError, TypeError):
+            return cache
+        if version != cache_version():
+            return cache
+        for content_hash, data in entries[-max_entries:]:
+            cache._entries[content_hash] = data
+        return cache
+
+    def __len__(self):
+        # type: () -> int
+        return len(self._entries)
+
+    def get(self, content_hash):
+        # type: (str) -> Optional[FunctionIndex]
+        with self._lock:
+            entry = self._entries.pop(content_hash, None)
+            if entry is None:
+                return None
+            if not isinstance(entry, FunctionIndex):
+                entry = FunctionIndex.from_tuple(entry)
+            self._entries[content_hash] = entry
+            return entry
+
+    def set(self, content_hash, function_index):
+        # type: (str, FunctionIndex) -> None
+        with self._lock:
+            self._entries.pop(content_hash, None)
+            self._entries[content_hash] = function_index
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._changed = True
+
+    def parse(self, content_hash, source):
+        # type: (str, str) -> FunctionIndex
+        """ The index of the source, only parsing it if it isn't cached.
+        Raises SyntaxError if it doesn't parse.
+        """
+        function_index = self.get(content_hash)
+        if function_index is None:
+            function_index = FunctionIndex.from_source(source)
+            self.set(content_hash, function_index)
+        return function_index
+
+    def parse_file(self, path):
+        # type: (str) -> FunctionIndex
+        """ Like parse, reading the file. Also raises read_source's errors. """
+        content_hash, source = read_source(path)
+        return self.parse(content_hash, source)
+
+    def save(self):
+        # type: () -> None
+        """ Writes the cache back to its path, if anything was added. """
+        if self.path is None or not self._changed:
+            return
+        with self._lock:
+            entries = [(content_hash, entry if isinstance(entry, tuple) else entry.to_tuple())
+                       for content_hash, entry in self._entries.items()]
+            self._changed = False
+        with atomic_write(self.path, 'wb') as f:
+            marshal.dump((cache_version(), entries), f)
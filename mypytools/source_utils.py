@@ -4,13 +4,32 @@ from __future__ import division
 
 import ast
 import re
+from collections import namedtuple
 
-from typing import List, Tuple, Optional
+MYPY = False
+if MYPY:
+    from typing import Dict, List, Tuple, Optional  # noqa
 
 DECORATOR_PATTERN = re.compile(r'^\s*@')
 TYPE_PATTERN = re.compile(r'^\s+#\s+type:\s+')
 
 
+class FunctionSignature(namedtuple('FunctionSignature', [
+        'first_line', 'def_line', 'signature_end_line', 'has_type_comment', 'has_annotations'])):
+    """ Where a function's decorators and signature are, and how it's annotated.
+
+    first_line is the first decorator's line, or the def line if there are
+    none. signature_end_line is where the parameter list's parens close, and
+    the line after it is where a type comment goes.
+    """
+    __slots__ = ()
+
+    @property
+    def is_annotated(self):
+        # type: () -> bool
+        return self.has_type_comment or self.has_annotations
+
+
 def find_final_line_including_parens(lines, line_num):
     # type: (List[str], int) -> int
     # It's very challenging to find the *end* of a decorator.
@@ -114,24 +133,7 @@ def is_func_def_annotated(func, lines):
     """ Produce True if either Python3 or Python2 style type annotations found
     for the given function
     """
-    if getattr(func, 'returns', None):
-        return True
-
-    for arg in func.args.args:
-        if getattr(arg, 'annotation', None):
-            return True
-
-    first_line_num = find_first_line_of_func(lines, func.lineno)
-    first_line = lines[first_line_num]
-    if is_line_annotated(first_line):
-        return True
-
-    end_line_of_def = lines[first_line_num - 1]
-    function_definition, rest = end_line_of_def.split(':', 1)
-    if is_line_annotated(rest):
-        return True
-
-    return False
+    return read_signature(lines, func).is_annotated
 
 
 def parse_source(source):
@@ -142,3 +144,41 @@ def parse_source(source):
     return lines, tree
 
 
+def has_annotations(func):
+    # type: (ast.FunctionDef) -> bool
+    """ Whether the function has Python 3 style annotations. """
+    if getattr(func, 'returns', None):
+        return True
+    for arg in func.args.args:
+        if getattr(arg, 'annotation', None):
+            return True
+    return False
+
+
+def read_signature(lines, func):
+    # type: (List[str], ast.FunctionDef) -> FunctionSignature
+    """ Finds where the function's decorators and signature are, scanning
+    them once so checking and reporting the function don't scan them again.
+    """
+    first_line = min([func.lineno] + [decorator.lineno for decorator in func.decorator_list])
+    def_line = func.lineno
+    if func.decorator_list and def_line == first_line:
+        # Older Pythons give the first decorator's line as the function's
+        # lineno, so skip over the decorators to find the def.
+        while DECORATOR_PATTERN.search(lines[def_line]) is not None:
+            def_line = find_final_line_including_parens(lines, def_line) + 1
+    signature_end_line = find_final_line_including_parens(lines, def_line)
+
+    _, _, rest = lines[signature_end_line].partition(':')
+    has_type_comment = is_line_annotated(rest) or is_line_annotated(lines[signature_end_line + 1])
+    return FunctionSignature(first_line, def_line, signature_end_line, has_type_comment, has_annotations(func))
+
+
+def index_signatures(lines, tree):
+    # type: (List[str], ast.AST) -> Dict[int, FunctionSignature]
+    """ Reads the signature of every function in the tree, by ast lineno. """
+    signatures = {}     # type: Dict[int, FunctionSignature]
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef):
+            signatures[node.lineno] = read_signature(lines, node)
+    return signatures
@@ -14,6 +14,9 @@ setup(name='mypytools',
       packages=['mypytools', 'mypytools.server'],
       scripts=[
           'bin/check_mypy_annotations.py',
+          'bin/mypy_agent.py',
+          'bin/mypy_cache_server.py',
+          'bin/mypy_client.py',
           'bin/mypy_server.py',
           'bin/print_mypy_coverage.py',
       ],
@@ -0,0 +1,83 @@
+""" Coordinators, agents and fakes shared by the server tests. """
+import hashlib
+import os
+import time
+from threading import Event, Thread
+
+from typing import Any, Tuple  # noqa
+
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock   # type: ignore
+
+from mypytools.server.mypy_agent import MypyAgent
+from mypytools.server.mypy_agent_server import AgentServerThread
+from mypytools.server.mypy_diagnostics import Diagnostic  # noqa
+from mypytools.server.mypy_event_handler import MypyEventHandler
+from mypytools.server.mypy_file_cache import MypyFileCache
+
+ROOT_DIR = '/coordinator/root'
+
+
+class FakeTask(object):
+    def __init__(self, filename, block):
+        # type: (str, bool) -> None
+        self.filename = filename
+        self.interrupted = Event()
+        self.timed_out = False
+        self.block = block
+
+    def execute(self):
+        # type: () -> Tuple[int, str, str, str, str]
+        if self.block:
+            self.interrupted.wait(5)
+        return 1, '{}:1: error: bad\n'.format(self.filename), '', '', 'hash-' + os.path.basename(self.filename)
+
+    def interrupt(self):
+        # type: () -> None
+        self.interrupted.set()
+
+
+class FakeAgent(MypyAgent):
+    block = False
+
+    def _make_task(self, filename):
+        # type: (str) -> Any
+        return FakeTask(filename, self.block)
+
+
+def start_coordinator():
+    # type: () -> Tuple[MypyEventHandler, AgentServerThread]
+    queueing_handler = Mock()
+    queueing_handler.has_new_events = False
+    handler = MypyEventHandler(None, queueing_handler, MypyFileCache(), True, 0)
+    server = AgentServerThread(handler, '127.0.0.1:0', ROOT_DIR)
+    server.start()
+    server.ready.wait(5)
+    return handler, server
+
+
+def start_agent(server, name, agent_cls=FakeAgent):
+    # type: (AgentServerThread, str, Any) -> MypyAgent
+    host, port = server.bound_address
+    agent = agent_cls('{}:{}'.format(host, port), '/agent/root', name=name)
+    agent.connect()
+    thread = Thread(target=agent.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return agent
+
+
+def cached(file_cache, filename):
+    # type: (MypyFileCache, str) -> Tuple[str, str, str, Tuple[Diagnostic, ...], str]
+    """ The (file hash, output, filename, diagnostics, status) stored for the file. """
+    return file_cache._cache[hashlib.md5(filename.encode('utf-8')).hexdigest()]
+
+
+def wait_for(predicate):
+    # type: (Any) -> None
+    deadline = time.time() + 5
+    while not predicate():
+        assert time.time() < deadline
+        time.sleep(0.01)
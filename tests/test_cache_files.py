@@ -0,0 +1,32 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import pytest
+from typing import Any  # noqa
+
+from mypytools.cache_files import atomic_write, code_version
+
+
+def test_interrupted_write_keeps_old_file(tmpdir):
+    # type: (Any) -> None
+    path = tmpdir.join('cache')
+    with atomic_write(str(path)) as f:
+        f.write('old')
+
+    with pytest.raises(KeyboardInterrupt):
+        with atomic_write(str(path)) as f:
+            f.write('trunc')
+            raise KeyboardInterrupt()
+    assert path.read() == 'old'
+    assert tmpdir.listdir() == [path]
+
+
+def test_code_version_follows_module_contents(tmpdir):
+    # type: (Any) -> None
+    module = tmpdir.join('module.py')
+    module.write('x = 1\n')
+    version = code_version('1', [str(module)])
+    assert version != code_version('2', [str(module)])
+    module.write('x = 2\n')
+    assert version != code_version('1', [str(module)])
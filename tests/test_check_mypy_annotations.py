@@ -4,20 +4,23 @@ from __future__ import division
 from __future__ import print_function
 
 import ast  # noqa
+import os
+import subprocess
 
-from typing import Optional, Dict, Set, List  # noqa
+from typing import Any, Optional, Dict, Set, List  # noqa
 
-from bin.check_mypy_annotations import fill_line_to_func_gaps, process_source, visit_node
+from bin.check_mypy_annotations import FunctionSpans, check_annotations, parse_diff, process_source
 from mypytools import source_utils
+from mypytools.annotations import FunctionIndex
 
 
 def get_error_lines(source, added_lines):
     # type: (str, Set[int]) -> List[int]
-    line_to_func_map = {}  # type: Dict[int, Optional[ast.FunctionDef]]
     lines, tree = source_utils.parse_source(source)
-    visit_node(tree, line_to_func_map)
-    fill_line_to_func_gaps(line_to_func_map, len(lines))
-    return process_source(lines, added_lines, line_to_func_map)
+    error_lines = process_source(lines, added_lines, FunctionSpans(tree, added_lines))
+    # The cached index the command line uses has to agree.
+    assert FunctionIndex.from_source(source).missing_annotations([(line, line) for line in added_lines]) == error_lines
+    return error_lines
 
 
 def test_no_annotation():
@@ -210,3 +213,118 @@ def foo(a, b):  # type: (int, int) -> int
     """
     error_lines = get_error_lines(source, {3})
     assert error_lines == []
+
+
+def test_parse_diff():
+    # type: () -> None
+    diff = '\n'.join([
+        'diff --git a/a.py b/a.py',
+        'index 1111111..2222222 100644',
+        '--- a/a.py',
+        '+++ b/a.py',
+        '@@ -1,0 +2,2 @@ def foo():',
+        '+x = 1',
+        '+++ b/not_a_header.py',
+        '@@ -10 +11 @@',
+        '-old',
+        '+new',
+        '@@ -20,3 +21,0 @@',
+        '-gone',
+        '-gone',
+        '-gone',
+        'diff --git a/deleted.py b/deleted.py',
+        '--- a/deleted.py',
+        '+++ /dev/null',
+        '@@ -1,2 +0,0 @@',
+        '-a',
+        '-b',
+        'diff --git a/only_deletions.py b/only_deletions.py',
+        '--- a/only_deletions.py',
+        '+++ b/only_deletions.py',
+        '@@ -3 +2,0 @@',
+        '-a',
+        '',
+    ])
+    assert parse_diff(diff) == {'a.py': [(2, 3), (11, 11)]}
+
+
+def test_check_annotations_against_git(tmpdir, capsys):
+    # type: (Any, Any) -> None
+    def git(*args):
+        # type: (*str) -> None
+        subprocess.check_call(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com'] + list(args),
+                              cwd=str(tmpdir), stdout=subprocess.PIPE)
+
+    def write(name, source):
+        # type: (str, str) -> None
+        with open(str(tmpdir.join(name)), 'w') as f:
+            f.write(source)
+
+    git('init', '-q')
+    write('a.py', 'x = 1\n')
+    write('script', '#!/usr/bin/env python\n')
+    write('notes.txt', 'def not_python():\n')
+    git('add', '.')
+    git('commit', '-q', '-m', 'initial')
+
+    write('a.py', 'x = 1\n\n\ndef new():\n    return 2\n')
+    write('script', '#!/usr/bin/env python\ndef run():\n    pass\n')
+    write('notes.txt', 'def not_python():\ndef still_not_python():\n')
+
+    cwd = os.getcwd()
+    os.chdir(str(tmpdir))
+    try:
+        check_annotations('HEAD', jobs=2)
+    finally:
+        os.chdir(cwd)
+    root = subprocess.check_output(['git', 'rev-parse', '--show-toplevel'], cwd=str(tmpdir),
+                                   universal_newlines=True).strip()
+    assert capsys.readouterr().out.split('\n') == [  # type: ignore
+        '{}:5 Please add a mypy annotation!'.format(os.path.join(root, 'a.py')),
+        '{}:3 Please add a mypy annotation!'.format(os.path.join(root, 'script')),
+        '',
+    ]
+
+
+def test_function_spans_find_innermost():
+    # type: () -> None
+    source = """import os
+
+
+@decorator(
+    arg)
+def outer():
+    x = 1
+
+    def inner():
+        return x
+
+    y = 2
+    class Nested(object):
+        def method(self):
+            pass
+
+x = 3
+
+
+def last():
+    pass
+"""
+    _, tree = source_utils.parse_source(source)
+    spans = FunctionSpans(tree)
+    names = [getattr(spans.find(line_num), 'name', None) for line_num in range(1, 22)]
+    assert names == [
+        None, None, None,
+        'outer', 'outer', 'outer', 'outer', 'outer',
+        'inner', 'inner',
+        'outer', 'outer', 'outer',
+        'method', 'method',
+        None, None, None, None,
+        'last', 'last',
+    ]
+
+    # Only the functions around the added lines are collected.
+    spans = FunctionSpans(tree, {10, 20})
+    assert [func.name for func in spans.funcs] == ['outer', 'inner', 'last']
+    assert spans.find(10).name == 'inner'   # type: ignore
+    assert spans.find(20).name == 'last'    # type: ignore
@@ -0,0 +1,16 @@
+import json
+import os
+
+from typing import Any  # noqa
+
+from mypytools import config as config_module
+from mypytools.config import get_src_dirs
+
+
+def test_src_dirs_load_the_config(tmpdir, monkeypatch):
+    # type: (Any, Any) -> None
+    with open(str(tmpdir.join('.mypy_server')), 'w') as f:
+        json.dump({'src_dirs': [{'path': 'src'}, {'path': 'lib'}]}, f)
+    monkeypatch.setattr(config_module, 'config', {})
+    monkeypatch.chdir(str(tmpdir))
+    assert get_src_dirs() == [os.path.join(str(tmpdir), 'src'), os.path.join(str(tmpdir), 'lib')]
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def modules_loaded_by(module):
+    # type: (str) -> str
+    return subprocess.check_output(
+        [sys.executable, '-c', 'import sys, {}; print(" ".join(sys.modules))'.format(module)],
+        cwd=ROOT_DIR, universal_newlines=True)
+
+
+@pytest.mark.parametrize('module', ['bin.check_mypy_annotations', 'bin.print_mypy_coverage', 'bin.mypy_client'])
+def test_cli_imports_stay_light(module):
+    # type: (str) -> None
+    loaded = modules_loaded_by(module).split()
+    assert 'click' not in loaded
+    assert 'typing' not in loaded
+
+
+def test_config_not_loaded_on_import():
+    # type: () -> None
+    output = subprocess.check_output(
+        [sys.executable, '-c', 'from mypytools.config import config; print(len(config))'],
+        cwd='/', env=dict(os.environ, PYTHONPATH=ROOT_DIR), universal_newlines=True)
+    assert output.strip() == '0'
@@ -0,0 +1,103 @@
+import os
+
+from typing import Any, List  # noqa
+
+from mypytools.server import mypy_task
+from mypytools.server.mypy_agent import MypyAgent, parse_address
+from mypytools.server.mypy_event_handler import MypyEventHandler
+from mypytools.server.mypy_task import MypyTask
+from tests.mypy_server_helpers import ROOT_DIR, FakeAgent, cached, start_agent, start_coordinator, wait_for
+
+
+def run_cycle(handler, filenames):
+    # type: (MypyEventHandler, List[str]) -> None
+    handler.task_cond.acquire()
+    for filename in filenames:
+        handler._add_task(MypyTask(filename))
+    handler._enable_workers()
+    handler._wait_until_tasks_completed()
+    handler._disable_workers()
+    handler.task_cond.release()
+
+
+def test_parse_address():
+    # type: () -> None
+    assert parse_address('localhost:9000')[1] == ('localhost', 9000)
+    assert parse_address('unix:/tmp/agents.sock')[1] == '/tmp/agents.sock'
+
+
+def test_several_agents():
+    # type: () -> None
+    handler, server = start_coordinator()
+    for i in range(3):
+        start_agent(server, 'agent-{}'.format(i))
+    wait_for(lambda: len(handler.worker_pool) == 3)
+
+    filenames = [os.path.join(ROOT_DIR, 'pkg', 'mod{}.py'.format(i)) for i in range(12)]
+    run_cycle(handler, filenames)
+
+    for filename in filenames:
+        output = cached(handler.file_cache, filename)[1]
+        # Agent paths get mapped back onto the coordinator's checkout.
+        assert output == '{}:1: error: bad\n'.format(filename)
+    assert sum(agent['tasks_completed'] for agent in server.agents()) == 12
+    server.stop()
+
+
+def test_dead_agent_task_is_requeued():
+    # type: () -> None
+    handler, server = start_coordinator()
+
+    class BlockingAgent(FakeAgent):
+        block = True
+
+    stuck_agent = start_agent(server, 'stuck', BlockingAgent)
+    wait_for(lambda: len(handler.worker_pool) == 1)
+
+    filename = os.path.join(ROOT_DIR, 'stuck.py')
+    handler.task_cond.acquire()
+    handler._add_task(MypyTask(filename))
+    handler._enable_workers()
+    handler.task_cond.release()
+    wait_for(lambda: handler.worker_pool[0].current_task is not None)
+
+    # Kill the agent mid task; a healthy agent should pick the task up.
+    stuck_agent.close()
+    wait_for(lambda: len(handler.worker_pool) == 0)
+    start_agent(server, 'healthy')
+
+    handler.task_cond.acquire()
+    handler._wait_until_tasks_completed()
+    handler._disable_workers()
+    handler.task_cond.release()
+    assert cached(handler.file_cache, filename)[0] == 'hash-stuck.py'
+    server.stop()
+
+
+
+def test_failed_task_finishes_the_cycle(monkeypatch):
+    # type: (Any) -> None
+    def missing_config():
+        # type: () -> Any
+        raise RuntimeError('Unable to find .mypy_server config file')
+    monkeypatch.setattr(mypy_task, 'get_profiles', missing_config)
+    handler, server = start_coordinator()
+    start_agent(server, 'broken', MypyAgent)
+    wait_for(lambda: len(handler.worker_pool) == 1)
+
+    filename = os.path.join(ROOT_DIR, 'broken.py')
+    handler.task_cond.acquire()
+    handler._add_task(MypyTask(filename))
+    handler._enable_workers()
+    handler.task_cond.release()
+    wait_for(lambda: server.agents()[0]['tasks_failed'] == 1)
+
+    handler.task_cond.acquire()
+    handler._wait_until_tasks_completed()
+    handler._disable_workers()
+    handler.task_cond.release()
+    # It isn't retried or stored until the file changes.
+    assert handler.task_pool == []
+    assert handler.file_cache._cache == {}
+    assert server.agents()[0]['alive']
+    server.stop()
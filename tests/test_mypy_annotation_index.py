@@ -0,0 +1,74 @@
+import os
+import subprocess
+
+from typing import Any  # noqa
+
+from mypytools.server.mypy_annotation_index import AnnotationIndex
+from mypytools.source_cache import SourceCache
+
+
+def git(root, *args):
+    # type: (str, *str) -> None
+    subprocess.check_call(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com'] + list(args),
+                          cwd=root, stdout=subprocess.PIPE)
+
+
+def write(root, name, source):
+    # type: (str, str, str) -> str
+    path = os.path.join(root, name)
+    with open(path, 'w') as f:
+        f.write(source)
+    return path
+
+
+def test_check_reuses_parsed_sources(tmpdir):
+    # type: (Any) -> None
+    root = str(tmpdir)
+    git(root, 'init', '-q')
+    write(root, 'a.py', 'x = 1\n')
+    write(root, 'b.py', 'y = 1\n')
+    git(root, 'add', '.')
+    git(root, 'commit', '-q', '-m', 'initial')
+    root = subprocess.check_output(['git', 'rev-parse', '--show-toplevel'], cwd=root,
+                                   universal_newlines=True).strip()
+
+    a = write(root, 'a.py', 'x = 1\n\n\ndef f():\n    return 1\n\n\ndef g():\n    # type: () -> int\n    return 2\n')
+    b = write(root, 'b.py', 'y = 1\ndef broken(:\n')
+    index = AnnotationIndex()
+    # b.py doesn't parse, so it's skipped.
+    assert index.check('HEAD', cwd=root) == [(a, 5)]
+    parsed = index.get(a)
+    assert index.check('HEAD', cwd=root) == [(a, 5)]
+    assert index.get(a) is parsed
+
+    # The contents haven't changed, so they aren't parsed again.
+    index.invalidate(a)
+    assert index.get(a) is parsed
+
+    write(root, 'a.py', 'x = 1\n\n\ndef f():\n    # type: () -> int\n    return 1\n')
+    os.utime(a, (0, 0))
+    assert index.check('HEAD', cwd=root) == []
+    assert index.get(a) is not parsed
+    assert index.get(b) is None
+
+
+def test_source_cache_saved_between_checks(tmpdir):
+    # type: (Any) -> None
+    root = str(tmpdir)
+    git(root, 'init', '-q')
+    write(root, 'a.py', 'x = 1\n')
+    git(root, 'add', '.')
+    git(root, 'commit', '-q', '-m', 'initial')
+    write(root, 'a.py', 'x = 1\n\n\ndef f():\n    return 1\n')
+    cache_path = str(tmpdir.join('.mypy_source_cache'))
+
+    index = AnnotationIndex(SourceCache(cache_path), save_interval=3600)
+    assert len(index.check('HEAD', cwd=root)) == 1
+    assert not os.path.exists(cache_path)
+    index.save()
+    assert len(SourceCache.load(cache_path)) == 1
+
+    index = AnnotationIndex(SourceCache(cache_path), save_interval=0)
+    os.unlink(cache_path)
+    index.check('HEAD', cwd=root)
+    assert len(SourceCache.load(cache_path)) == 1
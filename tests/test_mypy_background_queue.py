@@ -0,0 +1,35 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from typing import List  # noqa
+
+from mypytools.server.mypy_background_queue import BackgroundQueue
+from mypytools.server.mypy_task import MypyTask
+
+
+def make_tasks(*names):
+    # type: (*str) -> List[MypyTask]
+    return [MypyTask('/root/{}.py'.format(name)) for name in names]
+
+
+def test_queue_order_and_counts():
+    # type: () -> None
+    queue = BackgroundQueue('warm start')
+    queue.extend(make_tasks('a', 'b', 'c', 'a'))
+    assert queue.tasks == make_tasks('a', 'b', 'c')
+
+    queue.prioritize(make_tasks('c', 'd'))
+    assert queue.tasks == make_tasks('c', 'd', 'a', 'b')
+    assert queue.total == 4
+
+    task = queue.pop()
+    assert task == MypyTask('/root/c.py')
+    queue.requeue(task)
+    assert queue.tasks == make_tasks('c', 'd', 'a', 'b')
+    assert queue.total == 4
+
+    queue.discard(MypyTask('/root/a.py'))
+    queue.discard(MypyTask('/root/e.py'))
+    assert queue.tasks == make_tasks('c', 'd', 'b')
+    assert (queue.completed, len(queue)) == (1, 3)
@@ -0,0 +1,60 @@
+import os
+import time
+
+from typing import Optional  # noqa
+
+from mypytools.server.mypy_cache_dirs import CacheDirPool, sync_newer_files
+
+
+def write(path, contents, mtime=None):
+    # type: (str, str, Optional[float]) -> None
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(contents)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def read(path):
+    # type: (str) -> str
+    with open(path, 'r') as f:
+        return f.read()
+
+
+def test_sync_only_copies_newer_files(tmpdir):
+    # type: (object) -> None
+    src = str(tmpdir.join('src'))   # type: ignore
+    dst = str(tmpdir.join('dst'))   # type: ignore
+    now = time.time()
+    write(os.path.join(src, '3.6', 'a.meta.json'), 'new a', now)
+    write(os.path.join(src, '3.6', 'b.meta.json'), 'old b', now - 100)
+    write(os.path.join(dst, '3.6', 'b.meta.json'), 'new b', now)
+
+    assert sync_newer_files(src, dst) == 1
+    assert read(os.path.join(dst, '3.6', 'a.meta.json')) == 'new a'
+    assert read(os.path.join(dst, '3.6', 'b.meta.json')) == 'new b'
+    # Nothing left to copy the second time around.
+    assert sync_newer_files(src, dst) == 0
+
+
+def test_workers_get_private_seeded_dirs(tmpdir):
+    # type: (object) -> None
+    baseline = str(tmpdir.join('.mypy_cache'))  # type: ignore
+    pool = CacheDirPool(baseline, os.path.join(baseline, 'workers'))
+    write(os.path.join(baseline, '3.6', 'a.data.json'), 'baseline')
+
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first != second
+    assert read(os.path.join(first, '3.6', 'a.data.json')) == 'baseline'
+    # The workers directory itself isn't copied into each worker.
+    assert not os.path.exists(os.path.join(first, 'workers'))
+
+    # Slots are reused once released.
+    pool.release(first)
+    assert pool.acquire() == first
+
+    write(os.path.join(second, '3.6', 'b.data.json'), 'from second', time.time() + 10)
+    assert pool.merge() == 1
+    assert read(os.path.join(baseline, '3.6', 'b.data.json')) == 'from second'
@@ -0,0 +1,175 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+from threading import Timer
+
+from typing import Any, List, Set  # noqa
+
+from bin import mypy_client
+from bin.mypy_client import check_files
+from mypytools import config as config_module
+from mypytools.server import mypy_toolchain
+from mypytools.server.mypy_diagnostics import Diagnostic
+from mypytools.server.mypy_file_cache import MypyFileCache
+from mypytools.server.mypy_http_client import MypyServerClient
+from mypytools.server.mypy_http_request_handler import HttpServerThread
+from mypytools.server.mypy_task import BufferTask
+
+
+class FakeEventHandler(object):
+    """ Checks requested files starting with prefix a little later. """
+
+    def __init__(self, file_cache, prefix):
+        # type: (MypyFileCache, str) -> None
+        self.file_cache = file_cache
+        self.prefix = prefix
+        self.requested = []     # type: List[List[str]]
+        self.buffers_requested = []     # type: List[BufferTask]
+
+    def _store(self, filename):
+        # type: (str) -> None
+        with open(filename, 'rb') as f:
+            file_hash = hashlib.md5(f.read()).hexdigest()
+        self.file_cache.store(filename, file_hash, '', [Diagnostic(filename, 1, None, 'note', None, 'Checked')])
+
+    def request_checks(self, filenames):
+        # type: (List[str]) -> Set[str]
+        self.requested.append(filenames)
+        pending = {filename for filename in filenames if filename.startswith(self.prefix)}
+        for filename in pending:
+            Timer(0.1, self._store, [filename]).start()
+        return pending
+
+
+    def _store_buffer(self, task):
+        # type: (BufferTask) -> None
+        diagnostics = [Diagnostic(task.filename, 1, None, 'error', None, task.contents.strip())]
+        self.file_cache.store_buffer(task.filename, task.buffer_hash, '', diagnostics)
+
+    def request_buffer_check(self, task):
+        # type: (BufferTask) -> bool
+        self.buffers_requested.append(task)
+        Timer(0.1, self._store_buffer, [task]).start()
+        return True
+
+
+def start_server(root_dir, event_handler):
+    # type: (str, FakeEventHandler) -> HttpServerThread
+    thread = HttpServerThread(event_handler.file_cache, address=('127.0.0.1', 0), root_dir=root_dir,
+                              event_handler=event_handler)    # type: ignore
+    thread.start()
+    thread.ready.wait()
+    return thread
+
+
+def test_check_files(tmpdir, capsys, monkeypatch):
+    # type: (Any, Any, Any) -> None
+    src = tmpdir.mkdir('src')
+    checked = src.join('checked.py')
+    checked.write('a = 1\n')
+    unchecked = src.join('unchecked.py')
+    unchecked.write('a = 1\n')
+    other = tmpdir.join('other.py')
+    other.write('b = 1\n')
+
+    file_cache = MypyFileCache()
+    diagnostics = [Diagnostic(str(other), 1, 5, 'error', 'assignment', 'Incompatible types in assignment'),
+                   Diagnostic('src/imported.py', 2, None, 'note', None, 'See above')]
+    file_cache.store(str(other), hashlib.md5(b'b = 1\n').hexdigest(), '', diagnostics)
+    event_handler = FakeEventHandler(file_cache, str(checked))
+    thread = start_server(str(tmpdir), event_handler)
+    client = MypyServerClient(str(tmpdir), thread.server_address[1])
+    monkeypatch.chdir(tmpdir)
+    try:
+        exit_code = check_files(['other.py', str(checked), 'src/unchecked.py', 'missing.py', 'other.py'],
+                                client=client)
+    finally:
+        thread.stop()
+
+    out, err = capsys.readouterr()
+    assert out.splitlines() == [
+        'other.py:1:5: error: Incompatible types in assignment  [assignment]',
+        'src/imported.py:2: note: See above',
+        '{}:1: note: Checked'.format(checked),
+    ]
+    assert err.splitlines() == [
+        'src/unchecked.py: not in a src dir the mypy server checks',
+        "missing.py: can't read file",
+    ]
+    assert exit_code == 2
+    # Only pending files are asked about again.
+    assert event_handler.requested[0] == [str(checked), str(unchecked)]
+    assert event_handler.requested[1] == [str(checked)]
+
+    # mypy only runs here once the server is gone.
+    monkeypatch.setattr(mypy_client, 'run_mypy', lambda paths, buffers: diagnostics[:1])
+    assert check_files(['other.py'], client=client) == 1
+    out, err = capsys.readouterr()
+    assert out == 'other.py:1:5: error: Incompatible types in assignment  [assignment]\n'
+    assert 'running mypy directly' in err
+
+
+def test_check_unsaved_buffers(tmpdir, capsys):
+    # type: (Any, Any) -> None
+    path = tmpdir.join('a.py')
+    path.write('a = 1\n')
+    tmpdir.join('buffer').write('a = "unsaved"\n')
+    event_handler = FakeEventHandler(MypyFileCache(), str(path))
+    thread = start_server(str(tmpdir), event_handler)
+    client = MypyServerClient(str(tmpdir), thread.server_address[1])
+    shadow_files = [(str(path), str(tmpdir.join('buffer')))]
+    try:
+        assert check_files([str(path)], client=client, shadow_files=shadow_files) == 1
+        num_requested = len(event_handler.buffers_requested)
+        # The second time the result comes straight from the cache.
+        assert check_files([str(path)], client=client, shadow_files=shadow_files) == 1
+    finally:
+        thread.stop()
+    out, _ = capsys.readouterr()
+    assert out == '{}:1: error: a = "unsaved"\n'.format(path) * 2
+    assert len(event_handler.buffers_requested) == num_requested
+    assert event_handler.buffers_requested[0].contents == 'a = "unsaved"\n'
+    assert event_handler.requested == []
+
+
+class PendingClient(object):
+    """ A server that never finishes checking anything. """
+
+    def __init__(self):
+        # type: () -> None
+        self.num_requests = 0
+
+    def request(self, method, path, body=None):
+        # type: (str, str, Any) -> Any
+        self.num_requests += 1
+        paths = json.loads(body.decode('utf-8'))['paths']
+        return 200, json.dumps([{'path': path, 'hash': 'hash', 'status': 'pending', 'diagnostics': None}
+                                for path in paths]).encode('utf-8')
+
+
+def test_dropped_checks_stop_being_retried(monkeypatch):
+    # type: (Any) -> None
+    monkeypatch.setattr(mypy_client, 'POLL_INTERVAL', 0.0)
+    monkeypatch.setattr(mypy_client, 'MAX_POLL_INTERVAL', 0.0)
+    client = PendingClient()
+    results = mypy_client.query_server(client, ['/a.py'], timeout=60, max_retries=3)  # type: ignore
+    assert results['/a.py']['status'] == 'pending'
+    assert client.num_requests == 4
+
+
+def test_outside_a_project(tmpdir, capsys, monkeypatch):
+    # type: (Any, Any, Any) -> None
+    monkeypatch.setattr(config_module, 'config', {})
+    monkeypatch.setattr(mypy_toolchain, '_profiles', None)
+    monkeypatch.chdir(tmpdir)
+    assert check_files(['a.py']) == 2
+    assert capsys.readouterr().err == "Can't check files: Unable to find .mypy_server config file\n"
+
+    # Falling back on running mypy here needs the config too.
+    client = MypyServerClient(str(tmpdir), None)
+    assert check_files(['a.py'], client=client) == 2
+    assert capsys.readouterr().err.endswith("Can't check files: Unable to find .mypy_server config file\n")
@@ -0,0 +1,53 @@
+from mypytools.server.mypy_diagnostics import (
+    Diagnostic, diagnostic_to_json, format_diagnostic, group_output_by_path, parse_mypy_output)
+
+
+def test_parse_mypy_output():
+    # type: () -> None
+    output = '\n'.join([
+        'a.py:1: error: Incompatible types in assignment (expression has type "str", variable has type "int")',
+        'a.py:12:5: error: Name "foo" is not defined  [name-defined]',
+        'b/c.py:3: note: See https://mypy.readthedocs.io/en/latest/',
+        'b/c.py:4:1: error: Dict entry 0 has incompatible type "str": "int"',
+        'Found 3 errors in 2 files (checked 1 source file)',
+        '',
+    ])
+    assert parse_mypy_output(output) == [
+        Diagnostic('a.py', 1, None, 'error', None,
+                   'Incompatible types in assignment (expression has type "str", variable has type "int")'),
+        Diagnostic('a.py', 12, 5, 'error', 'name-defined', 'Name "foo" is not defined'),
+        Diagnostic('b/c.py', 3, None, 'note', None, 'See https://mypy.readthedocs.io/en/latest/'),
+        Diagnostic('b/c.py', 4, 1, 'error', None, 'Dict entry 0 has incompatible type "str": "int"'),
+    ]
+
+
+def test_diagnostic_to_json():
+    # type: () -> None
+    diagnostic = Diagnostic('a.py', 12, 5, 'error', 'name-defined', 'Name "foo" is not defined')
+    assert diagnostic_to_json(diagnostic) == {
+        'path': 'a.py',
+        'line': 12,
+        'column': 5,
+        'severity': 'error',
+        'code': 'name-defined',
+        'message': 'Name "foo" is not defined',
+    }
+
+
+def test_format_diagnostic():
+    # type: () -> None
+    lines = [
+        'a.py:1: error: Incompatible types in assignment',
+        'a.py:12:5: error: Name "foo" is not defined  [name-defined]',
+        'b/c.py:3: note: See https://mypy.readthedocs.io/en/latest/',
+    ]
+    assert [format_diagnostic(diagnostic) for diagnostic in parse_mypy_output('\n'.join(lines))] == lines
+
+
+def test_group_output_by_path():
+    # type: () -> None
+    output = 'b.py:1: error: one\na.py:2: error: two\nb.py:3: note: three\nFound 2 errors in 2 files\n'
+    groups = group_output_by_path(output)
+    assert list(groups) == ['b.py', 'a.py']
+    assert groups['b.py'][0] == ['b.py:1: error: one', 'b.py:3: note: three']
+    assert [d.line for d in groups['b.py'][1]] == [1, 3]
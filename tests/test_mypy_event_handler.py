@@ -0,0 +1,167 @@
+import json
+import os
+
+from typing import Any, Dict, List  # noqa
+
+from findimports import Module, ModuleGraph
+
+from mypytools.config import config, get_src_dirs, load_config_file
+from mypytools.server import mypy_toolchain
+from mypytools.server.mypy_event_handler import MypyEventHandler
+from mypytools.server.mypy_file_cache import MypyFileCache
+from mypytools.server.mypy_remote_cache import RemoteCacheClient
+from mypytools.server.mypy_task import BufferTask, MypyTask
+from mypytools.server.mypy_toolchain import Toolchain, load_profiles
+from tests.mypy_server_helpers import (
+    ROOT_DIR, FakeAgent, Mock, cached, start_agent, start_coordinator, wait_for)
+
+
+class FakeGraph(object):
+    def __init__(self, filenames):
+        # type: (List[str]) -> None
+        self.modules = {os.path.basename(f): Module(os.path.basename(f), f) for f in filenames}
+
+    def listModules(self):
+        # type: () -> List[Module]
+        return list(self.modules.values())
+
+
+def test_warm_start_fills_cache(capsys):
+    # type: (object) -> None
+    handler, server = start_coordinator()
+    filenames = [os.path.join(ROOT_DIR, 'mod{}.py'.format(i)) for i in range(20)]
+    handler.dep_graph = FakeGraph(filenames)
+    start_agent(server, 'agent')
+    wait_for(lambda: len(handler.worker_pool) == 1)
+
+    handler.queue_warm_start()
+    wait_for(lambda: handler.background_queue.completed == 20)
+    for filename in filenames:
+        assert cached(handler.file_cache, filename)[1] != ''
+    assert 'Warm start: done, checked 20 files' in capsys.readouterr().out  # type: ignore
+    server.stop()
+
+
+def test_background_task_yields_to_cycle():
+    # type: () -> None
+    class BlockingAgent(FakeAgent):
+        block = True
+
+    handler, server = start_coordinator()
+    background_file = os.path.join(ROOT_DIR, 'background.py')
+    handler.dep_graph = FakeGraph([background_file])
+    start_agent(server, 'agent', BlockingAgent)
+    wait_for(lambda: len(handler.worker_pool) == 1)
+    worker = handler.worker_pool[0]
+
+    handler.queue_warm_start()
+    wait_for(lambda: worker.current_task is not None)
+    assert worker.current_task_is_background
+
+    # Starting a cycle interrupts the background task and puts it back.
+    foreground_file = os.path.join(ROOT_DIR, 'edited.py')
+    handler.task_cond.acquire()
+    handler._add_task(MypyTask(foreground_file))
+    handler._enable_workers()
+    handler.task_cond.release()
+    wait_for(lambda: worker.current_task is not None and not worker.current_task_is_background)
+    assert handler.background_queue.tasks == [MypyTask(background_file)]
+    server.stop()
+
+
+def test_requested_checks_jump_the_queue():
+    # type: () -> None
+    handler, server = start_coordinator()
+    handler.queueing_handler.should_check_file.side_effect = lambda path: not path.endswith('.txt')  # type: ignore
+    filenames = [os.path.join(ROOT_DIR, 'mod{}.py'.format(i)) for i in range(3)]
+    handler.dep_graph = FakeGraph(filenames)
+    handler.queue_warm_start()
+
+    requested = [os.path.join(ROOT_DIR, 'mod2.py'), os.path.join(ROOT_DIR, 'editing.py'),
+                 os.path.join(ROOT_DIR, 'notes.txt')]
+    assert handler.request_checks(requested) == set(requested[:2])
+    assert handler.background_queue.tasks == [MypyTask(f) for f in requested[:2] + filenames[:2]]
+
+    start_agent(server, 'agent')
+    wait_for(lambda: handler.background_queue.completed == 4)
+    assert cached(handler.file_cache, requested[1])[1] != ''
+    server.stop()
+
+
+def test_newer_buffers_replace_queued_ones():
+    # type: () -> None
+    handler, server = start_coordinator()
+    handler.queueing_handler.should_check_file.side_effect = lambda path: path.endswith('.py')  # type: ignore
+    start_agent(server, 'agent')
+    wait_for(lambda: len(handler.worker_pool) == 1)
+
+    filename = os.path.join(ROOT_DIR, 'a.py')
+    assert handler.request_buffer_check(BufferTask(filename, 'x = 1\n'))
+    assert handler.request_buffer_check(BufferTask(filename, 'x = 2\n'))
+    assert not handler.request_buffer_check(BufferTask(os.path.join(ROOT_DIR, 'notes.txt'), ''))
+    # Agents don't have the buffers, so they leave them for local workers.
+    assert [task.contents for task in handler.buffer_tasks] == ['x = 2\n']
+    server.stop()
+
+
+def test_config_reload(tmpdir, monkeypatch):
+    # type: (Any, Any) -> None
+    monkeypatch.setattr(Toolchain, 'resolve', classmethod(lambda cls: cls('mypy', 'python')))
+    monkeypatch.setattr(mypy_toolchain, '_profiles', None)
+    original_config = dict(config)
+    root = str(tmpdir)
+
+    def write_config(src_dirs):
+        # type: (List[Dict[str, Any]]) -> None
+        with open(os.path.join(root, '.mypy_server'), 'w') as f:
+            json.dump({'src_dirs': src_dirs, 'global_flags': ['--py2'], 'port': 1}, f)
+
+    for name in ('a', 'b', 'c'):
+        os.mkdir(os.path.join(root, name))
+        with open(os.path.join(root, name, 'mod_{}.py'.format(name)), 'w') as f:
+            f.write('import os\n')
+
+    try:
+        write_config([{'path': 'a/'}, {'path': 'b/'}])
+        load_config_file(root_dir=root)
+        load_profiles(config)
+        graph = ModuleGraph()
+        for src_dir in get_src_dirs():
+            graph.parsePathname(src_dir)
+
+        handler, server = start_coordinator()
+        handler.dep_graph = graph
+        handler.queueing_handler.src_dirs = get_src_dirs()
+        for name in ('a', 'b'):
+            handler.file_cache.store(os.path.join(root, name, 'mod_{}.py'.format(name)), 'hash', '')
+
+        write_config([{'path': 'a/', 'strict_optional': True}, {'path': 'c/'}])
+        handler.on_config_changed()
+
+        assert sorted(graph.modules) == ['mod_a', 'mod_c']
+        assert handler.queueing_handler.src_dirs == [os.path.join(root, 'a/'), os.path.join(root, 'c/')]
+        # a's flags changed, b's didn't.
+        assert [entry[2] for entry in handler.file_cache._cache.values()] == [os.path.join(root, 'b', 'mod_b.py')]
+        server.stop()
+    finally:
+        config.clear()
+        config.update(original_config)
+
+
+def test_dependency_fingerprint_shared_between_checkouts(tmpdir):
+    # type: (Any) -> None
+    fingerprints = []
+    for checkout in ('alice', 'bob'):
+        root = str(tmpdir.mkdir(checkout))
+        for name, source in (('a.py', 'import b\n'), ('b.py', 'import c\n'), ('c.py', 'x = 1\n')):
+            with open(os.path.join(root, name), 'w') as f:
+                f.write(source)
+        graph = ModuleGraph()
+        graph.parsePathname(root)
+        file_cache = MypyFileCache(remote=RemoteCacheClient('http://127.0.0.1:1', root))
+        handler = MypyEventHandler(graph, Mock(), file_cache, True, 0)
+        task = MypyTask(os.path.join(root, 'a.py'))
+        handler._fingerprint_tasks([task])
+        fingerprints.append(task.dependency_fingerprint)
+    assert fingerprints[0] != ''
+    assert fingerprints[0] == fingerprints[1]
@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import pytest
+from typing import Any  # noqa
+
+from mypytools.server import mypy_fingerprints
+from mypytools.server.mypy_fingerprints import FingerprintCache
+
+
+def test_unchanged_files_are_not_read_again(tmpdir, monkeypatch):
+    # type: (Any, Any) -> None
+    path = tmpdir.join('a.py')
+    path.write('a = 1\n')
+    os.utime(str(path), (1000000000, 1000000000))
+    cache = FingerprintCache(racy_window=0)
+    content_hash = cache.get(str(path))
+
+    def fail(*args):
+        # type: (*Any) -> None
+        raise AssertionError('read again')
+    monkeypatch.setattr(mypy_fingerprints, 'open', fail, raising=False)
+    assert cache.get(str(path)) == content_hash
+    monkeypatch.undo()
+
+    # Changes the watcher reports, and ones it misses, are both picked up.
+    cache.invalidate(str(path))
+    assert cache.get(str(path)) == content_hash
+    path.write('a = 22\n')
+    os.utime(str(path), (1000000001, 1000000001))
+    assert cache.get(str(path)) != content_hash
+
+    path.remove()
+    with pytest.raises(OSError):
+        cache.get(str(path))
+
+
+def test_recently_modified_files_are_not_kept(tmpdir):
+    # type: (Any) -> None
+    path = tmpdir.join('a.py')
+    path.write('a = 1\n')
+    cache = FingerprintCache(racy_window=60)
+    first = cache.get(str(path))
+
+    # Rewritten within the same mtime tick with the same size.
+    stat = os.stat(str(path))
+    path.write('a = 2\n')
+    os.utime(str(path), (stat.st_atime, stat.st_mtime))
+    assert cache.get(str(path)) != first
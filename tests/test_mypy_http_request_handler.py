@@ -1,5 +1,9 @@
+import hashlib
+import os
+import socket
 import sys
 
+import pytest
 from typing import Any, Type, Tuple, Union
 
 try:
@@ -12,7 +16,9 @@ if sys.version_info[0] > 2:
 else:
     from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 
-from mypytools.server.mypy_http_request_handler import MypyHttpRequestHandler
+from mypytools.server.mypy_diagnostics import Diagnostic
+from mypytools.server.mypy_http_client import MypyServerClient
+from mypytools.server.mypy_http_request_handler import HTTP_SOCKET_FILENAME, HttpServerThread, MypyHttpRequestHandler
 
 try:
     # Python 2.x
@@ -71,9 +77,11 @@ class MockRequest(object):
 
 
 class MockServer(object):
-    def __init__(self, ip_port, handler_cls, file_cache, path):
-        # type: (Tuple[str, int], Type[BaseHTTPRequestHandler], Any, str) -> None
+    def __init__(self, ip_port, handler_cls, file_cache, path, **attrs):
+        # type: (Tuple[str, int], Type[BaseHTTPRequestHandler], Any, str, **Any) -> None
         self.file_cache = file_cache
+        for name, value in attrs.items():
+            setattr(self, name, value)
         self.active_request = MockRequest(path)
         handler = handler_cls(self.active_request, ip_port, self)   # type: ignore
 
@@ -90,3 +98,113 @@ def test_http_request_handler():
     for path, expected in paths:
         server = MockServer(('0.0.0.0', 8888), MypyHttpRequestHandler, file_cache, path)
         assert expected == server.active_request.body.copy.getvalue()
+
+
+def test_v1_diagnostics():
+    # type: () -> None
+    file_cache = Mock()
+    file_cache.lookup_diagnostics.side_effect = [None, None, (Diagnostic('a.py', 2, None, 'error', None, 'Oops'),)]
+    file_cache.lookup_status.side_effect = [None, 'timed_out']
+    paths = [
+        ('/v1/file/f00/ba12', b''),
+        ('/v1/file/f00/ba12', b'{"status": "timed_out"}'),
+        ('/v1/file/f00/ba12ba2', b'[{"path": "a.py", "line": 2, "column": null, '
+                                 b'"severity": "error", "code": null, "message": "Oops"}]'),
+    ]
+    for path, expected in paths:
+        server = MockServer(('0.0.0.0', 8888), MypyHttpRequestHandler, file_cache, path)
+        assert expected == server.active_request.body.copy.getvalue()
+
+
+def test_path_diagnostics(tmpdir):
+    # type: (Any) -> None
+    path = tmpdir.join('a.py')
+    path.write('a = 1\n')
+    content_hash = hashlib.md5(b'a = 1\n').hexdigest()
+    name_hash = hashlib.md5(str(path).encode('utf-8')).hexdigest()
+    file_cache = Mock()
+    file_cache.lookup_status.side_effect = [None, 'timed_out', 'done']
+    file_cache.lookup_diagnostics.return_value = (Diagnostic(str(path), 2, None, 'error', None, 'Oops'),)
+    paths = [
+        ('/v1/path', b'{"error": '),
+        ('/v1/path?path=/etc/passwd', b'{"error": '),
+        ('/v1/path?path=' + str(tmpdir.join('..', 'x.py')), b'{"error": '),
+        ('/v1/path?path=' + str(tmpdir.join('missing.py')), b'"hash": null}'),
+        ('/v1/path?path=' + str(path), '"hash": "{}"}}'.format(content_hash).encode('ascii')),
+        ('/v1/path?path=' + str(path), '"hash": "{}", "status": "timed_out"}}'.format(content_hash).encode('ascii')),
+        ('/v1/path?path=' + str(path), '"hash": "{}", "diagnostics": [{{"path": "{}", "line": 2, '
+                                       '"column": null, "severity": "error", "code": null, "message": "Oops"}}]}}'
+                                       .format(content_hash, path).encode('ascii')),
+    ]
+    for request_path, expected in paths:
+        server = MockServer(('0.0.0.0', 8888), MypyHttpRequestHandler, file_cache, request_path,
+                            root_dir=str(tmpdir))
+        assert expected in server.active_request.body.copy.getvalue()
+    file_cache.lookup_diagnostics.assert_called_with(name_hash, content_hash)
+
+
+def test_annotations():
+    # type: () -> None
+    annotation_index = Mock()
+    annotation_index.check.return_value = [('/src/a.py', 3)]
+    paths = [
+        ('/annotations', b'{"error": "Expected a single rev"}'),
+        ('/annotations?rev=--output=x', b'{"error": "Expected a single rev"}'),
+        ('/annotations?rev=master', b'[{"path": "/src/a.py", "line": 3}]'),
+    ]
+    for path, expected in paths:
+        server = MockServer(('0.0.0.0', 8888), MypyHttpRequestHandler, Mock(), path,
+                            annotation_index=annotation_index, root_dir='/src')
+        assert server.active_request.body.copy.getvalue().endswith(expected)
+    annotation_index.check.assert_called_once_with('master', cwd='/src')
+
+
+def test_unix_socket_with_tcp_fallback(tmpdir):
+    # type: (Any) -> None
+    file_cache = Mock()
+    file_cache.lookup.return_value = 'Error on line 2'
+    socket_path = os.path.join(str(tmpdir), HTTP_SOCKET_FILENAME)
+    threads = [HttpServerThread(file_cache, address=socket_path, root_dir=str(tmpdir)),
+               HttpServerThread(file_cache, address=('127.0.0.1', 0), root_dir=str(tmpdir))]
+    for thread in threads:
+        thread.start()
+        thread.ready.wait()
+    unix_thread, tcp_thread = threads
+    try:
+        expected = (200, b'{"output": "Error on line 2"}')
+        assert MypyServerClient(str(tmpdir), port=None).get('/file/f00/ba12') == expected
+
+        # Once the socket's gone, or stale, requests go over TCP.
+        unix_thread.stop()
+        assert not os.path.exists(socket_path)
+        with pytest.raises(socket.error):
+            MypyServerClient(str(tmpdir), port=None).get('/file/f00/ba12')
+        open(socket_path, 'w').close()
+        assert MypyServerClient(str(tmpdir), port=tcp_thread.server_address[1]).get('/file/f00/ba12') == expected
+    finally:
+        tcp_thread.stop()
+
+
+def test_running_server_keeps_its_socket(tmpdir, capsys):
+    # type: (Any, Any) -> None
+    file_cache = Mock()
+    file_cache.lookup.return_value = 'Error on line 2'
+    socket_path = os.path.join(str(tmpdir), HTTP_SOCKET_FILENAME)
+    # A socket left behind by a server that was killed.
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()
+
+    first = HttpServerThread(file_cache, address=socket_path, root_dir=str(tmpdir))
+    first.start()
+    first.ready.wait()
+    try:
+        assert first.server_address == socket_path
+        second = HttpServerThread(file_cache, address=socket_path, root_dir=str(tmpdir))
+        second.start()
+        second.ready.wait()
+        assert second.server_address is None
+        assert 'already running' in capsys.readouterr().out
+        assert MypyServerClient(str(tmpdir), port=None).get('/file/f00/ba12')[0] == 200
+    finally:
+        first.stop()
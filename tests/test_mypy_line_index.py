@@ -0,0 +1,62 @@
+import os
+import time
+
+from mypytools.server.mypy_diagnostics import Diagnostic
+from mypytools.server.mypy_line_index import LineIndex, LineIndexCache
+from mypytools.server.mypy_task import MypyTask
+
+
+def _write(path, contents):
+    # type: (str, str) -> None
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+def test_line_index(tmpdir):
+    # type: (...) -> None
+    path = str(tmpdir.join('a.py'))
+    _write(path, 'one\ntwo\r\n\nfour')
+    index = LineIndex.build(path)
+    assert index.num_lines == 4
+    assert [index.line(n) for n in range(1, 5)] == ['one', 'two', '', 'four']
+    assert index.line(0) == ''
+    assert index.line(5) == ''
+
+
+def test_line_index_cache_rebuilds_on_change(tmpdir):
+    # type: (...) -> None
+    path = str(tmpdir.join('a.py'))
+    _write(path, 'one\n')
+    cache = LineIndexCache(max_entries=1)
+    index = cache.get(path)
+    assert cache.get(path) is index
+    assert cache.get(path, index.content_hash) is index
+
+    # A stale hash forces a rebuild even if the stat looks the same.
+    assert cache.get(path, 'stale') is not index
+    # Replaced indexes still work for whoever is using them.
+    assert index.line(1) == 'one'
+
+    _write(path, 'one\ntwo\n')
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    assert cache.get(path).line(2) == 'two'
+
+
+def test_context_does_not_accumulate(tmpdir):
+    # type: (...) -> None
+    path = str(tmpdir.join('a.py'))
+    _write(path, ''.join('line{}\n'.format(n) for n in range(1, 11)))
+    task = MypyTask(path)
+    context = task._get_context_for_path(path, [(2, 'first'), (8, 'second')])
+    assert len(context) == 2
+    assert '1 line1' in context[0] and '4 line4' in context[0]
+    assert '6 line6' in context[1] and '10 line10' in context[1]
+    # The second error only shows the lines around it.
+    assert 'line1\n' not in context[1] and 'line3' not in context[1]
+
+
+def test_context_skips_missing_files(tmpdir):
+    # type: (...) -> None
+    task = MypyTask(str(tmpdir.join('a.py')))
+    diagnostic = Diagnostic(str(tmpdir.join('gone.py')), 1, None, 'error', None, 'oops')
+    assert task._find_context([diagnostic]) == ''
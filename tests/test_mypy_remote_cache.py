@@ -0,0 +1,76 @@
+import socket
+import time
+from threading import Thread
+
+from typing import Tuple  # noqa
+
+from mypytools.server.mypy_cache_server import ResultStore, ThreadedHTTPServer, make_cache_server
+from mypytools.server.mypy_remote_cache import RemoteCacheClient, remote_cache_key
+
+
+def start_cache_server():
+    # type: () -> Tuple[str, ThreadedHTTPServer]
+    httpd = make_cache_server('127.0.0.1', 0, max_entries=10)
+    thread = Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'http://127.0.0.1:{}'.format(httpd.server_address[1]), httpd
+
+
+def test_key_depends_on_everything():
+    # type: () -> None
+    key = remote_cache_key('a.py', 'abc', 'deps', ['--py2', '--strict-optional'], 'mypy 0.600')
+    assert key == remote_cache_key('a.py', 'abc', 'deps', ['--strict-optional', '--py2'], 'mypy 0.600')
+    assert key != remote_cache_key('a.py', 'abd', 'deps', ['--py2', '--strict-optional'], 'mypy 0.600')
+    assert key != remote_cache_key('a.py', 'abc', 'deps2', ['--py2', '--strict-optional'], 'mypy 0.600')
+    assert key != remote_cache_key('a.py', 'abc', 'deps', ['--py2'], 'mypy 0.600')
+    # Files with the same contents, like empty __init__.py files.
+    assert key != remote_cache_key('b.py', 'abc', 'deps', ['--py2', '--strict-optional'], 'mypy 0.600')
+    assert key != remote_cache_key('a.py', 'abc', 'deps', ['--py2', '--strict-optional'], 'mypy 0.610')
+
+
+def test_result_store_evicts_oldest():
+    # type: () -> None
+    store = ResultStore(max_entries=2)
+    store.put('a', b'1')
+    store.put('b', b'2')
+    store.get('a')
+    store.put('c', b'3')
+    assert store.get('b') is None
+    assert store.get('a') == b'1'
+    assert len(store) == 2
+
+
+def test_results_shared_between_checkouts():
+    # type: () -> None
+    url, httpd = start_cache_server()
+    alice = RemoteCacheClient(url, '/home/alice/project')
+    bob = RemoteCacheClient(url, '/home/bob/project')
+    alice.start()
+
+    assert bob.lookup('/home/bob/project/a.py', 'hash', 'deps', ['--py2'], 'mypy 0.600') is None
+    alice.store('/home/alice/project/a.py', 'hash', 'deps', ['--py2'], 'mypy 0.600', 1,
+                '/home/alice/project/a.py:1: error: oops\n')
+    alice.flush()
+    assert bob.lookup('/home/bob/project/a.py', 'hash', 'deps', ['--py2'], 'mypy 0.600') == (
+        1, '/home/bob/project/a.py:1: error: oops\n')
+    assert bob.lookup('/home/bob/project/a.py', 'hash', 'other-deps', ['--py2'], 'mypy 0.600') is None
+    assert bob.lookup('/home/bob/project/b.py', 'hash', 'deps', ['--py2'], 'mypy 0.600') is None
+    httpd.shutdown()
+
+
+def test_slow_cache_is_skipped():
+    # type: () -> None
+    # A listening socket that never answers.
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(1)
+    client = RemoteCacheClient('http://127.0.0.1:{}'.format(sock.getsockname()[1]), '/', timeout=0.1)
+
+    start = time.time()
+    assert client.lookup('/a.py', 'hash', 'deps', [], 'mypy 0.600') is None
+    assert client.lookup('/a.py', 'hash', 'deps', [], 'mypy 0.600') is None
+    # Only the first lookup should have waited for the timeout.
+    assert time.time() - start < 1.0
+    assert not client._available()
+    sock.close()
@@ -0,0 +1,64 @@
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock   # type: ignore
+
+from typing import Any  # noqa
+
+from mypytools.server.mypy_resource_monitor import ResourceMonitor, process_rss_mb
+
+
+def make_monitor(**kwargs):
+    # type: (**Any) -> ResourceMonitor
+    monitor = ResourceMonitor(Mock(), max_workers=8, **kwargs)
+    monitor.cpu_count = 8
+    monitor.task_mb = 1000
+    monitor.min_free_mb = 1000
+    return monitor
+
+
+def test_grows_while_there_is_room():
+    # type: () -> None
+    # Plenty of memory, CPU limits us to 8 - 2.5 = 5 more.
+    assert make_monitor().compute_target(1, 64000, 2.5) == 6
+    # Memory for two more mypy processes.
+    assert make_monitor().compute_target(1, 3500, 0.0) == 3
+    # Never more than the maximum.
+    assert make_monitor().compute_target(4, None, 0.0) == 8
+
+
+def test_new_workers_count_until_the_load_average_catches_up():
+    # type: () -> None
+    monitor = make_monitor()
+    current = 1
+    for now in range(10):
+        current = monitor.compute_target(current, 64000, 2.5, now=now)
+    assert current == 6
+    # Once the readings have had time to include them, the same readings
+    # mean there's room for more.
+    assert monitor.compute_target(current, 64000, 2.5, now=100) == 8
+
+
+def test_backs_off_under_pressure():
+    # type: () -> None
+    monitor = make_monitor()
+    assert monitor.compute_target(4, 500, 0.0) == 3
+    assert monitor.compute_target(4, 64000, 13.0) == 3
+    assert monitor.compute_target(1, 500, 13.0) == 1
+
+
+def test_memory_budget_kills_biggest_task():
+    # type: () -> None
+    monitor = make_monitor(memory_budget_mb=2500)
+    small, big = Mock(), Mock()
+    assert monitor.enforce_memory_budget([(1000, small), (1200, big)]) is None
+    assert monitor.enforce_memory_budget([(1000, small), (1800, big)]) is big
+    big.interrupt_current_task.assert_called_once_with()
+    assert not small.interrupt_current_task.called
+    # A single task over budget is left alone.
+    assert monitor.enforce_memory_budget([(3000, big)]) is None
+
+
+def test_process_rss_of_missing_process():
+    # type: () -> None
+    assert process_rss_mb(-1) is None
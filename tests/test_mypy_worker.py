@@ -0,0 +1,192 @@
+import hashlib
+import os
+import sys
+import time
+from threading import Condition
+
+from typing import Any, List, Tuple  # noqa
+
+from mypytools.server import mypy_task, mypy_worker
+from mypytools.server.mypy_diagnostics import Diagnostic
+from mypytools.server.mypy_file_cache import MypyFileCache
+from mypytools.server.mypy_task import BufferTask, MypyTask
+from mypytools.server.mypy_toolchain import CommandProfile
+from mypytools.server.mypy_worker import MypyWorker
+from tests.mypy_server_helpers import cached
+
+
+class FakeProfiles(object):
+    def __init__(self, flags):
+        # type: (Any) -> None
+        self.flags = flags
+
+    def profile_for(self, filename):
+        # type: (str) -> CommandProfile
+        flags = self.flags.get(os.path.basename(filename), ())
+        return CommandProfile('/', flags, ('mypy',) + flags, ())
+
+
+class OutputTask(MypyTask):
+    def __init__(self, filename, output):
+        # type: (str, str) -> None
+        super(OutputTask, self).__init__(filename, include_error_context=False)
+        self.output = output
+
+    def execute(self):
+        # type: () -> Tuple[int, str, str, str, str]
+        return 1, self.output, '', '', self._get_file_hash()
+
+
+def _make_files(tmpdir, names):
+    # type: (Any, List[str]) -> List[str]
+    paths = []
+    for name in names:
+        path = str(tmpdir.join(name))
+        with open(path, 'w') as f:
+            f.write('x = 1\n')
+        # Make sure the files look older than the run.
+        os.utime(path, (time.time() - 10, time.time() - 10))
+        paths.append(path)
+    return paths
+
+
+def _run(task, task_pool, file_cache):
+    # type: (MypyTask, List[MypyTask], MypyFileCache) -> None
+    task_pool.insert(0, task)
+    worker = MypyWorker(task_pool, Condition(), file_cache, compact=True)
+    worker.run_tasks = True
+    worker._run_next_task()
+
+
+def test_errors_credited_to_other_files(tmpdir, monkeypatch, capsys):
+    # type: (Any, Any, Any) -> None
+    a, b, c = _make_files(tmpdir, ['a.py', 'b.py', 'c.py'])
+    monkeypatch.setattr(mypy_worker, 'get_profiles', lambda: FakeProfiles({}))
+    output = ('{}:1: error: in a\n{}:3: note: "f" defined here\n{}:1: error: in b\n{}:2: note: also b\n'
+              .format(a, b, b, b))
+    task_pool = [MypyTask(b), MypyTask(c)]
+    file_cache = MypyFileCache()
+
+    _run(OutputTask(a, output), task_pool, file_cache)
+    assert cached(file_cache, a)[1] == output
+    # The note about a's error isn't part of b's result.
+    assert cached(file_cache, b)[1] == '{}:1: error: in b\n{}:2: note: also b\n'.format(b, b)
+    assert [d.message for d in cached(file_cache, b)[3]] == ['in b', 'also b']
+    # b's queued run was subsumed, c's wasn't.
+    assert task_pool == [MypyTask(c)]
+    capsys.readouterr()
+
+
+def test_errors_not_credited_across_commands_or_changes(tmpdir, monkeypatch, capsys):
+    # type: (Any, Any, Any) -> None
+    a, b, c = _make_files(tmpdir, ['a.py', 'b.py', 'c.py'])
+    monkeypatch.setattr(mypy_worker, 'get_profiles', lambda: FakeProfiles({'b.py': ('--strict',)}))
+    # c changes after the run starts.
+    os.utime(c, (time.time() + 10, time.time() + 10))
+    output = '{}:1: error: in a\n{}:1: error: in b\n{}:1: error: in c\n'.format(a, b, c)
+    task_pool = [MypyTask(b), MypyTask(c)]
+    file_cache = MypyFileCache()
+
+    _run(OutputTask(a, output), task_pool, file_cache)
+    # Only a's own result is cached.
+    assert len(file_cache._cache) == 1
+    assert task_pool == [MypyTask(b), MypyTask(c)]
+    capsys.readouterr()
+
+
+def test_errors_not_credited_without_following_imports(tmpdir, monkeypatch, capsys):
+    # type: (Any, Any, Any) -> None
+    a, b = _make_files(tmpdir, ['a.py', 'b.py'])
+    flags = ('--follow-imports=silent',)
+    monkeypatch.setattr(mypy_worker, 'get_profiles', lambda: FakeProfiles({'a.py': flags, 'b.py': flags}))
+    # b's own errors are hidden, only the note about a's error is printed.
+    output = '{}:1: error: in a\n{}:3: note: "f" defined here\n'.format(a, b)
+    task_pool = [MypyTask(b)]
+    file_cache = MypyFileCache()
+
+    _run(OutputTask(a, output), task_pool, file_cache)
+    assert len(file_cache._cache) == 1
+    assert task_pool == [MypyTask(b)]
+    capsys.readouterr()
+
+
+def test_follows_imports():
+    # type: () -> None
+    def follows_imports(*flags):
+        # type: (*str) -> bool
+        return CommandProfile('/', flags, ('mypy',) + flags, ()).follows_imports
+
+    assert follows_imports('--py2')
+    assert follows_imports('--follow-imports=normal')
+    assert not follows_imports('--follow-imports=silent')
+    assert not follows_imports('--follow-imports', 'skip')
+    assert follows_imports('--follow-imports=silent', '--follow-imports=normal')
+    assert not follows_imports('--silent-imports')
+
+
+def _use_script(monkeypatch, script, **config):
+    # type: (Any, str, **Any) -> None
+    """ Runs the python script instead of mypy, with the config settings. """
+    profile = CommandProfile('/', (), (sys.executable, '-c', script), (('PATH', os.environ.get('PATH', '')),))
+
+    class Profiles(object):
+        def profile_for(self, filename):
+            # type: (str) -> CommandProfile
+            return profile
+    monkeypatch.setattr(mypy_task, 'get_profiles', Profiles)
+    monkeypatch.setattr(mypy_task, 'get_config', lambda: config)
+
+
+def test_buffer_checked_in_place_of_file(tmpdir, monkeypatch):
+    # type: (Any, Any) -> None
+    a, = _make_files(tmpdir, ['a.py'])
+    # Reports the shadow file's contents as an error in the file it shadows.
+    _use_script(monkeypatch, 'import sys; print("%s:1: error: %s" % (sys.argv[4], open(sys.argv[3]).read().strip()))')
+
+    file_cache = MypyFileCache()
+    buffer_tasks = [BufferTask(a, 'y = 2\n')]
+    worker = MypyWorker([MypyTask(a)], Condition(), file_cache, compact=True, buffer_tasks=buffer_tasks)
+    # Buffers are checked even between cycles, ahead of anything else.
+    worker._run_next_task()
+    assert buffer_tasks == []
+    assert file_cache.lookup_buffer_diagnostics(a, hashlib.md5(b'y = 2\n').hexdigest()) == (
+        Diagnostic(a, 1, None, 'error', None, 'y = 2'),)
+    assert file_cache._cache == {}
+
+    # A buffer matching the saved file uses the file's result.
+    file_cache.store(a, hashlib.md5(b'x = 1\n').hexdigest(), '', ())
+    assert file_cache.lookup_buffer_diagnostics(a, hashlib.md5(b'x = 1\n').hexdigest()) == ()
+    file_cache.clear_buffers()
+    assert file_cache.lookup_buffer_diagnostics(a, hashlib.md5(b'y = 2\n').hexdigest()) is None
+
+
+def test_runaway_task_times_out(tmpdir, monkeypatch, capsys):
+    # type: (Any, Any, Any) -> None
+    a, = _make_files(tmpdir, ['a.py'])
+    _use_script(monkeypatch, 'import time; time.sleep(30)', task_timeout=0.2)
+    file_cache = MypyFileCache()
+    task_pool = []  # type: List[MypyTask]
+
+    started_at = time.time()
+    _run(MypyTask(a), task_pool, file_cache)
+    assert time.time() - started_at < 10
+    file_hash = hashlib.md5(b'x = 1\n').hexdigest()
+    assert file_cache.lookup_status(hashlib.md5(a.encode('utf-8')).hexdigest(), file_hash) == 'timed_out'
+    assert file_cache.lookup(hashlib.md5(a.encode('utf-8')).hexdigest(), file_hash) is None
+    # It isn't tried again until the file changes.
+    assert task_pool == []
+    assert 'Timed out checking {}'.format(a) in capsys.readouterr().out
+
+
+def test_reruns_of_changing_files_are_bounded(tmpdir, monkeypatch, capsys):
+    # type: (Any, Any, Any) -> None
+    a, = _make_files(tmpdir, ['a.py'])
+    # Every run changes the file, like a generator rewriting it.
+    _use_script(monkeypatch, 'import sys; open(sys.argv[-1], "a").write("#\\n")', max_reruns=2)
+    monkeypatch.setattr(mypy_task, 'RERUN_BACKOFF', 0.01)
+
+    exit_code = MypyTask(a).execute()[0]
+    assert exit_code == 0
+    with open(a) as f:
+        assert f.read() == 'x = 1\n#\n#\n#\n'
+    assert 'kept changing, giving up after 3 runs' in capsys.readouterr().out
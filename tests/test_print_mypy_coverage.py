@@ -2,9 +2,19 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from typing import List, Tuple  # noqa
+import io
+import json
+import os
+import sys
 
-from bin.print_mypy_coverage import process_source, SourceObj
+from typing import Any, List, Optional, Tuple  # noqa
+
+from bin import print_mypy_coverage
+from bin.print_mypy_coverage import (
+    add_new_leaf_node, compare_to_baseline, flatten_json, process_source, scan_files, scan_files_cached, write_csv,
+    SourceObj)
+from mypytools.coverage_cache import CoverageCache
+from mypytools.source_cache import SourceCache
 
 
 def process_files(files):
@@ -12,6 +22,7 @@ def process_files(files):
     root = SourceObj('root')
     for source, path in files:
         process_source(root, path, source)
+    root.aggregate()
     output_lines = []   # type: List[str]
     root.sorted_output(0, output_lines, max_depth=None)
     return output_lines
@@ -49,3 +60,182 @@ def bar():
         '        b.py: 1/1 (100.00%)',
         '        a.py: 0/1 (0.00%)'
     ]
+
+
+def test_scan_files_and_aggregate(tmpdir):
+    # type: (Any) -> None
+    sources = {
+        'pkg/a.py': 'def a():\n    # type: () -> None\n    pass\n',
+        'pkg/sub/b.py': 'def b():\n    pass\n\ndef c(x: int) -> int:\n    return x\n',
+        'pkg/sub/deeper/c.py': 'x = 1\n',
+    }
+    paths = []
+    for name, source in sources.items():
+        path = tmpdir.join(name)
+        path.write(source, ensure=True)
+        paths.append(str(path))
+
+    for jobs in (1, 2):
+        root = SourceObj('root')
+        for path, num_annotated_funcs, num_scanned_funcs in scan_files(sorted(paths), jobs):
+            add_new_leaf_node(root, os.path.relpath(path, str(tmpdir)), num_annotated_funcs, num_scanned_funcs)
+        root.aggregate()
+        output_lines = []   # type: List[str]
+        root.sorted_output(0, output_lines)
+        assert output_lines == [
+            'root: 2/3 (66.67%)',
+            '    pkg: 2/3 (66.67%)',
+            '        a.py: 1/1 (100.00%)',
+            '        sub: 1/2 (50.00%)',
+            '            b.py: 1/2 (50.00%)',
+            '            deeper: 0/0 (0.00%)',
+            '                c.py: 0/0 (0.00%)',
+        ]
+
+
+def test_scan_files_cached(tmpdir, monkeypatch):
+    # type: (Any, Any) -> None
+    from bin import print_mypy_coverage
+
+    scanned = []    # type: List[str]
+    real_index_files = print_mypy_coverage.index_files
+
+    def recording_index_files(paths, jobs=None):
+        # type: (List[str], Any) -> Any
+        scanned.extend(paths)
+        return real_index_files(paths, 1)
+    monkeypatch.setattr(print_mypy_coverage, 'index_files', recording_index_files)
+
+    a = tmpdir.join('a.py')
+    b = tmpdir.join('b.py')
+    a.write('def a():\n    pass\n')
+    b.write('def b():\n    # type: () -> None\n    pass\n')
+    for path in (a, b):
+        path.setmtime(1000)
+    cache_path = str(tmpdir.join('cache'))
+
+    def run(version='1', source_cache=None):
+        # type: (str, Optional[SourceCache]) -> List[Tuple[str, int, int]]
+        del scanned[:]
+        cache = CoverageCache.load(cache_path, version)
+        results = sorted(scan_files_cached([str(a), str(b)], cache, source_cache=source_cache))
+        cache.save()
+        return results
+
+    expected = [(str(a), 0, 1), (str(b), 1, 1)]
+    assert run() == expected
+    assert scanned == [str(a), str(b)]
+
+    # Nothing changed.
+    assert run() == expected
+    assert scanned == []
+
+    # Touched but the same contents, so only hashed.
+    a.setmtime(2000)
+    assert run() == expected
+    assert scanned == []
+
+    b.write('def b():\n    pass\n')
+    b.setmtime(1000)
+    assert run() == [(str(a), 0, 1), (str(b), 0, 1)]
+    assert scanned == [str(b)]
+
+    # A new version throws everything away.
+    source_cache = SourceCache()
+    run(version='2', source_cache=source_cache)
+    assert scanned == [str(a), str(b)]
+
+    # Unless the files were already parsed into a shared source cache.
+    assert run(version='3', source_cache=source_cache) == [(str(a), 0, 1), (str(b), 0, 1)]
+    assert scanned == []
+
+
+def test_recently_modified_files_are_rehashed(tmpdir):
+    # type: (Any) -> None
+    cache = CoverageCache(str(tmpdir.join('cache')), '1')
+    cache.set('a.py', 1000.0, 10, 'hash', 1, 2)
+    cache.saved_at = 2000.0
+    assert cache.get('a.py', 1000.0, 10) == (1, 2)
+    assert cache.get('a.py', 1000.0, 11) is None
+    cache.saved_at = 1001.0
+    assert cache.get('a.py', 1000.0, 10) is None
+    assert cache.get_by_hash('a.py', 'hash') == (1, 2)
+
+
+def build_tree(counts):
+    # type: (List[Tuple[str, int, int]]) -> SourceObj
+    root = SourceObj('root')
+    for path, num_annotated_funcs, num_scanned_funcs in counts:
+        add_new_leaf_node(root, path, num_annotated_funcs, num_scanned_funcs)
+    root.aggregate()
+    return root
+
+
+def test_json_and_csv_output():
+    # type: () -> None
+    root = build_tree([('/src/a.py', 1, 2), ('/src/pkg/b.py', 3, 4)])
+    assert flatten_json(root.to_json()) == {
+        '': ('dir', 4, 6),
+        '/': ('dir', 4, 6),
+        '/src': ('dir', 4, 6),
+        '/src/a.py': ('file', 1, 2),
+        '/src/pkg': ('dir', 3, 4),
+        '/src/pkg/b.py': ('file', 3, 4),
+    }
+    assert 'children' not in root.to_json(max_depth=1)
+
+    out = io.StringIO() if sys.version_info[0] > 2 else io.BytesIO()  # type: Any
+    write_csv(root, out)
+    assert out.getvalue().split('\n') == [
+        'path,type,annotated,scanned,coverage',
+        ',dir,4,6,0.6667',
+        '/,dir,4,6,0.6667',
+        '/src,dir,4,6,0.6667',
+        '/src/a.py,file,1,2,0.5000',
+        '/src/pkg,dir,3,4,0.7500',
+        '/src/pkg/b.py,file,3,4,0.7500',
+        '',
+    ]
+
+
+def test_compare_to_baseline():
+    # type: () -> None
+    baseline = build_tree([('src/a.py', 1, 2), ('src/b.py', 2, 2), ('old/c.py', 1, 1)]).to_json()
+    root = build_tree([('src/a.py', 2, 2), ('src/b.py', 1, 3), ('new/d.py', 0, 1)])
+    report = compare_to_baseline(root, baseline)
+    assert [(change['path'], change['baseline_annotated'], change['annotated'])
+            for change in report['directories']] == [('', 4, 3), ('new', 0, 0), ('src', 3, 3)]
+    assert [change['path'] for change in report['dropped_files']] == ['src/b.py']
+    assert (report['baseline_files'], report['matched_files']) == (3, 2)
+
+
+def test_baseline_from_another_checkout(tmpdir, monkeypatch, capsys):
+    # type: (Any, Any, Any) -> None
+    def write_checkout(root_dir):
+        # type: (Any) -> None
+        root_dir.join('src').ensure(dir=True)
+        root_dir.join('src', 'a.py').write('def foo():\n    pass\n')
+
+    def run(root_dir, baseline=None, output_format='json'):
+        # type: (Any, Optional[str], str) -> Tuple[int, str]
+        config = {'root_dir': str(root_dir), 'src_dirs': [{'path': 'src'}]}
+        monkeypatch.setattr(print_mypy_coverage, 'get_config', lambda: config)
+        exit_code = print_mypy_coverage.print_coverage(None, 1, False, output_format, baseline)
+        return exit_code, capsys.readouterr().out
+
+    ci_checkout, local_checkout = tmpdir.join('ci'), tmpdir.join('local')
+    write_checkout(ci_checkout)
+    write_checkout(local_checkout)
+    exit_code, output = run(ci_checkout)
+    assert 'src/a.py' in flatten_json(json.loads(output))
+    baseline = tmpdir.join('baseline.json')
+    baseline.write(output)
+    assert run(local_checkout, str(baseline))[0] == 0
+
+    # Trees written with absolute paths don't match anything.
+    baseline.write(json.dumps(build_tree([(str(ci_checkout.join('src', 'a.py')), 0, 1)]).to_json()))
+    assert run(local_checkout, str(baseline))[0] == 2
+
+    # The text report keeps its absolute paths.
+    lines = [line.strip() for line in run(ci_checkout, output_format='text')[1].split('\n')]
+    assert 'ci: 0/1 (0.00%)' in lines
@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from typing import Any  # noqa
+
+from mypytools import source_cache as source_cache_module
+from mypytools.annotations import FunctionIndex
+from mypytools.source_cache import SourceCache, read_source
+
+SOURCE = """import os
+
+
+@decorator
+def outer(a):
+    # type: (int) -> None
+    def inner():
+        return a
+
+    return inner
+
+
+def unannotated(b):
+    return b
+"""
+
+
+def test_function_index():
+    # type: () -> None
+    function_index = FunctionIndex.from_source(SOURCE)
+    assert function_index.num_funcs == 3
+    assert function_index.num_annotated_funcs == 1
+    assert function_index.missing_annotations([(1, 2)]) == []
+    assert function_index.missing_annotations([(5, 8)]) == [8]
+    assert function_index.missing_annotations([(10, 14), (14, 15)]) == [14]
+    assert FunctionIndex.from_tuple(function_index.to_tuple()).to_tuple() == function_index.to_tuple()
+
+
+def test_save_and_load(tmpdir, monkeypatch):
+    # type: (Any, Any) -> None
+    path = tmpdir.join('a.py')
+    path.write_binary(SOURCE.replace('\n', '\r\n').encode('utf-8'))
+    content_hash, source = read_source(str(path))
+    assert source == SOURCE
+
+    cache_path = str(tmpdir.join('cache'))
+    cache = SourceCache(cache_path)
+    function_index = cache.parse_file(str(path))
+    assert cache.parse(content_hash, 'not parsed again') is function_index
+    cache.save()
+
+    loaded = SourceCache.load(cache_path)
+    assert len(loaded) == 1
+    loaded_index = loaded.get(content_hash)
+    assert loaded_index is not None
+    assert loaded_index.to_tuple() == function_index.to_tuple()
+
+    # Indexes built by different code are thrown away.
+    monkeypatch.setattr(source_cache_module, 'cache_version', lambda: 'other')
+    assert len(SourceCache.load(cache_path)) == 0
+    tmpdir.join('cache').write('garbage')
+    assert len(SourceCache.load(cache_path)) == 0
+
+
+def test_least_recently_used_are_dropped():
+    # type: () -> None
+    cache = SourceCache(max_entries=2)
+    cache.parse('a', 'a = 1\n')
+    cache.parse('b', 'b = 1\n')
+    assert cache.get('a') is not None
+    cache.parse('c', 'c = 1\n')
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
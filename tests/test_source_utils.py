@@ -0,0 +1,37 @@
+from mypytools.source_utils import FunctionSignature, index_signatures, parse_source
+
+
+def test_index_signatures():
+    # type: () -> None
+    source = """import os
+
+@decorator(
+    ')', arg)
+@other
+def multiline(a,
+              b=(1, 2)):
+    # type: (int, int) -> None
+    pass
+
+
+class A(object):
+    @property
+    def same_line(self):  # type: () -> int
+        return self.x @ self.y
+
+    def unannotated(self, callback=lambda x: x):
+        # not a type comment
+        pass
+
+    def python3(self, x: int) -> None:
+        pass
+"""
+    lines, tree = parse_source(source)
+    signatures = {signature.def_line: signature for signature in index_signatures(lines, tree).values()}
+    assert signatures == {
+        6: FunctionSignature(3, 6, 7, True, False),
+        14: FunctionSignature(13, 14, 14, True, False),
+        17: FunctionSignature(17, 17, 17, False, False),
+        21: FunctionSignature(21, 21, 21, False, True),
+    }
+    assert [signatures[line].is_annotated for line in sorted(signatures)] == [True, True, False, True]